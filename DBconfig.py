@@ -1,35 +1,121 @@
-import mysql.connector
-
+import configparser
 import logging
-
-# Database configuration (use environment variables for security in a production environment)
+import os
+import threading
+import time
 
 import mysql.connector
-import logging
+from mysql.connector import pooling
 
-# Database configuration (use environment variables for security in a production environment)
+from metrics import timed
+
+# Database configuration is read from AMS_DB_* environment variables, falling back to the
+# [database] section of the file named by AMS_DB_CONFIG (default: db_config.ini next to this
+# module) and finally to the defaults below. Keep real credentials out of the source tree.
 logging.basicConfig(level=logging.INFO)
 
+CONFIG_FILE = os.environ.get("AMS_DB_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_config.ini"))
+
+DEFAULT_SETTINGS = {
+    "host": "localhost",
+    "port": "3306",
+    "user": "your_username",
+    "password": "your_password",
+    "database": "db_name",
+    "auth_plugin": "mysql_native_password",
+    "pool_name": "ams_pool",
+    "pool_size": "5",
+    "connect_timeout": "10",
+    "checkout_timeout": "5",
+}
+
+_pool = None
+_checkout_timeout = float(DEFAULT_SETTINGS["checkout_timeout"])
+_pool_lock = threading.Lock()
+
+
+def load_db_settings():
+    """
+    Resolve the database settings from the environment, the config file and the defaults.
+
+    Returns:
+        dict: Setting name -> string value.
+    """
+    settings = dict(DEFAULT_SETTINGS)
+
+    parser = configparser.ConfigParser()
+    if parser.read(CONFIG_FILE) and parser.has_section("database"):
+        settings.update(parser.items("database"))
 
+    for key in DEFAULT_SETTINGS:
+        value = os.environ.get(f"AMS_DB_{key.upper()}")
+        if value is not None:
+            settings[key] = value
+
+    return settings
+
+
+def _get_pool():
+    """Create the connection pool on first use."""
+    global _pool, _checkout_timeout
+    with _pool_lock:
+        if _pool is None:
+            settings = load_db_settings()
+            _checkout_timeout = float(settings["checkout_timeout"])
+            _pool = pooling.MySQLConnectionPool(
+                pool_name=settings["pool_name"],
+                pool_size=int(settings["pool_size"]),
+                pool_reset_session=True,
+                host=settings["host"],
+                port=int(settings["port"]),
+                user=settings["user"],
+                password=settings["password"],
+                database=settings["database"],
+                auth_plugin=settings["auth_plugin"],
+                connection_timeout=int(settings["connect_timeout"]),
+            )
+            logging.info(f"Database connection pool '{settings['pool_name']}' created with {settings['pool_size']} connections.")
+        return _pool
+
+
+@timed("db.connect")
 def get_db_connection():
     """
-    Establishes a connection to the MySQL database.
+    Check a connection out of the MySQL connection pool.
+
+    The connection is health-checked (and transparently reconnected) before it is
+    handed out. Calling close() on it returns it to the pool instead of closing it.
+    If every connection is busy, waits up to `checkout_timeout` seconds for one.
 
     Returns:
-        mysql.connector.connection.MySQLConnection: A connection object if successful, 
-                                                     otherwise None.
+        mysql.connector.pooling.PooledMySQLConnection: A connection object if successful,
+                                                       otherwise None.
     """
     try:
-        mydb = mysql.connector.connect(
-            host="localhost",
-            user="your_username",
-            password="your_password", 
-            database="db_name", 
-            auth_plugin="mysql_native_password"  # Use mysql_native_password 
-        )
-        logging.info("Successfully connected to the database.")
-        return mydb
-
+        pool = _get_pool()
     except mysql.connector.Error as e:
         logging.error(f"Error connecting to the database: {e}")
         return None
+
+    deadline = time.monotonic() + _checkout_timeout
+    while True:
+        try:
+            mydb = pool.get_connection()
+            break
+        except pooling.PoolError:
+            if time.monotonic() >= deadline:
+                logging.error("Error connecting to the database: connection pool exhausted.")
+                return None
+            time.sleep(0.05)
+        except mysql.connector.Error as e:
+            logging.error(f"Error connecting to the database: {e}")
+            return None
+
+    try:
+        mydb.ping(reconnect=True, attempts=2, delay=0)
+    except mysql.connector.Error as e:
+        logging.error(f"Pooled database connection failed its health check: {e}")
+        mydb.close()
+        return None
+
+    return mydb
@@ -33,6 +33,8 @@ CREATE TABLE `attendances` (
   KEY `session_id` (`session_id`),
   KEY `enrollment_id` (`enrollment_id`),
   KEY `excuse_reason_id` (`excuse_reason_id`),
+  UNIQUE KEY `session_enrollment` (`session_id`,`enrollment_id`),
+  KEY `enrollment_session_status` (`enrollment_id`,`session_id`,`attendance_status`),
   CONSTRAINT `attendances_ibfk_1` FOREIGN KEY (`session_id`) REFERENCES `sessions` (`session_id`),
   CONSTRAINT `attendances_ibfk_2` FOREIGN KEY (`enrollment_id`) REFERENCES `students` (`enrollment_id`),
   CONSTRAINT `attendances_ibfk_3` FOREIGN KEY (`excuse_reason_id`) REFERENCES `excuse_reasons` (`excuse_reason_id`)
@@ -98,6 +100,24 @@ CREATE TABLE `excuse_reasons` (
 ) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `gallery_changes`
+--
+
+DROP TABLE IF EXISTS `gallery_changes`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `gallery_changes` (
+  `change_id` bigint NOT NULL AUTO_INCREMENT,
+  `person_type` enum('student','teacher') NOT NULL,
+  `person_id` bigint NOT NULL,
+  `operation` enum('insert','update','delete') NOT NULL,
+  `changed_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`change_id`),
+  KEY `person_type_change` (`person_type`,`change_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `sections`
 --
@@ -150,6 +170,33 @@ CREATE TABLE `semestersubjects` (
 ) ENGINE=InnoDB AUTO_INCREMENT=9 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `session_attendance_summary`
+--
+-- One row per completed session, written by close_attendance_session (attendance_reports.py)
+--
+
+DROP TABLE IF EXISTS `session_attendance_summary`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `session_attendance_summary` (
+  `session_id` int NOT NULL,
+  `available_class_id` int DEFAULT NULL,
+  `teacher_id` bigint DEFAULT NULL,
+  `session_date` date DEFAULT NULL,
+  `present_count` int NOT NULL DEFAULT '0',
+  `late_count` int NOT NULL DEFAULT '0',
+  `excused_count` int NOT NULL DEFAULT '0',
+  `absent_count` int NOT NULL DEFAULT '0',
+  `summarized_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`session_id`),
+  KEY `class_date` (`available_class_id`,`session_date`),
+  KEY `teacher_date` (`teacher_id`,`session_date`),
+  KEY `session_date` (`session_date`),
+  CONSTRAINT `session_attendance_summary_ibfk_1` FOREIGN KEY (`session_id`) REFERENCES `sessions` (`session_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `sessions`
 --
@@ -168,11 +215,38 @@ CREATE TABLE `sessions` (
   PRIMARY KEY (`session_id`),
   KEY `available_class_id` (`available_class_id`),
   KEY `teacher_id` (`teacher_id`),
+  KEY `class_status_start` (`available_class_id`,`status`,`start_time`),
+  KEY `teacher_status_start` (`teacher_id`,`status`,`start_time`),
   CONSTRAINT `sessions_ibfk_1` FOREIGN KEY (`available_class_id`) REFERENCES `availableclasses` (`available_class_id`),
   CONSTRAINT `sessions_ibfk_2` FOREIGN KEY (`teacher_id`) REFERENCES `teachers` (`teacher_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=9 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `student_class_attendance`
+--
+-- Running attendance totals of each student in each class, added to as sessions close
+--
+
+DROP TABLE IF EXISTS `student_class_attendance`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `student_class_attendance` (
+  `enrollment_id` bigint NOT NULL,
+  `available_class_id` int NOT NULL,
+  `present_count` int NOT NULL DEFAULT '0',
+  `late_count` int NOT NULL DEFAULT '0',
+  `excused_count` int NOT NULL DEFAULT '0',
+  `absent_count` int NOT NULL DEFAULT '0',
+  `last_session_id` int DEFAULT NULL,
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`enrollment_id`,`available_class_id`),
+  KEY `available_class_id` (`available_class_id`),
+  CONSTRAINT `student_class_attendance_ibfk_1` FOREIGN KEY (`enrollment_id`) REFERENCES `students` (`enrollment_id`),
+  CONSTRAINT `student_class_attendance_ibfk_2` FOREIGN KEY (`available_class_id`) REFERENCES `availableclasses` (`available_class_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `students`
 --
@@ -198,6 +272,32 @@ CREATE TABLE `students` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Triggers recording biometric changes of table `students` in `gallery_changes`
+--
+
+DELIMITER ;;
+CREATE TRIGGER `students_gallery_insert` AFTER INSERT ON `students` FOR EACH ROW
+BEGIN
+  IF NEW.biometric_data IS NOT NULL THEN
+    INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('student', NEW.enrollment_id, 'insert');
+  END IF;
+END ;;
+CREATE TRIGGER `students_gallery_update` AFTER UPDATE ON `students` FOR EACH ROW
+BEGIN
+  IF OLD.enrollment_id <> NEW.enrollment_id THEN
+    INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('student', OLD.enrollment_id, 'delete');
+    INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('student', NEW.enrollment_id, 'insert');
+  ELSEIF NOT (OLD.biometric_data <=> NEW.biometric_data) THEN
+    INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('student', NEW.enrollment_id, 'update');
+  END IF;
+END ;;
+CREATE TRIGGER `students_gallery_delete` AFTER DELETE ON `students` FOR EACH ROW
+BEGIN
+  INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('student', OLD.enrollment_id, 'delete');
+END ;;
+DELIMITER ;
+
 --
 -- Table structure for table `subjects`
 --
@@ -239,6 +339,32 @@ CREATE TABLE `teachers` (
   PRIMARY KEY (`teacher_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Triggers recording biometric changes of table `teachers` in `gallery_changes`
+--
+
+DELIMITER ;;
+CREATE TRIGGER `teachers_gallery_insert` AFTER INSERT ON `teachers` FOR EACH ROW
+BEGIN
+  IF NEW.biometric_data IS NOT NULL THEN
+    INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('teacher', NEW.teacher_id, 'insert');
+  END IF;
+END ;;
+CREATE TRIGGER `teachers_gallery_update` AFTER UPDATE ON `teachers` FOR EACH ROW
+BEGIN
+  IF OLD.teacher_id <> NEW.teacher_id THEN
+    INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('teacher', OLD.teacher_id, 'delete');
+    INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('teacher', NEW.teacher_id, 'insert');
+  ELSEIF NOT (OLD.biometric_data <=> NEW.biometric_data) THEN
+    INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('teacher', NEW.teacher_id, 'update');
+  END IF;
+END ;;
+CREATE TRIGGER `teachers_gallery_delete` AFTER DELETE ON `teachers` FOR EACH ROW
+BEGIN
+  INSERT INTO gallery_changes (person_type, person_id, operation) VALUES ('teacher', OLD.teacher_id, 'delete');
+END ;;
+DELIMITER ;
 /*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
 
 /*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
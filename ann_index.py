@@ -0,0 +1,284 @@
+
+# ______________________________________________________________IVF APPROXIMATE NEAREST-NEIGHBOUR INDEX_____________________________________________________________
+
+import copy
+import logging
+import os
+from typing import List
+
+import numpy as np
+
+from gallery import ENCODING_DIM, MatchResult, rank_candidates
+
+
+def _squared_distances(points: np.ndarray, centres: np.ndarray) -> np.ndarray:
+    """Squared Euclidean distances between every point and every centre."""
+    sq = (np.einsum('ij,ij->i', points, points)[:, None]
+          + np.einsum('ij,ij->i', centres, centres)[None, :]
+          - 2.0 * (points @ centres.T))
+    return np.maximum(sq, 0.0)
+
+
+def _nearest_centre(points: np.ndarray, centres: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """Index of the closest centre for every point, computed in memory-bounded chunks."""
+    assignment = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        assignment[start:start + len(chunk)] = np.argmin(_squared_distances(chunk, centres), axis=1)
+    return assignment
+
+
+def kmeans(points: np.ndarray, n_clusters: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """
+    Plain Lloyd's k-means used to train the coarse quantizer.
+
+    Args:
+        points (np.ndarray): Training vectors, one per row.
+        n_clusters (int): Number of centroids.
+        iterations (int): Lloyd iterations.
+        seed (int): Seed for the initial centroids and for reseeding empty clusters.
+
+    Returns:
+        np.ndarray: A (n_clusters, dim) centroid matrix.
+    """
+    rng = np.random.default_rng(seed)
+    centres = points[rng.choice(len(points), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest_centre(points, centres)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        empty = counts == 0
+
+        # Per-cluster sums via one sort + reduceat (much faster than np.add.at)
+        order = np.argsort(assignment, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[~empty]
+        sums = np.add.reduceat(points[order], starts, axis=0)
+        centres[~empty] = sums / counts[~empty, None]
+        if empty.any():
+            centres[empty] = points[rng.choice(len(points), int(empty.sum()), replace=False)]
+    return centres
+
+
+class IVFIndex:
+    """
+    Inverted-file index over face encodings with exact re-ranking.
+
+    A k-means coarse quantizer splits the gallery into `n_lists` inverted lists,
+    stored contiguously in list order. A query is compared with every centroid, the
+    `n_probe` closest lists are scanned exactly, and the candidates are ranked by their
+    true distance. Raising `n_probe` trades speed for recall (n_probe == n_lists is an
+    exact search).
+
+    Inserted encodings go to an unindexed tail that every query scans; the tail is
+    folded into the inverted lists once it reaches `merge_threshold` rows.
+
+    `watermark` is the gallery_changes position the indexed encodings reflect (None if
+    unknown), so a loaded index can catch up on the changes made after it was saved.
+    """
+
+    def __init__(self, centroids, ids, encodings, n_probe=8, merge_threshold=1024, offsets=None, watermark=None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float64)
+        self.n_probe = n_probe
+        self.merge_threshold = merge_threshold
+        self.watermark = watermark
+        self._tail_ids = []
+        self._tail_encodings = []
+
+        ids = np.asarray(ids, dtype=np.int64)
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, self.centroids.shape[1])
+        if offsets is None:
+            self._set_lists(ids, encodings)
+        else:
+            # Already stored in list order (loaded from disk)
+            self.ids = ids
+            self.matrix = np.ascontiguousarray(encodings)
+            self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+            self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def build(cls, ids, encodings, n_lists=None, n_probe=8, iterations=20, training_size=None, seed=0, watermark=None):
+        """
+        Train the coarse quantizer and index a gallery.
+
+        Args:
+            ids (array-like): Person IDs.
+            encodings (array-like): Face encodings, one per row.
+            n_lists (int, optional): Inverted lists; defaults to about 4 * sqrt(n).
+            n_probe (int): Lists scanned per query.
+            iterations (int): k-means iterations.
+            training_size (int, optional): Rows sampled to train k-means; defaults to 32 per list.
+            seed (int): Random seed.
+            watermark (int, optional): gallery_changes position the encodings were read at.
+
+        Returns:
+            IVFIndex: The populated index.
+        """
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, ENCODING_DIM)
+        if len(encodings) == 0:
+            raise ValueError("Cannot build an IVF index from an empty gallery.")
+
+        n_lists = min(n_lists or max(1, int(4 * np.sqrt(len(encodings)))), len(encodings))
+        training_size = min(training_size or 32 * n_lists, len(encodings))
+        rng = np.random.default_rng(seed)
+        sample = encodings[rng.choice(len(encodings), training_size, replace=False)]
+
+        centroids = kmeans(sample, n_lists, iterations=iterations, seed=seed)
+        return cls(centroids, ids, encodings, n_probe=n_probe, watermark=watermark)
+
+    def __len__(self):
+        return len(self.ids) + len(self._tail_ids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def _set_lists(self, ids: np.ndarray, encodings: np.ndarray):
+        assignment = _nearest_centre(encodings, self.centroids) if len(encodings) else np.empty(0, dtype=np.int64)
+        order = np.argsort(assignment, kind='stable')
+        self.ids = ids[order]
+        self.matrix = np.ascontiguousarray(encodings[order])
+        self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=self.n_lists))))
+
+    def add(self, person_id, encoding):
+        """Insert one encoding (e.g. right after a registration)."""
+        self._tail_ids.append(int(person_id))
+        self._tail_encodings.append(np.asarray(encoding, dtype=np.float64).reshape(-1))
+        if len(self._tail_ids) >= self.merge_threshold:
+            self.merge_tail()
+
+    def pending_count(self):
+        """Number of inserted encodings not yet merged into the inverted lists."""
+        return len(self._tail_ids)
+
+    def with_changes(self, removed_ids, ids, encodings) -> "IVFIndex":
+        """
+        Return a new index with some entries removed and others inserted or replaced
+        (the Gallery.with_changes contract, so a LiveGallery can keep an index current).
+
+        The index is not modified. Inserted encodings go to the tail of the new index, and
+        the inverted lists are only copied when a changed ID is in them.
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(len(ids), self.centroids.shape[1])
+        changed = np.concatenate((np.asarray(removed_ids, dtype=np.int64).reshape(-1), ids))
+
+        index = copy.copy(self)
+        in_lists = np.isin(self.ids, changed)
+        if in_lists.any():
+            keep = ~in_lists
+            list_of_row = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))
+            index.ids = self.ids[keep]
+            index.matrix = np.ascontiguousarray(self.matrix[keep])
+            index.sq_norms = self.sq_norms[keep]
+            index.offsets = np.concatenate(([0], np.cumsum(np.bincount(list_of_row[keep], minlength=self.n_lists))))
+
+        changed = set(changed.tolist())
+        tail = [(person_id, encoding) for person_id, encoding in zip(self._tail_ids, self._tail_encodings)
+                if person_id not in changed]
+        index._tail_ids = [person_id for person_id, _ in tail] + ids.tolist()
+        index._tail_encodings = [encoding for _, encoding in tail] + list(encodings)
+        if len(index._tail_ids) >= index.merge_threshold:
+            index.merge_tail()
+        return index
+
+    def merge_tail(self):
+        """Fold the inserted encodings into the inverted lists (the centroids are not retrained)."""
+        if not self._tail_ids:
+            return
+        ids = np.concatenate((self.ids, np.asarray(self._tail_ids, dtype=np.int64)))
+        encodings = np.vstack((self.matrix, np.asarray(self._tail_encodings)))
+        self._tail_ids, self._tail_encodings = [], []
+        self._set_lists(ids, encodings)
+
+    def _candidates(self, probe: np.ndarray):
+        """Exact distances from a probe to every row of its n_probe closest lists and the tail."""
+        n_probe = min(self.n_probe, self.n_lists)
+        centre_distances = _squared_distances(probe[None, :], self.centroids)[0]
+        lists = np.argpartition(centre_distances, n_probe - 1)[:n_probe] if n_probe < self.n_lists else range(self.n_lists)
+
+        rows = np.concatenate([np.arange(self.offsets[j], self.offsets[j + 1]) for j in lists])
+        candidate_ids = self.ids[rows]
+        sq = self.sq_norms[rows] + probe.dot(probe) - 2.0 * (self.matrix[rows] @ probe)
+
+        if self._tail_ids:
+            tail = np.asarray(self._tail_encodings)
+            candidate_ids = np.concatenate((candidate_ids, np.asarray(self._tail_ids, dtype=np.int64)))
+            sq = np.concatenate((sq, np.einsum('ij,ij->i', tail - probe, tail - probe)))
+        return candidate_ids, np.sqrt(np.maximum(sq, 0.0))
+
+    def match(self, probe, threshold: float = 0.6, k: int = 5) -> MatchResult:
+        """Approximate 1:N search with exact re-ranking of the probed lists (same result type as Gallery.match)."""
+        probe = np.asarray(probe, dtype=np.float64).reshape(-1)
+        candidate_ids, distances = self._candidates(probe)
+        return rank_candidates(candidate_ids, distances, threshold, k)
+
+    def match_batch(self, probes, threshold: float = 0.6, k: int = 5) -> List[MatchResult]:
+        return [self.match(probe, threshold, k) for probe in np.asarray(probes).reshape(len(probes), -1)]
+
+    def save(self, path):
+        """
+        Persist the whole index to a .npz file, written atomically. Pending inserts are
+        merged into the saved lists; the index itself is not modified.
+        """
+        index = self
+        if self._tail_ids:
+            index = copy.copy(self)
+            index.merge_tail()
+        extra = {} if index.watermark is None else {"watermark": index.watermark}
+        _save_npz(path, centroids=index.centroids, ids=index.ids, matrix=index.matrix, offsets=index.offsets,
+                  n_probe=index.n_probe, merge_threshold=index.merge_threshold, **extra)
+        if os.path.exists(tail_path(path)):
+            os.remove(tail_path(path))
+        logging.info(f"IVF index with {len(index)} encodings in {index.n_lists} lists saved to '{path}'.")
+
+    def save_tail(self, path):
+        """Persist only the unmerged inserts next to the index file, so a registration does not rewrite the whole index."""
+        _save_npz(tail_path(path), ids=np.asarray(self._tail_ids, dtype=np.int64),
+                  matrix=np.asarray(self._tail_encodings, dtype=np.float64).reshape(-1, self.centroids.shape[1]))
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save() (plus any inserts saved with save_tail()) without retraining or re-bucketing."""
+        with np.load(path) as data:
+            index = cls(data['centroids'], data['ids'], data['matrix'], offsets=data['offsets'],
+                        n_probe=int(data['n_probe']), merge_threshold=int(data['merge_threshold']),
+                        watermark=int(data['watermark']) if 'watermark' in data else None)
+        if os.path.exists(tail_path(path)):
+            with np.load(tail_path(path)) as tail:
+                index._tail_ids = [int(person_id) for person_id in tail['ids']]
+                index._tail_encodings = list(tail['matrix'])
+        return index
+
+
+def tail_path(path):
+    """Sidecar file holding the inserts not yet merged into a saved index."""
+    return f"{path}.tail.npz"
+
+
+def _save_npz(path, **arrays):
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+if __name__ == '__main__':
+    import argparse
+    from biometric_utils import PERSON_TABLES, ann_index_path, load_watermarked_gallery
+
+    parser = argparse.ArgumentParser(description="Build the IVF index used for large galleries (requires AMS_ANN_INDEX_DIR).")
+    parser.add_argument('person_type', choices=sorted(PERSON_TABLES))
+    parser.add_argument('--lists', type=int, default=None, help="Number of inverted lists (default: about 4*sqrt(n)).")
+    parser.add_argument('--probe', type=int, default=8, help="Lists scanned per query (recall/speed knob).")
+    parser.add_argument('--iterations', type=int, default=20, help="k-means iterations.")
+    args = parser.parse_args()
+
+    index_path = ann_index_path(args.person_type)
+    if index_path is None:
+        parser.error("Set AMS_ANN_INDEX_DIR to the directory the index should be written to.")
+    watermark, gallery = load_watermarked_gallery(args.person_type)
+    if gallery is None or len(gallery) == 0:
+        parser.error(f"No {args.person_type} encodings could be loaded.")
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    IVFIndex.build(gallery.ids, gallery.matrix, n_lists=args.lists, n_probe=args.probe, iterations=args.iterations,
+                   watermark=watermark if isinstance(watermark, int) else None).save(index_path)
@@ -0,0 +1,162 @@
+
+# ______________________________________________________________LOCAL ATTENDANCE JOURNAL_____________________________________________________________
+#
+# Every attendance mark is committed to a local SQLite file (AMS_ATTENDANCE_JOURNAL,
+# default attendance_journal.sqlite3) before anything is sent to MySQL. The
+# attendance writer replays the journal to MySQL in bulk, and marks survive a MySQL
+# outage or a restart of the application. The journal also remembers which sessions
+# are open, so an interrupted session can be resumed with its marks.
+
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+ATTENDANCE_JOURNAL_PATH = os.environ.get("AMS_ATTENDANCE_JOURNAL", "attendance_journal.sqlite3")
+
+JOURNAL_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS marks (
+        mark_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        enrollment_id INTEGER NOT NULL,
+        excuse_reason_id INTEGER,
+        attendance_status TEXT NOT NULL,
+        marked_at TEXT NOT NULL,
+        replayed INTEGER NOT NULL DEFAULT 0,  -- 0 pending, 1 in MySQL, -1 rejected by MySQL
+        UNIQUE (session_id, enrollment_id)
+    );
+    CREATE INDEX IF NOT EXISTS marks_pending ON marks (replayed, session_id, mark_id);
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id INTEGER PRIMARY KEY,
+        available_class_id INTEGER,
+        teacher_id INTEGER,
+        opened_at TEXT NOT NULL,
+        closed_at TEXT
+    );
+"""
+
+
+class AttendanceJournal:
+    """
+    Append-only record of attendance marks and open sessions in a SQLite file.
+
+    A mark is on disk when append() returns: the file runs in WAL mode, so each append
+    is a single small write and survives a crash of the process. A student is journaled
+    at most once per session: the first mark wins, except that an absent mark is replaced
+    by any other status (as in MySQL).
+    """
+
+    def __init__(self, path=ATTENDANCE_JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(JOURNAL_SCHEMA)
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def append(self, session_id, enrollment_id, attendance_status='present', excuse_reason_id=None):
+        """
+        Journal one mark.
+
+        Returns:
+            bool: True if the mark is new or replaces an absent mark, False if the student
+            already has a mark in the session.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            if attendance_status != 'absent':
+                # Replaced under a new mark_id, so a replay of the absent mark in progress
+                # cannot flag this one as written
+                self._connection.execute("DELETE FROM marks WHERE session_id = ? AND enrollment_id = ? "
+                                         "AND attendance_status = 'absent'", (session_id, enrollment_id))
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO marks (session_id, enrollment_id, excuse_reason_id, attendance_status, marked_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, enrollment_id, excuse_reason_id, attendance_status, datetime.datetime.now().isoformat()))
+            self._connection.execute("COMMIT")
+            return cursor.rowcount == 1
+
+    def pending(self, session_id=None, limit=1000):
+        """
+        Marks not yet replayed to MySQL, oldest first.
+
+        Returns:
+            list: (mark_id, session_id, enrollment_id, excuse_reason_id, attendance_status) tuples.
+        """
+        if session_id is None:
+            return self._execute("SELECT mark_id, session_id, enrollment_id, excuse_reason_id, attendance_status "
+                                 "FROM marks WHERE replayed = 0 ORDER BY mark_id LIMIT ?", (limit,))
+        return self._execute("SELECT mark_id, session_id, enrollment_id, excuse_reason_id, attendance_status "
+                             "FROM marks WHERE replayed = 0 AND session_id = ? ORDER BY mark_id LIMIT ?", (session_id, limit))
+
+    def pending_count(self, session_id=None):
+        if session_id is None:
+            return self._execute("SELECT COUNT(*) FROM marks WHERE replayed = 0")[0][0]
+        return self._execute("SELECT COUNT(*) FROM marks WHERE replayed = 0 AND session_id = ?", (session_id,))[0][0]
+
+    def mark_replayed(self, mark_ids):
+        """Record that these marks are in MySQL."""
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("UPDATE marks SET replayed = 1 WHERE mark_id = ?", ((mark_id,) for mark_id in mark_ids))
+            self._connection.execute("COMMIT")
+
+    def mark_rejected(self, mark_ids):
+        """Park marks MySQL refuses (e.g. an unknown enrollment ID) so they are not replayed again."""
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("UPDATE marks SET replayed = -1 WHERE mark_id = ?", ((mark_id,) for mark_id in mark_ids))
+            self._connection.execute("COMMIT")
+
+    def marked_students(self, session_id):
+        """Enrollment IDs journaled in a session other than as absent, replayed or not."""
+        return {enrollment_id for enrollment_id, in self._execute(
+            "SELECT enrollment_id FROM marks WHERE session_id = ? AND attendance_status <> 'absent'", (session_id,))}
+
+    def open_session(self, session_id, available_class_id, teacher_id):
+        self._execute("INSERT OR REPLACE INTO sessions (session_id, available_class_id, teacher_id, opened_at) "
+                      "VALUES (?, ?, ?, ?)", (session_id, available_class_id, teacher_id, datetime.datetime.now().isoformat()))
+
+    def close_session(self, session_id):
+        """Mark a session closed and forget its marks that are already in MySQL."""
+        with self._lock:
+            self._connection.execute("UPDATE sessions SET closed_at = ? WHERE session_id = ?",
+                                     (datetime.datetime.now().isoformat(), session_id))
+            self._connection.execute("DELETE FROM marks WHERE session_id = ? AND replayed = 1", (session_id,))
+
+    def open_sessions(self, teacher_id=None):
+        """
+        Sessions started here and not closed yet, newest first.
+
+        Returns:
+            list: (session_id, available_class_id, teacher_id, opened_at) tuples.
+        """
+        if teacher_id is None:
+            return self._execute("SELECT session_id, available_class_id, teacher_id, opened_at FROM sessions "
+                                 "WHERE closed_at IS NULL ORDER BY opened_at DESC")
+        return self._execute("SELECT session_id, available_class_id, teacher_id, opened_at FROM sessions "
+                             "WHERE closed_at IS NULL AND teacher_id = ? ORDER BY opened_at DESC", (teacher_id,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_attendance_journal():
+    """Return the process-wide journal, opening AMS_ATTENDANCE_JOURNAL on first use."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = AttendanceJournal()
+            logging.info(f"Attendance journal: {os.path.abspath(_journal.path)} "
+                         f"({_journal.pending_count()} marks waiting for MySQL).")
+        return _journal
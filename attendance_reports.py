@@ -0,0 +1,417 @@
+
+# ______________________________________________________________ATTENDANCE REPORTS AND ROLLUPS_____________________________________________________________
+#
+#   python attendance_reports.py student 2201001 [--from 2025-01-01 --to 2025-06-30]
+#   python attendance_reports.py class 3 | teacher 1001 | daily --from ... --to ...
+#   python attendance_reports.py rebuild          (backfill the rollups from the full history)
+#
+# Reports read two summary tables instead of scanning attendances:
+#
+#   session_attendance_summary   one row per completed session (class, teacher, date, counts)
+#   student_class_attendance     running totals per (student, class)
+#
+# close_attendance_session adds each session to both tables in the transaction that
+# completes it; marks replayed into a completed session later recompute its rows
+# (refresh_session_rollups). A student marked more than once in a session counts once, with the best
+# status (present > late > excused > absent). Attendance percentages count present and
+# late as attended.
+
+import argparse
+import logging
+
+import mysql.connector
+
+from DBconfig import get_db_connection
+
+# Best status of each student in one session: 1 present, 2 late, 3 excused, 4 absent
+SESSION_MARKS_QUERY = """
+    SELECT enrollment_id, MIN(FIELD(attendance_status, 'present', 'late', 'excused', 'absent')) AS best
+    FROM attendances
+    WHERE session_id = %s AND enrollment_id IS NOT NULL
+    GROUP BY enrollment_id
+"""
+
+INSERT_SESSION_SUMMARY = f"""
+    INSERT IGNORE INTO session_attendance_summary
+        (session_id, available_class_id, teacher_id, session_date, present_count, late_count, excused_count, absent_count)
+    SELECT s.session_id, s.available_class_id, s.teacher_id, DATE(COALESCE(s.start_time, s.created_at)),
+           COALESCE(SUM(marks.best = 1), 0), COALESCE(SUM(marks.best = 2), 0),
+           COALESCE(SUM(marks.best = 3), 0), COALESCE(SUM(marks.best = 4), 0)
+    FROM sessions s
+    LEFT JOIN ({SESSION_MARKS_QUERY}) AS marks ON TRUE
+    WHERE s.session_id = %s
+    GROUP BY s.session_id, s.available_class_id, s.teacher_id, s.start_time, s.created_at
+"""
+
+ADD_STUDENT_TOTALS = f"""
+    INSERT INTO student_class_attendance
+        (enrollment_id, available_class_id, present_count, late_count, excused_count, absent_count, last_session_id)
+    SELECT marks.enrollment_id, s.available_class_id, marks.best = 1, marks.best = 2, marks.best = 3, marks.best = 4, s.session_id
+    FROM sessions s
+    JOIN ({SESSION_MARKS_QUERY}) AS marks
+    WHERE s.session_id = %s AND s.available_class_id IS NOT NULL
+    ON DUPLICATE KEY UPDATE
+        present_count = present_count + VALUES(present_count),
+        late_count = late_count + VALUES(late_count),
+        excused_count = excused_count + VALUES(excused_count),
+        absent_count = absent_count + VALUES(absent_count),
+        last_session_id = VALUES(last_session_id)
+"""
+
+# Best status of each student in every session, for the rebuild
+ALL_MARKS_QUERY = """
+    SELECT session_id, enrollment_id, MIN(FIELD(attendance_status, 'present', 'late', 'excused', 'absent')) AS best
+    FROM attendances
+    WHERE enrollment_id IS NOT NULL
+    GROUP BY session_id, enrollment_id
+"""
+
+REBUILD_SESSION_SUMMARY = f"""
+    INSERT INTO session_attendance_summary
+        (session_id, available_class_id, teacher_id, session_date, present_count, late_count, excused_count, absent_count)
+    SELECT s.session_id, s.available_class_id, s.teacher_id, DATE(COALESCE(s.start_time, s.created_at)),
+           COALESCE(SUM(marks.best = 1), 0), COALESCE(SUM(marks.best = 2), 0),
+           COALESCE(SUM(marks.best = 3), 0), COALESCE(SUM(marks.best = 4), 0)
+    FROM sessions s
+    LEFT JOIN ({ALL_MARKS_QUERY}) AS marks ON marks.session_id = s.session_id
+    WHERE s.status = 'completed'
+    GROUP BY s.session_id, s.available_class_id, s.teacher_id, s.start_time, s.created_at
+"""
+
+REBUILD_STUDENT_TOTALS = f"""
+    INSERT INTO student_class_attendance
+        (enrollment_id, available_class_id, present_count, late_count, excused_count, absent_count, last_session_id)
+    SELECT marks.enrollment_id, s.available_class_id, SUM(marks.best = 1), SUM(marks.best = 2),
+           SUM(marks.best = 3), SUM(marks.best = 4), MAX(s.session_id)
+    FROM sessions s
+    JOIN ({ALL_MARKS_QUERY}) AS marks ON marks.session_id = s.session_id
+    WHERE s.status = 'completed' AND s.available_class_id IS NOT NULL
+    GROUP BY marks.enrollment_id, s.available_class_id
+"""
+
+# Best status of each student in every session of one class, for a refresh
+CLASS_MARKS_QUERY = """
+    SELECT a.session_id, a.enrollment_id, MIN(FIELD(a.attendance_status, 'present', 'late', 'excused', 'absent')) AS best
+    FROM attendances a
+    JOIN sessions cs ON cs.session_id = a.session_id
+    WHERE cs.available_class_id = %s AND a.enrollment_id IS NOT NULL
+    GROUP BY a.session_id, a.enrollment_id
+"""
+
+REBUILD_CLASS_TOTALS = f"""
+    INSERT INTO student_class_attendance
+        (enrollment_id, available_class_id, present_count, late_count, excused_count, absent_count, last_session_id)
+    SELECT marks.enrollment_id, s.available_class_id, SUM(marks.best = 1), SUM(marks.best = 2),
+           SUM(marks.best = 3), SUM(marks.best = 4), MAX(s.session_id)
+    FROM sessions s
+    JOIN ({CLASS_MARKS_QUERY}) AS marks ON marks.session_id = s.session_id
+    WHERE s.status = 'completed' AND s.available_class_id = %s
+    GROUP BY marks.enrollment_id, s.available_class_id
+"""
+
+# Defaults that make a date range cover the whole history
+EARLIEST_DATE = '1000-01-01'
+LATEST_DATE = '9999-12-31'
+
+CLASS_DETAILS = """
+    JOIN availableclasses ac ON ac.available_class_id = totals.available_class_id
+    JOIN subjects sub ON sub.subject_id = ac.subject_id
+    LEFT JOIN sections sec ON sec.section_id = ac.section_id
+"""
+
+SESSIONS_HELD = """
+    (SELECT COUNT(*) FROM session_attendance_summary held
+     WHERE held.available_class_id = totals.available_class_id AND held.session_date BETWEEN %s AND %s) AS sessions_held
+"""
+
+
+def update_session_rollups(cursor, session_id):
+    """
+    Add a completed session to the summary tables.
+
+    Runs on the caller's cursor so it commits (or rolls back) with the session status
+    update. A session that is already summarized is skipped, so closing twice does not
+    count it twice.
+
+    Args:
+        cursor: Cursor of the transaction that completes the session.
+        session_id (int): The session being completed.
+
+    Returns:
+        bool: True if the session was added, False if it already was or the summary tables are missing.
+    """
+    try:
+        cursor.execute(INSERT_SESSION_SUMMARY, (session_id, session_id))
+        if cursor.rowcount != 1:
+            return False
+        cursor.execute(ADD_STUDENT_TOTALS, (session_id, session_id))
+        return True
+    except mysql.connector.ProgrammingError as e:
+        # Databases created before the summary tables: closing the session must still work
+        logging.warning(f"Attendance rollups not updated for session {session_id} ({e}). "
+                        f"Create the summary tables from ams_schema.sql and run 'python attendance_reports.py rebuild'.")
+        return False
+
+
+def rebuild_rollups():
+    """
+    Recompute both summary tables from every completed session in one transaction.
+
+    Returns:
+        bool: True if the rollups were rebuilt.
+    """
+    db = get_db_connection()
+    if db is None:
+        logging.error("Database connection failed. Rollups not rebuilt.")
+        return False
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("DELETE FROM student_class_attendance")
+            cursor.execute("DELETE FROM session_attendance_summary")
+            cursor.execute(REBUILD_SESSION_SUMMARY)
+            sessions = cursor.rowcount
+            cursor.execute(REBUILD_STUDENT_TOTALS)
+            db.commit()
+            logging.info(f"Attendance rollups rebuilt from {sessions} completed sessions.")
+            return True
+    except mysql.connector.Error as e:
+        logging.error(f"Error while rebuilding attendance rollups: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+def refresh_session_rollups(session_id):
+    """
+    Recompute a completed session's summary row and its class's student totals in one
+    transaction, after marks were written to the session once it was completed (e.g. a
+    replayed recording turning absent students present). Open sessions are left alone.
+
+    Args:
+        session_id (int): The session whose marks changed.
+
+    Returns:
+        bool: True if the rollups were recomputed.
+    """
+    db = get_db_connection()
+    if db is None:
+        logging.error(f"Database connection failed. Rollups of session {session_id} not refreshed.")
+        return False
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT available_class_id FROM sessions WHERE session_id = %s AND status = 'completed'",
+                           (session_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            available_class_id, = row
+            cursor.execute("DELETE FROM session_attendance_summary WHERE session_id = %s", (session_id,))
+            cursor.execute(INSERT_SESSION_SUMMARY, (session_id, session_id))
+            if available_class_id is not None:
+                cursor.execute("DELETE FROM student_class_attendance WHERE available_class_id = %s", (available_class_id,))
+                cursor.execute(REBUILD_CLASS_TOTALS, (available_class_id, available_class_id))
+            db.commit()
+            logging.info(f"Attendance rollups of session {session_id} refreshed.")
+            return True
+    except mysql.connector.Error as e:
+        logging.error(f"Error while refreshing the rollups of session {session_id}: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+def _run_report(query, params):
+    """Run a report query; returns its rows as dicts, or None if the database failed."""
+    db = get_db_connection()
+    if db is None:
+        logging.error("Database connection failed.")
+        return None
+    try:
+        with db.cursor(dictionary=True) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+    except mysql.connector.Error as e:
+        logging.error(f"Database error while running an attendance report: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def _add_percentage(rows, denominator):
+    """Add attendance_percentage = (present + late) / row[denominator], or None when that is 0."""
+    for row in rows or []:
+        attended = int(row['present_count'] or 0) + int(row['late_count'] or 0)
+        total = int(row[denominator] or 0)
+        row['attendance_percentage'] = round(100.0 * attended / total, 1) if total else None
+    return rows
+
+
+def student_report(enrollment_id, start_date=None, end_date=None):
+    """
+    Attendance of one student in each of their classes.
+
+    Without a date range the running totals are read directly; with one, only the
+    student's own attendance rows are read (through the enrollment_session_status index).
+
+    Args:
+        enrollment_id (int): The student.
+        start_date, end_date (date or 'YYYY-MM-DD', optional): Inclusive range of session dates.
+
+    Returns:
+        list: Per class: subject, section, status counts, sessions_held and attendance_percentage
+              (of sessions held). None if the database failed.
+    """
+    start_date, end_date = start_date or EARLIEST_DATE, end_date or LATEST_DATE
+    if start_date == EARLIEST_DATE and end_date == LATEST_DATE:
+        totals = "SELECT * FROM student_class_attendance WHERE enrollment_id = %s"
+        params = (enrollment_id,)
+    else:
+        totals = """
+            SELECT ss.available_class_id, SUM(marks.best = 1) AS present_count, SUM(marks.best = 2) AS late_count,
+                   SUM(marks.best = 3) AS excused_count, SUM(marks.best = 4) AS absent_count
+            FROM (SELECT session_id, MIN(FIELD(attendance_status, 'present', 'late', 'excused', 'absent')) AS best
+                  FROM attendances WHERE enrollment_id = %s GROUP BY session_id) AS marks
+            JOIN session_attendance_summary ss ON ss.session_id = marks.session_id
+            WHERE ss.session_date BETWEEN %s AND %s
+            GROUP BY ss.available_class_id
+        """
+        params = (enrollment_id, start_date, end_date)
+
+    query = f"""
+        SELECT ac.available_class_id, sub.subject_code, sub.subject_name, sec.section,
+               totals.present_count, totals.late_count, totals.excused_count, totals.absent_count, {SESSIONS_HELD}
+        FROM ({totals}) AS totals {CLASS_DETAILS}
+        ORDER BY sub.subject_code, sec.section
+    """
+    # The sessions_held subquery comes first in the statement, so its dates are bound first
+    return _add_percentage(_run_report(query, (start_date, end_date) + params), 'sessions_held')
+
+
+def class_report(available_class_id, start_date=None, end_date=None):
+    """
+    Sessions of one class with their status counts, newest first.
+
+    Returns:
+        list: Per session: session_id, session_date, teacher_id, status counts and attendance_percentage
+              (of the students marked). None if the database failed.
+    """
+    query = """
+        SELECT session_id, session_date, teacher_id, present_count, late_count, excused_count, absent_count,
+               present_count + late_count + excused_count + absent_count AS marked_count
+        FROM session_attendance_summary
+        WHERE available_class_id = %s AND session_date BETWEEN %s AND %s
+        ORDER BY session_date DESC, session_id DESC
+    """
+    rows = _run_report(query, (available_class_id, start_date or EARLIEST_DATE, end_date or LATEST_DATE))
+    return _add_percentage(rows, 'marked_count')
+
+
+def class_student_report(available_class_id):
+    """
+    Running totals of every student of one class, lowest attendance first.
+
+    Returns:
+        list: Per student: enrollment_id, name, status counts, sessions_held and attendance_percentage.
+              None if the database failed.
+    """
+    query = f"""
+        SELECT totals.enrollment_id, st.first_name, st.last_name,
+               totals.present_count, totals.late_count, totals.excused_count, totals.absent_count, {SESSIONS_HELD}
+        FROM student_class_attendance totals
+        JOIN students st ON st.enrollment_id = totals.enrollment_id
+        WHERE totals.available_class_id = %s
+    """
+    rows = _add_percentage(_run_report(query, (EARLIEST_DATE, LATEST_DATE, available_class_id)), 'sessions_held')
+    if rows is not None:
+        rows.sort(key=lambda row: (row['attendance_percentage'] is None, row['attendance_percentage'] or 0.0))
+    return rows
+
+
+def teacher_report(teacher_id, start_date=None, end_date=None):
+    """
+    Sessions held by one teacher, per class.
+
+    Returns:
+        list: Per class: subject, section, sessions_held, status counts and attendance_percentage
+              (of the students marked). None if the database failed.
+    """
+    query = f"""
+        SELECT ac.available_class_id, sub.subject_code, sub.subject_name, sec.section, totals.sessions_held,
+               totals.present_count, totals.late_count, totals.excused_count, totals.absent_count, totals.marked_count
+        FROM (SELECT available_class_id, COUNT(*) AS sessions_held,
+                     SUM(present_count) AS present_count, SUM(late_count) AS late_count,
+                     SUM(excused_count) AS excused_count, SUM(absent_count) AS absent_count,
+                     SUM(present_count + late_count + excused_count + absent_count) AS marked_count
+              FROM session_attendance_summary
+              WHERE teacher_id = %s AND session_date BETWEEN %s AND %s
+              GROUP BY available_class_id) AS totals {CLASS_DETAILS}
+        ORDER BY sub.subject_code, sec.section
+    """
+    rows = _run_report(query, (teacher_id, start_date or EARLIEST_DATE, end_date or LATEST_DATE))
+    return _add_percentage(rows, 'marked_count')
+
+
+def daily_report(start_date=None, end_date=None):
+    """
+    Institution-wide totals per day.
+
+    Returns:
+        list: Per date: sessions_held, status counts and attendance_percentage (of the students marked).
+              None if the database failed.
+    """
+    query = """
+        SELECT session_date, COUNT(*) AS sessions_held,
+               SUM(present_count) AS present_count, SUM(late_count) AS late_count,
+               SUM(excused_count) AS excused_count, SUM(absent_count) AS absent_count,
+               SUM(present_count + late_count + excused_count + absent_count) AS marked_count
+        FROM session_attendance_summary
+        WHERE session_date BETWEEN %s AND %s
+        GROUP BY session_date
+        ORDER BY session_date
+    """
+    return _add_percentage(_run_report(query, (start_date or EARLIEST_DATE, end_date or LATEST_DATE)), 'marked_count')
+
+
+def print_report(rows):
+    """Print report rows as an aligned text table."""
+    if not rows:
+        print("No attendance recorded.")
+        return
+    columns = list(rows[0])
+    cells = [[("" if row[column] is None else str(row[column])) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Attendance reports read from the incrementally maintained rollups.")
+    parser.add_argument('report', choices=['student', 'class', 'class-students', 'teacher', 'daily', 'rebuild'])
+    parser.add_argument('id', nargs='?', type=int, help="Enrollment ID, available_class_id or teacher ID.")
+    parser.add_argument('--from', dest='start_date', help="First session date (YYYY-MM-DD).")
+    parser.add_argument('--to', dest='end_date', help="Last session date (YYYY-MM-DD).")
+    args = parser.parse_args()
+
+    if args.report == 'rebuild':
+        parser.exit(0 if rebuild_rollups() else 1)
+    if args.report != 'daily' and args.id is None:
+        parser.error(f"The {args.report} report needs an ID.")
+
+    if args.report == 'student':
+        report = student_report(args.id, args.start_date, args.end_date)
+    elif args.report == 'class':
+        report = class_report(args.id, args.start_date, args.end_date)
+    elif args.report == 'class-students':
+        report = class_student_report(args.id)
+    elif args.report == 'teacher':
+        report = teacher_report(args.id, args.start_date, args.end_date)
+    else:
+        report = daily_report(args.start_date, args.end_date)
+
+    if report is None:
+        parser.exit(1, "The report could not be read from the database.\n")
+    print_report(report)
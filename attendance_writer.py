@@ -0,0 +1,270 @@
+
+# ______________________________________________________________WRITE-BEHIND ATTENDANCE BUFFER_____________________________________________________________
+#
+# Marks are committed to the local attendance journal (attendance_journal.py) and
+# replayed from it to MySQL in bulk. Scanning never waits for MySQL, and a mark
+# that cannot be written yet stays in the journal until it can, across restarts too.
+
+import atexit
+import logging
+import threading
+
+import mysql.connector
+
+from DBconfig import get_db_connection
+from attendance_journal import get_attendance_journal
+from metrics import stage
+
+# The unique (session_id, enrollment_id) key makes replaying a mark twice harmless: the
+# first mark is kept, except that an 'absent' row is replaced by any other status (a
+# student found later in a recording of the session). excuse_reason_id is assigned first,
+# while attendance_status still holds the existing value.
+INSERT_ATTENDANCE_QUERY = """
+    INSERT INTO attendances (session_id, enrollment_id, excuse_reason_id, attendance_status)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        excuse_reason_id = CASE WHEN attendance_status = 'absent' AND VALUES(attendance_status) <> 'absent'
+                                THEN VALUES(excuse_reason_id) ELSE excuse_reason_id END,
+        attendance_status = CASE WHEN attendance_status = 'absent' AND VALUES(attendance_status) <> 'absent'
+                                 THEN VALUES(attendance_status) ELSE attendance_status END
+"""
+
+# Marks sent to MySQL per executemany/commit
+REPLAY_BATCH_SIZE = 1000
+# Seconds between replays of the whole journal by the background replayer
+REPLAY_INTERVAL = 2.0
+
+_replay_lock = threading.Lock()
+
+
+def _insert_marks_singly(cursor, marks):
+    """
+    Insert marks one at a time, after their batch was refused as a whole.
+
+    Returns:
+        list: The marks MySQL still refuses (e.g. an enrollment ID with no student).
+    """
+    rejected = []
+    for mark in marks:
+        try:
+            cursor.execute(INSERT_ATTENDANCE_QUERY, mark[1:])
+        except mysql.connector.IntegrityError as e:
+            logging.error(f"Attendance mark of enrollment ID {mark[2]} in session {mark[1]} rejected by the "
+                          f"database and kept aside in the journal: {e}")
+            rejected.append(mark)
+    return rejected
+
+
+def replay_journal(journal=None, session_id=None, batch_size=REPLAY_BATCH_SIZE):
+    """
+    Write the journaled marks that are not in MySQL yet, in batches of one executemany/commit.
+
+    A batch that breaks a constraint is written again mark by mark; marks MySQL still
+    refuses are parked in the journal so they cannot hold back the others.
+
+    Args:
+        journal (AttendanceJournal, optional): Defaults to the process-wide journal.
+        session_id (int, optional): Only replay this session's marks.
+        batch_size (int): Marks per transaction.
+
+    Returns:
+        bool: True if no mark is left to replay, False if MySQL could not take them.
+    """
+    journal = journal or get_attendance_journal()
+    with _replay_lock:
+        while True:
+            marks = journal.pending(session_id, batch_size)
+            if not marks:
+                return True
+
+            db = get_db_connection()
+            if db is None:
+                logging.error(f"Database connection failed. {len(marks)} attendance marks kept in the journal.")
+                return False
+
+            rejected = []
+            try:
+                with stage("attendance.flush"), db.cursor() as cursor:
+                    try:
+                        cursor.executemany(INSERT_ATTENDANCE_QUERY, [mark[1:] for mark in marks])
+                    except mysql.connector.IntegrityError as e:
+                        logging.warning(f"Attendance batch refused ({e}). Writing its {len(marks)} marks one by one.")
+                        db.rollback()
+                        rejected = _insert_marks_singly(cursor, marks)
+                    db.commit()
+            except mysql.connector.Error as e:
+                logging.error(f"Error while replaying attendance marks: {e}")
+                db.rollback()
+                return False
+            finally:
+                db.close()
+
+            # A crash before this line only means the batch is replayed (and ignored) again
+            if rejected:
+                journal.mark_rejected([mark[0] for mark in rejected])
+            journal.mark_replayed([mark[0] for mark in marks if mark not in rejected])
+            logging.info(f"Replayed {len(marks) - len(rejected)} attendance marks to the database.")
+
+
+class AttendanceWriter:
+    """
+    Journals the attendance marks of one session and has them written in batches.
+
+    mark() returns once the mark is in the local journal. The background replayer
+    writes journaled marks with a single executemany/commit whenever `batch_size` marks
+    are waiting or `flush_interval` seconds have passed. close() flushes whatever is
+    left; marks that fail to insert stay in the journal for the next replay.
+    """
+
+    def __init__(self, session_id, batch_size=50, flush_interval=REPLAY_INTERVAL, journal=None):
+        self.session_id = session_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal = journal or get_attendance_journal()
+
+        self._unflushed = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._replayer = start_journal_replayer(self.journal, flush_interval)
+
+    def mark(self, enrollment_id, attendance_status='present', excuse_reason_id=None):
+        """
+        Journal an attendance mark for the session.
+
+        Args:
+            enrollment_id (int): The enrollment ID of the student.
+            attendance_status (str): Attendance status ('present', 'absent', 'late', 'excused').
+            excuse_reason_id (int, optional): Reason ID for excused absences.
+
+        Returns:
+            bool: False if the student already had a mark in the session (the first one is kept,
+            unless it is 'absent').
+        """
+        if self._closed.is_set():
+            raise RuntimeError(f"Attendance writer for session {self.session_id} is closed.")
+
+        added = self.journal.append(self.session_id, enrollment_id, attendance_status, excuse_reason_id)
+        with self._lock:
+            self._unflushed += added
+            pending = self._unflushed
+
+        if pending >= self.batch_size:
+            with self._lock:
+                self._unflushed = 0
+            self._replayer.wake()
+        return added
+
+    def pending_count(self):
+        return self.journal.pending_count(self.session_id)
+
+    def flush(self):
+        """
+        Write every journaled mark of the session.
+
+        Returns:
+            bool: True if none is left, False if the insert failed.
+        """
+        flushed = replay_journal(self.journal, self.session_id)
+        if flushed:
+            with self._lock:
+                self._unflushed = 0
+        return flushed
+
+    def close(self):
+        """Stop taking marks and flush the remaining ones."""
+        self._closed.set()
+        return self.flush()
+
+
+class JournalReplayer:
+    """Background thread replaying a journal for every session, including those left by an earlier run."""
+
+    def __init__(self, journal, interval=REPLAY_INTERVAL):
+        self.journal = journal
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="attendance-replayer", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                replay_journal(self.journal)
+            except Exception as e:
+                logging.error(f"Attendance journal replay failed: {e}")
+
+
+_replayers = {}
+_replayers_lock = threading.Lock()
+
+
+def start_journal_replayer(journal=None, interval=REPLAY_INTERVAL):
+    """Start the replayer of a journal (default: the process-wide one) if it is not running yet, and return it."""
+    journal = journal or get_attendance_journal()
+    with _replayers_lock:
+        replayer = _replayers.get(id(journal))
+        if replayer is None:
+            replayer = _replayers[id(journal)] = JournalReplayer(journal, interval)
+        return replayer
+
+
+def stop_journal_replayer(journal=None):
+    """Stop the replayer of a journal, if one is running (pending marks stay in the journal)."""
+    journal = journal or get_attendance_journal()
+    with _replayers_lock:
+        replayer = _replayers.pop(id(journal), None)
+    if replayer is not None:
+        replayer.stop()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_attendance_writer(session_id, **kwargs):
+    """Return the writer of a session, creating it on first use."""
+    with _writers_lock:
+        writer = _writers.get(session_id)
+        if writer is None:
+            writer = _writers[session_id] = AttendanceWriter(session_id, **kwargs)
+        return writer
+
+
+def close_attendance_writer(session_id):
+    """
+    Flush and discard the writer of a session, if it has one.
+
+    Returns:
+        bool: False if marks could not be written, True otherwise.
+    """
+    with _writers_lock:
+        writer = _writers.pop(session_id, None)
+    if writer is None:
+        # Marks journaled by an earlier run of the application may still be waiting
+        return replay_journal(session_id=session_id)
+    # The closed writer is dropped either way: marks it could not write stay in the
+    # journal for the replayer, and a later mark gets a fresh writer
+    return writer.close()
+
+
+@atexit.register
+def close_all_attendance_writers():
+    """Flush every open session on interpreter shutdown; whatever fails is replayed on the next start."""
+    for session_id in list(_writers):
+        if not close_attendance_writer(session_id):
+            logging.error(f"Attendance marks for session {session_id} could not be written before exit. "
+                          f"They are kept in the journal and will be written once the application "
+                          f"or the recognition service is started again.")
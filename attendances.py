@@ -1,7 +1,8 @@
 import logging
 from datetime import datetime
+from attendance_writer import get_attendance_writer
 from biometric_utils import find_person_by_biometric, is_match
-from DBconfig import get_db_connection
+from metrics import stage, timed
 
 ############################_THIS FILE IS USED FOR ATTENDANCE OF STUDENTS DURING CLASS_#########################################
 # Initialize logging
@@ -30,6 +31,7 @@ def choose_person_type():
 
 
 
+@timed("attendance.record")
 def record_attendance(session_id, enrollment_id, biometric_data, attendance_status='present', excuse_reason_id=None):
     """
     Record attendance for a student.
@@ -41,47 +43,24 @@ def record_attendance(session_id, enrollment_id, biometric_data, attendance_stat
         attendance_status (str): Attendance status ('present', 'absent', 'late', 'excused').
         excuse_reason_id (int, optional): Reason ID for excused absences.
     """
-    db = get_db_connection()
-    if db is None:
-        logging.error("Database connection failed. Attendance not recorded.")
-        return
-
     try:
-        cursor = db.cursor()
-
         # Verify the biometric data matches the student
-        if enrollment_id and is_match(biometric_data, enrollment_id):
-            # Prepare query based on provided columns
-            if excuse_reason_id:
-                query = """
-                    INSERT INTO attendances (session_id, enrollment_id, excuse_reason_id, attendance_status)
-                    VALUES (%s, %s, %s, %s)
-                """
-                cursor.execute(query, (session_id, enrollment_id, excuse_reason_id, attendance_status))
-            else:
-                query = """
-                    INSERT INTO attendances (session_id, enrollment_id, attendance_status)
-                    VALUES (%s, %s, %s)
-                """
-                cursor.execute(query, (session_id, enrollment_id, attendance_status))
+        with stage("attendance.verify"):
+            verified = enrollment_id and is_match(biometric_data, enrollment_id)
 
-            # Commit the transaction
-            db.commit()
-            logging.info(f"Attendance recorded for Enrollment ID: {enrollment_id} with status '{attendance_status}'.")
-            print(f"Attendance successfully recorded for Enrollment ID: {enrollment_id} with status '{attendance_status}'.")
+        if verified:
+            with stage("attendance.insert"):
+                # Journaled locally and replayed to the database in the background, so a
+                # slow or unreachable database does not lose the mark
+                added = get_attendance_writer(session_id).mark(enrollment_id, attendance_status, excuse_reason_id)
+            if added:
+                logging.info(f"Attendance recorded for Enrollment ID: {enrollment_id} with status '{attendance_status}'.")
+                print(f"Attendance successfully recorded for Enrollment ID: {enrollment_id} with status '{attendance_status}'.")
+            else:
+                print(f"Attendance already recorded for Enrollment ID: {enrollment_id} in this session.")
         else:
             logging.warning(f"No matching student found for Enrollment ID: {enrollment_id}.")
             print("Attendance not recorded: No matching student found.")
 
     except Exception as e:
         logging.error(f"Error while recording attendance: {str(e)}")
-        db.rollback()  # Rollback the transaction in case of error
-    finally:
-        try:
-            cursor.close()
-        except Exception as close_error:
-            logging.error(f"Error closing cursor: {str(close_error)}")
-        try:
-            db.close()
-        except Exception as close_error:
-            logging.error(f"Error closing database connection: {str(close_error)}")
@@ -0,0 +1,200 @@
+
+# ______________________________________________________________DUPLICATE BIOMETRIC AUDIT_____________________________________________________________
+#
+#   python audit_duplicates.py --threshold 0.45 --output duplicates.csv
+#
+# Finds faces enrolled more than once (under two student IDs, two teacher IDs, or as
+# both a student and a teacher). Such pairs make identification return whichever one
+# happens to be closest to a scan.
+
+import argparse
+import csv
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from biometric_utils import PERSON_TABLES, get_live_gallery, load_gallery
+
+# Two encodings closer than this are reported as the same face (recognition matches below 0.6)
+DUPLICATE_THRESHOLD = 0.45
+# Rows per block of the all-pairs computation: block_size**2 distances are held per worker
+BLOCK_SIZE = 2048
+
+
+def near_duplicate_pairs(matrix, threshold=DUPLICATE_THRESHOLD, block_size=BLOCK_SIZE, workers=None):
+    """
+    Find every pair of rows closer than a threshold, without materialising the n x n distance matrix.
+
+    The upper triangle is covered one block of rows at a time. Each row block is compared
+    with every column block from the diagonal onwards through one matrix product, and the
+    row blocks are spread over a thread pool (NumPy releases the GIL inside the products).
+
+    Args:
+        matrix (np.ndarray): Encodings, one per row.
+        threshold (float): Distance under which a pair is reported.
+        block_size (int): Rows per block.
+        workers (int, optional): Threads; defaults to the number of CPUs.
+
+    Returns:
+        tuple: (first_rows, second_rows, distances) arrays with first_rows < second_rows.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    n = len(matrix)
+    sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+    limit = threshold ** 2
+
+    def row_block(start):
+        stop = min(start + block_size, n)
+        rows = matrix[start:stop]
+        firsts, seconds, distances = [], [], []
+        for column_start in range(start, n, block_size):
+            column_stop = min(column_start + block_size, n)
+            sq = (sq_norms[start:stop, None] + sq_norms[None, column_start:column_stop]
+                  - 2.0 * (rows @ matrix[column_start:column_stop].T))
+            a, b = np.nonzero(sq < limit)
+            pair_distances = np.sqrt(np.maximum(sq[a, b], 0.0))
+            a, b = a + start, b + column_start
+            upper = a < b  # Each pair once, and never a row with itself
+            firsts.append(a[upper])
+            seconds.append(b[upper])
+            distances.append(pair_distances[upper])
+        return firsts, seconds, distances
+
+    firsts, seconds, distances = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        for block_firsts, block_seconds, block_distances in executor.map(row_block, range(0, n, block_size)):
+            firsts += block_firsts
+            seconds += block_seconds
+            distances += block_distances
+    return np.concatenate(firsts), np.concatenate(seconds), np.concatenate(distances)
+
+
+def cluster_pairs(n, firsts, seconds):
+    """
+    Group rows linked by near-duplicate pairs (union-find with path halving).
+
+    Returns:
+        list: Clusters of two or more row indexes.
+    """
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(firsts.tolist(), seconds.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    clusters = {}
+    for row in set(firsts.tolist()) | set(seconds.tolist()):
+        clusters.setdefault(find(row), []).append(row)
+    return [sorted(rows) for rows in clusters.values()]
+
+
+def load_combined_gallery():
+    """
+    Load the student and teacher galleries into one matrix.
+
+    Returns:
+        tuple: (labels, matrix) with a (person_type, person_id) label per row, or None if a load failed.
+    """
+    labels, matrices = [], []
+    for person_type in sorted(PERSON_TABLES):
+        gallery = load_gallery(person_type)
+        if gallery is None:
+            return None
+        labels += [(person_type, int(person_id)) for person_id in gallery.ids]
+        matrices.append(gallery.matrix)
+    return labels, np.concatenate(matrices)
+
+
+def audit_duplicates(threshold=DUPLICATE_THRESHOLD, block_size=BLOCK_SIZE, workers=None):
+    """
+    Report clusters of near-duplicate faces across the whole student + teacher gallery.
+
+    Returns:
+        list: One dict per cluster, closest pair first, with 'members' as
+              (person_type, person_id, distance to the nearest other member) tuples.
+              None if the galleries could not be loaded.
+    """
+    loaded = load_combined_gallery()
+    if loaded is None:
+        return None
+    labels, matrix = loaded
+    firsts, seconds, distances = near_duplicate_pairs(matrix, threshold, block_size, workers)
+
+    nearest = {}
+    for a, b, distance in zip(firsts.tolist(), seconds.tolist(), distances.tolist()):
+        nearest[a] = min(nearest.get(a, distance), distance)
+        nearest[b] = min(nearest.get(b, distance), distance)
+
+    report = []
+    for rows in cluster_pairs(len(labels), firsts, seconds):
+        members = [labels[row] + (nearest[row],) for row in rows]
+        report.append({"min_distance": min(member[2] for member in members), "members": members})
+    report.sort(key=lambda cluster: cluster["min_distance"])
+    return report
+
+
+def find_enrolled_duplicates(encodings, threshold=DUPLICATE_THRESHOLD):
+    """
+    Registration-time check: compare new encodings with every enrolled student and teacher.
+
+    Args:
+        encodings (array-like): Encodings about to be enrolled, one per row.
+        threshold (float): Distance under which an enrolled face counts as the same person.
+
+    Returns:
+        list: For each encoding, the (person_type, person_id, distance) of the enrolled faces
+              closer than the threshold, closest first.
+    """
+    encodings = np.asarray(encodings, dtype=np.float64).reshape(len(encodings), -1)
+    duplicates = [[] for _ in range(len(encodings))]
+    if len(encodings) == 0:
+        return duplicates
+    for person_type in sorted(PERSON_TABLES):
+        gallery = get_live_gallery(person_type)
+        gallery = getattr(gallery, "gallery", gallery)  # The current snapshot of a LiveGallery
+        if gallery is None or len(gallery) == 0:
+            continue
+        distances = gallery.batch_distances(encodings)
+        rows, columns = np.nonzero(distances < threshold)
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            duplicates[row].append((person_type, int(gallery.ids[column]), float(distances[row, column])))
+    for found in duplicates:
+        found.sort(key=lambda duplicate: duplicate[2])
+    return duplicates
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Find faces enrolled under more than one ID.")
+    parser.add_argument('--threshold', type=float, default=DUPLICATE_THRESHOLD,
+                        help="Distance under which two encodings are reported as the same face.")
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="Rows per block of the all-pairs computation.")
+    parser.add_argument('--workers', type=int, default=None, help="Threads (default: number of CPUs).")
+    parser.add_argument('--output', help="Also write the clusters to this CSV file.")
+    args = parser.parse_args()
+
+    clusters = audit_duplicates(args.threshold, args.block_size, args.workers)
+    if clusters is None:
+        parser.exit(1, "Galleries could not be loaded.\n")
+
+    for number, cluster in enumerate(clusters, start=1):
+        members = ", ".join(f"{person_type} {person_id} ({distance:.3f})" for person_type, person_id, distance in cluster["members"])
+        print(f"Cluster {number}: {members}")
+    print(f"{len(clusters)} near-duplicate clusters found under distance {args.threshold}.")
+
+    if args.output:
+        with open(args.output, "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["cluster", "person_type", "person_id", "nearest_distance"])
+            for number, cluster in enumerate(clusters, start=1):
+                for person_type, person_id, distance in cluster["members"]:
+                    writer.writerow([number, person_type, person_id, f"{distance:.4f}"])
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the matching, capture and database write paths.
+
+Run everything with `python -m benchmarks` from the project root; see
+`python -m benchmarks --help` for the gallery sizes, fixture directory and
+JSON output options.
+"""
@@ -0,0 +1,74 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+
+from .harness import environment
+from .synthetic import StandInDatabase, synthetic_gallery
+
+
+def run(sizes, fixtures=None, ann=False, workers=None, shards=None):
+    """Run every benchmark and return the results as a JSON-serialisable dict."""
+    from . import bench_db, bench_matching
+    from .stand_in import using_database
+
+    results = []
+
+    def record(name, size, stats):
+        results.append({"name": name, "gallery_size": size, **stats})
+        print(f"{name:<36} n={size:<8} p50={stats['p50_ms']:9.3f} ms  p99={stats['p99_ms']:9.3f} ms  "
+              f"{stats['throughput_per_s']:10.1f}/s", file=sys.stderr)
+
+    for size in sizes:
+        ids, encodings = synthetic_gallery(size)
+        database = StandInDatabase(ids, encodings)
+        try:
+            with using_database(database):
+                record("gallery.load", size, bench_matching.bench_gallery_load(size))
+                for name, stats in bench_matching.bench_identify(ids, encodings).items():
+                    record(name, size, stats)
+                record("identify.find_person_by_biometric", size, bench_matching.bench_find_person(size))
+                record("verify.is_match", size, bench_matching.bench_verify(ids, encodings))
+                record("attendance.record_attendance", size, bench_db.bench_record_attendance(ids, encodings))
+                record("attendance.writer", size, bench_db.bench_attendance_writer(ids))
+                if ann:
+                    record("identify.ivf", size, bench_matching.bench_ann(ids, encodings))
+                if shards:
+                    for name, stats in bench_matching.bench_sharded(ids, encodings, shards).items():
+                        record(name, size, stats)
+        finally:
+            database.close()
+
+    if fixtures:
+        from .bench_pipeline import bench_frame_pipeline
+        for name, stats in bench_frame_pipeline(fixtures, pool_workers=workers).items():
+            record(name, 0, stats)
+
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "environment": environment(), "results": results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmark matching, capture and database write paths.")
+    parser.add_argument('--sizes', default="1000,10000",
+                        help="Comma-separated synthetic gallery sizes, e.g. 1000,100000,1000000.")
+    parser.add_argument('--fixtures', help="Directory of face images to run the frame-pipeline benchmarks on.")
+    parser.add_argument('--ann', action='store_true', help="Also build and benchmark the IVF index.")
+    parser.add_argument('--shards', type=int, default=None, help="Also benchmark exact search split into this many shards.")
+    parser.add_argument('--workers', type=int, default=None, help="Encoding worker processes for the pool benchmark.")
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)  # The code under test logs every match
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # ... and prints every mark
+        report = run([int(size) for size in args.sizes.split(",") if size], args.fixtures, args.ann, args.workers, args.shards)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,39 @@
+import time
+
+import numpy as np
+
+import attendances
+from attendance_writer import AttendanceWriter
+
+from .harness import measure, summarize
+
+
+def bench_record_attendance(ids, encodings, marks=200):
+    """One record_attendance call (verify + journal) per student, as the scan loop used to do."""
+    rng = np.random.default_rng(2)
+    rows = rng.integers(0, len(ids), marks + 5)
+    cursor = iter(rows)
+
+    def record():
+        row = next(cursor)
+        attendances.record_attendance(1, int(ids[row]), encodings[row].tobytes())
+
+    return measure(record, iterations=marks)
+
+
+def bench_attendance_writer(ids, marks=200, batch_size=50):
+    """Journal `marks` marks on an AttendanceWriter and time the journaling and the final flush."""
+    writer = AttendanceWriter(2, batch_size=batch_size, flush_interval=3600)
+    latencies = np.empty(marks)
+    started = time.perf_counter()
+    for i in range(marks):
+        t0 = time.perf_counter()
+        writer.mark(int(ids[i % len(ids)]))
+        latencies[i] = time.perf_counter() - t0
+    flush_started = time.perf_counter()
+    writer.close()
+    finished = time.perf_counter()
+
+    result = summarize(latencies, finished - started, marks)
+    result["close_flush_ms"] = (finished - flush_started) * 1000.0
+    return result
@@ -0,0 +1,94 @@
+import numpy as np
+
+import biometric_utils
+from ann_index import IVFIndex
+from gallery import Gallery
+from sharded_search import ShardedGallery
+
+from .harness import measure
+from .synthetic import synthetic_probes
+
+
+def iterations_for(size, budget=2_000_000, low=5, high=200):
+    """Fewer timed iterations for larger galleries so every benchmark takes a similar time."""
+    return int(max(low, min(high, budget // max(size, 1))))
+
+
+def bench_gallery_load(size):
+    """Full table read + decode + matrix build, as paid by every scan before an in-process cache."""
+    return measure(lambda: biometric_utils.load_gallery("student"), iterations=iterations_for(size, 200_000), warmup=1)
+
+
+def bench_identify(ids, encodings, probes=200):
+    """1:N identification against an in-memory gallery, one probe at a time and as a frame batch."""
+    gallery = Gallery(ids, encodings)
+    _, probe_matrix = synthetic_probes(encodings, probes)
+    cursor = iter(range(10 ** 9))
+
+    results = {
+        "identify.single": measure(lambda: gallery.match(probe_matrix[next(cursor) % probes]),
+                                   iterations=iterations_for(len(ids))),
+        "identify.batch30": measure(lambda: gallery.match_batch(probe_matrix[:30]),
+                                    iterations=iterations_for(30 * len(ids), low=3)),
+    }
+    results["identify.batch30"]["faces_per_s"] = results["identify.batch30"]["throughput_per_s"] * 30
+    return results
+
+
+def bench_find_person(size):
+    """find_person_by_biometric end to end (live gallery loaded on the first call, then polled in the background)."""
+    gallery = biometric_utils.load_gallery("student")
+    _, probe_matrix = synthetic_probes(gallery.matrix, 50)
+    cursor = iter(range(10 ** 9))
+    return measure(lambda: biometric_utils.find_person_by_biometric(probe_matrix[next(cursor) % 50], "student"),
+                   iterations=iterations_for(size, 200_000), warmup=1)
+
+
+def bench_sharded(ids, encodings, shards, probes=200):
+    """Exact identification with the gallery split into shards searched in parallel."""
+    gallery = ShardedGallery(Gallery(ids, encodings), shards)
+    _, probe_matrix = synthetic_probes(encodings, probes)
+    cursor = iter(range(10 ** 9))
+
+    results = {
+        "identify.sharded.single": measure(lambda: gallery.match(probe_matrix[next(cursor) % probes]),
+                                           iterations=iterations_for(len(ids))),
+        "identify.sharded.batch30": measure(lambda: gallery.match_batch(probe_matrix[:30]),
+                                            iterations=iterations_for(30 * len(ids), low=3)),
+    }
+    results["identify.sharded.batch30"]["faces_per_s"] = results["identify.sharded.batch30"]["throughput_per_s"] * 30
+    for stats in results.values():
+        stats["shards"] = len(gallery.shard_bounds(len(ids)))
+    return results
+
+
+def bench_verify(ids, encodings):
+    """1:1 verification with is_match against the stand-in database."""
+    rows, probe_matrix = synthetic_probes(encodings, 100)
+    cursor = iter(range(10 ** 9))
+
+    def verify():
+        i = next(cursor) % 100
+        biometric_utils.is_match(probe_matrix[i].tobytes(), int(ids[rows[i]]))
+
+    return measure(verify, iterations=200)
+
+
+def bench_ann(ids, encodings, n_probe=8, probes=200):
+    """IVF index build time, query latency and recall@1 against the exact gallery."""
+    import time
+
+    started = time.perf_counter()
+    index = IVFIndex.build(ids, encodings, n_probe=n_probe)
+    build_seconds = time.perf_counter() - started
+
+    gallery = Gallery(ids, encodings)
+    _, probe_matrix = synthetic_probes(encodings, probes)
+    exact = np.array([gallery.match(probe).top_k[0][0] for probe in probe_matrix])
+    approximate = np.array([index.match(probe).top_k[0][0] for probe in probe_matrix])
+
+    cursor = iter(range(10 ** 9))
+    result = measure(lambda: index.match(probe_matrix[next(cursor) % probes]), iterations=iterations_for(len(ids) // 20))
+    result.update({"build_s": build_seconds, "n_lists": index.n_lists, "n_probe": index.n_probe,
+                   "recall_at_1": float(np.mean(exact == approximate))})
+    return result
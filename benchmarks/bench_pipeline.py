@@ -0,0 +1,65 @@
+import cv2
+
+from .harness import measure
+
+
+def load_fixture_frames(directory):
+    """Read every image of a fixture directory as an RGB frame, in file name order."""
+    from frame_sources import ImageDirectorySource
+
+    frames = []
+    source = ImageDirectorySource(directory)
+    while True:
+        ret, frame = source.read()
+        if not ret:
+            return frames
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+def bench_frame_pipeline(directory, pool_workers=None):
+    """Detection, encoding and tracked encoding per frame over image fixtures instead of a camera."""
+    import face_recognition
+    from encoding_pool import EncodingPool, encode_frame
+    from face_detection import detect_face_locations
+    from face_tracker import FaceTracker
+    from gallery import MatchResult
+
+    frames = load_fixture_frames(directory)
+    if not frames:
+        return {}
+    cursor = iter(range(10 ** 9))
+
+    def next_frame():
+        return frames[next(cursor) % len(frames)]
+
+    iterations = max(len(frames), 20)
+    results = {
+        "pipeline.detect_haar": measure(lambda: detect_face_locations(next_frame()), iterations=iterations),
+        "pipeline.detect_hog": measure(lambda: face_recognition.face_locations(next_frame()), iterations=iterations),
+        "pipeline.encode_frame": measure(lambda: encode_frame(next_frame()), iterations=iterations),
+    }
+
+    tracker = FaceTracker()
+    frame_number = iter(range(1, 10 ** 9))
+
+    def tracked():
+        number, frame = next(frame_number), next_frame()
+        due = tracker.update(number, detect_face_locations(frame))
+        if due:
+            face_recognition.face_encodings(frame, known_face_locations=[track.box for track in due])
+            for track in due:
+                # A confident result, so the tracker only re-encodes on its recheck interval
+                tracker.record_match(track, MatchResult(track.track_id, 0.0, float("inf")), number)
+
+    results["pipeline.tracked_frame"] = measure(tracked, iterations=iterations)
+
+    pool = EncodingPool(workers=pool_workers)
+    try:
+        pool.map(frames[:pool.workers])  # Start the workers before timing
+        results["pipeline.pool_map"] = measure(lambda: pool.map(frames), iterations=3, warmup=0)
+        results["pipeline.pool_map"]["frames_per_s"] = results["pipeline.pool_map"]["throughput_per_s"] * len(frames)
+        results["pipeline.pool_map"]["workers"] = pool.workers
+    finally:
+        pool.close()
+    return results
+
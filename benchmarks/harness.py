@@ -0,0 +1,56 @@
+import platform
+import time
+
+import numpy as np
+
+
+def measure(fn, iterations=100, warmup=5):
+    """
+    Time repeated calls of a function.
+
+    Args:
+        fn (callable): Called with no arguments once per iteration.
+        iterations (int): Timed calls.
+        warmup (int): Untimed calls made first.
+
+    Returns:
+        dict: Latency percentiles in milliseconds and throughput in calls per second.
+    """
+    for _ in range(warmup):
+        fn()
+
+    latencies = np.empty(iterations)
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        latencies[i] = time.perf_counter() - t0
+    elapsed = time.perf_counter() - started
+
+    return summarize(latencies, elapsed, iterations)
+
+
+def summarize(latencies, elapsed, operations):
+    """Latency percentiles (ms) of a set of timings plus the throughput of `operations` in `elapsed` seconds."""
+    latencies_ms = np.asarray(latencies) * 1000.0
+    return {
+        "iterations": int(len(latencies_ms)),
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p90_ms": float(np.percentile(latencies_ms, 90)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+        "throughput_per_s": float(operations / elapsed) if elapsed > 0 else float("inf"),
+    }
+
+
+def environment():
+    """Describe the machine a run happened on, so results can be compared across runs."""
+    import os
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
@@ -0,0 +1,37 @@
+import contextlib
+import os
+import tempfile
+
+import attendance_journal
+import attendance_writer
+import biometric_utils
+import gallery_snapshot
+
+# Modules that bound DBconfig.get_db_connection at import time
+DB_MODULES = (biometric_utils, gallery_snapshot, attendance_writer)
+
+
+@contextlib.contextmanager
+def using_database(database):
+    """
+    Route the application's database calls to a StandInDatabase for the duration of the block,
+    with attendance marks journaled in a temporary journal.
+    """
+    saved = [(module, module.get_db_connection) for module in DB_MODULES]
+    saved_journal = attendance_journal._journal
+    with tempfile.TemporaryDirectory() as directory:
+        journal = attendance_journal.AttendanceJournal(os.path.join(directory, "journal.sqlite3"))
+        try:
+            biometric_utils.reset_live_galleries()
+            for module in DB_MODULES:
+                module.get_db_connection = database.get_connection
+            attendance_journal._journal = journal
+            yield database
+        finally:
+            attendance_writer.close_all_attendance_writers()
+            attendance_writer.stop_journal_replayer(journal)
+            journal.close()
+            attendance_journal._journal = saved_journal
+            biometric_utils.reset_live_galleries()
+            for module, get_db_connection in saved:
+                module.get_db_connection = get_db_connection
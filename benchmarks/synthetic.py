@@ -0,0 +1,164 @@
+import os
+import re
+import sqlite3
+import tempfile
+
+import mysql.connector
+import numpy as np
+
+from encoding_format import encode_encoding
+from gallery import ENCODING_DIM
+
+# Spread of real dlib encodings around a person's mean, and of the people around each other
+IDENTITY_SCALE = 0.09
+CAPTURE_NOISE = 0.02
+
+
+def synthetic_gallery(size, seed=0):
+    """
+    Generate random 128-d encodings shaped roughly like dlib's.
+
+    Returns:
+        tuple: (ids, encodings) with ids starting at 1.
+    """
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(scale=IDENTITY_SCALE, size=(size, ENCODING_DIM))
+    return np.arange(1, size + 1, dtype=np.int64), encodings
+
+
+def synthetic_probes(encodings, count, seed=1):
+    """Noisy re-captures of randomly chosen gallery entries, with the index of the entry each came from."""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(encodings), count)
+    return rows, encodings[rows] + rng.normal(scale=CAPTURE_NOISE, size=(count, encodings.shape[1]))
+
+
+STAND_IN_SCHEMA = """
+    CREATE TABLE students (
+        enrollment_id INTEGER PRIMARY KEY,
+        course_id INTEGER,
+        first_name TEXT, last_name TEXT, email TEXT,
+        biometric_data BLOB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE teachers (
+        teacher_id INTEGER PRIMARY KEY,
+        first_name TEXT, last_name TEXT, email TEXT,
+        biometric_data BLOB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE availableclasses (
+        available_class_id INTEGER PRIMARY KEY,
+        subject_id INTEGER, course_id INTEGER, section_id INTEGER
+    );
+    CREATE TABLE sessions (
+        session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        available_class_id INTEGER, teacher_id INTEGER,
+        start_time TIMESTAMP, end_time TIMESTAMP,
+        status TEXT DEFAULT 'ongoing',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE attendances (
+        attendance_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER REFERENCES sessions (session_id),
+        enrollment_id INTEGER REFERENCES students (enrollment_id),
+        excuse_reason_id INTEGER,
+        attendance_status TEXT DEFAULT 'absent',
+        attendance_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (session_id, enrollment_id)
+    );
+    CREATE TABLE gallery_changes (
+        change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        person_type TEXT, person_id INTEGER, operation TEXT,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+def _to_sqlite(query):
+    query = query.replace("%s", "?").replace("INSERT IGNORE", "INSERT OR IGNORE")
+    query = query.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+    return re.sub(r"VALUES\((\w+)\)", r"excluded.\1", query)
+
+
+class _StandInCursor:
+    """
+    sqlite3 cursor that accepts the MySQL %s placeholders, INSERT IGNORE and ON DUPLICATE KEY UPDATE,
+    raises constraint violations as mysql.connector.IntegrityError, and works as a context manager.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, query, params=()):
+        try:
+            return self._cursor.execute(_to_sqlite(query), params)
+        except sqlite3.IntegrityError as e:
+            raise mysql.connector.IntegrityError(str(e)) from e
+
+    def executemany(self, query, rows):
+        try:
+            return self._cursor.executemany(_to_sqlite(query), rows)
+        except sqlite3.IntegrityError as e:
+            raise mysql.connector.IntegrityError(str(e)) from e
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class StandInConnection:
+    """The subset of a mysql.connector connection the application uses, backed by sqlite3."""
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+
+    def cursor(self, dictionary=False):
+        if dictionary:
+            self._connection.row_factory = sqlite3.Row
+        return _StandInCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+class StandInDatabase:
+    """
+    A throwaway sqlite database laid out like the MySQL schema and seeded with synthetic encodings.
+
+    get_connection() can replace DBconfig.get_db_connection in the modules under test.
+    """
+
+    def __init__(self, ids, encodings, dtype=np.float64, directory=None):
+        handle, self.path = tempfile.mkstemp(suffix=".sqlite", dir=directory)
+        os.close(handle)
+
+        connection = sqlite3.connect(self.path)
+        connection.executescript(STAND_IN_SCHEMA)
+        connection.execute("INSERT INTO availableclasses (available_class_id, subject_id, course_id, section_id) VALUES (1, 1, 1, 1)")
+        connection.execute("INSERT INTO sessions (available_class_id, teacher_id, status) VALUES (1, 1, 'ongoing')")
+        connection.executemany(
+            "INSERT INTO students (enrollment_id, course_id, biometric_data) VALUES (?, ?, ?)",
+            ((int(person_id), 1 + int(person_id) % 50, encode_encoding(encoding, dtype))
+             for person_id, encoding in zip(ids, encodings)))
+        connection.commit()
+        connection.close()
+
+    def get_connection(self):
+        return StandInConnection(self.path)
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,27 +1,47 @@
 import mysql.connector
+import copy
 import logging
+import os
+import threading
 from DBconfig import get_db_connection
 from typing import Optional
 import face_recognition
-import pickle
 import numpy as np
+from encoding_format import decode_encoding
+from gallery import Gallery, LiveGallery
+from gallery_snapshot import GALLERY_SNAPSHOT_DIR, sync_snapshot
+from shared_gallery import SHARED_GALLERY, attach_shared_gallery
+from metrics import stage, timed
+from ann_index import IVFIndex
+from sharded_search import SEARCH_SHARDS, ShardedGallery
 
-def find_person_by_biometric(biometric_data: bytes, person_type: str, threshold: float = 0.6) -> Optional[int]:
-    """
-    Find a person (student or teacher) in the database using their biometric data.
+# Person type -> (ID column, table) used to build a gallery
+PERSON_TABLES = {
+    'student': ('enrollment_id', 'students'),
+    'teacher': ('teacher_id', 'teachers'),
+}
 
-    Args:
-        biometric_data (bytes): The biometric data (face encoding) to search for.
-        person_type (str): The type of person to search for ('student' or 'teacher').
-        threshold (float): The distance threshold for face recognition comparison.
+# Optional IVF index for very large galleries: built with `python ann_index.py <person_type>`
+# into AMS_ANN_INDEX_DIR and used by find_person_by_biometric whenever it exists there.
+ANN_INDEX_DIR = os.environ.get("AMS_ANN_INDEX_DIR")
+ANN_N_PROBE = os.environ.get("AMS_ANN_N_PROBE")
 
-    Returns:
-        Optional[int]: The ID of the matching person, or None if not found.
-    """
-    if biometric_data is None:
-        logging.warning("No biometric data provided.")
-        return None
+_ann_indexes = {}
+_ann_lock = threading.Lock()
+
+# Seconds between polls of gallery_changes by the process-wide live galleries (0 reloads on every lookup)
+GALLERY_REFRESH_INTERVAL = float(os.environ.get("AMS_GALLERY_REFRESH_INTERVAL", 5))
+# More pending changes than this (e.g. after migrate_encodings.py) are applied with one full reload
+GALLERY_RELOAD_CHANGES = 5000
+# IDs per IN (...) list when fetching changed rows
+CHANGED_ROWS_CHUNK = 1000
+
+_live_galleries = {}
+_live_lock = threading.Lock()
 
+
+def _load_gallery_rows(query: str, params: tuple = ()) -> Optional[Gallery]:
+    """Build a gallery from a query returning (person_id, biometric_data) rows."""
     db = None
     cursor = None
     try:
@@ -31,28 +51,12 @@ def find_person_by_biometric(biometric_data: bytes, person_type: str, threshold:
             return None
         cursor = db.cursor()
 
-        if person_type == 'student':
-            query = "SELECT enrollment_id, biometric_data FROM students"
-        elif person_type == 'teacher':
-            query = "SELECT teacher_id, biometric_data FROM teachers"
-        else:
-            logging.error("Invalid person type specified. Must be 'student' or 'teacher'.")
-            return None
-
-        cursor.execute(query)
+        cursor.execute(query, params)
         persons = cursor.fetchall()
 
-        for person_id, stored_biometric_data in persons:
-            stored_biometric_data = pickle.loads(stored_biometric_data)
-            matches = face_recognition.compare_faces([stored_biometric_data], biometric_data)
-            distance = face_recognition.face_distance([stored_biometric_data], biometric_data)
-
-            if matches[0] and distance[0] < threshold:
-                logging.info(f"{person_type.capitalize()} found with ID: {person_id}")
-                return person_id
-
-        logging.info(f"No matching {person_type} found with the provided biometric data.")
-        return None
+        ids = [person_id for person_id, _ in persons]
+        encodings = [decode_encoding(stored_biometric_data) for _, stored_biometric_data in persons]
+        return Gallery(ids, encodings)
 
     except mysql.connector.Error as err:
         logging.error(f"Database error: {err}")
@@ -65,6 +69,368 @@ def find_person_by_biometric(biometric_data: bytes, person_type: str, threshold:
             db.close()
 
 
+def load_gallery(person_type: str) -> Optional[Gallery]:
+    """
+    Load every stored encoding of the given person type into an in-memory gallery.
+
+    With AMS_GALLERY_SNAPSHOT_DIR set, the gallery is memory-mapped from the local
+    snapshot, and only the rows created since the snapshot are fetched.
+
+    Args:
+        person_type (str): The type of person to load ('student' or 'teacher').
+
+    Returns:
+        Optional[Gallery]: The gallery, or None if the type is invalid or the database failed.
+    """
+    if person_type not in PERSON_TABLES:
+        logging.error("Invalid person type specified. Must be 'student' or 'teacher'.")
+        return None
+    id_column, table = PERSON_TABLES[person_type]
+
+    if GALLERY_SNAPSHOT_DIR:
+        return sync_snapshot(person_type, id_column, table)
+    return _load_gallery_rows(f"SELECT {id_column}, biometric_data FROM {table} WHERE biometric_data IS NOT NULL")
+
+
+def load_class_roster_gallery(available_class_id: int) -> Optional[Gallery]:
+    """
+    Load the encodings of the students on the roster of one class.
+
+    The roster is every student enrolled in the course the class (availableclasses row)
+    belongs to.
+
+    Args:
+        available_class_id (int): The availableclasses row selected for the session.
+
+    Returns:
+        Optional[Gallery]: The roster gallery, or None if the database failed.
+    """
+    query = """
+        SELECT s.enrollment_id, s.biometric_data
+        FROM students s
+        JOIN availableclasses ac ON s.course_id = ac.course_id
+        WHERE ac.available_class_id = %s AND s.biometric_data IS NOT NULL
+    """
+    return _load_gallery_rows(query, (available_class_id,))
+
+
+def _read_watermark(cursor, person_type: str):
+    """
+    Latest gallery_changes ID of a person type.
+
+    Databases created before gallery_changes existed fall back to the (row count, newest
+    created_at) of the table, which catches registrations and deletions but not updates.
+    """
+    try:
+        cursor.execute("SELECT COALESCE(MAX(change_id), 0) FROM gallery_changes WHERE person_type = %s", (person_type,))
+        return int(cursor.fetchone()[0])
+    except mysql.connector.ProgrammingError:
+        _, table = PERSON_TABLES[person_type]
+        cursor.execute(f"SELECT COUNT(*), MAX(created_at) FROM {table} WHERE biometric_data IS NOT NULL")
+        count, newest = cursor.fetchone()
+        return int(count), str(newest)
+
+
+def load_watermarked_gallery(person_type: str):
+    """Full load for a LiveGallery: (watermark, gallery), with the watermark read before the rows."""
+    db = get_db_connection()
+    if db is None:
+        logging.error("Database connection failed.")
+        return None, None
+    try:
+        with db.cursor() as cursor:
+            watermark = _read_watermark(cursor, person_type)
+    except mysql.connector.Error as err:
+        logging.error(f"Database error: {err}")
+        return None, None
+    finally:
+        db.close()
+    return watermark, load_gallery(person_type)
+
+
+def fetch_gallery_changes(person_type: str, watermark, reload_changes=GALLERY_RELOAD_CHANGES):
+    """
+    Read the gallery changes of a person type since a watermark (see LiveGallery).
+
+    The change log only says which IDs changed; their current rows are fetched, so an
+    ID that no longer has an encoding is removed whatever its last operation was.
+    More than `reload_changes` changes ask for a full reload instead (None: never).
+
+    Returns:
+        Optional[tuple]: (watermark, removed_ids, ids, encodings), (watermark, LiveGallery.RELOAD),
+                         or None if the database could not be read.
+    """
+    db = get_db_connection()
+    if db is None:
+        return None
+    id_column, table = PERSON_TABLES[person_type]
+    try:
+        with db.cursor() as cursor:
+            if watermark is None or isinstance(watermark, tuple):
+                current = _read_watermark(cursor, person_type)
+                return None if current == watermark else (current, LiveGallery.RELOAD)
+
+            cursor.execute("SELECT change_id, person_id FROM gallery_changes "
+                           "WHERE person_type = %s AND change_id > %s ORDER BY change_id", (person_type, watermark))
+            changes = cursor.fetchall()
+            if not changes:
+                return watermark, [], [], []
+            if reload_changes is not None and len(changes) > reload_changes:
+                return changes[-1][0], LiveGallery.RELOAD
+
+            changed_ids = sorted({person_id for _, person_id in changes})
+            ids, encodings = [], []
+            for start in range(0, len(changed_ids), CHANGED_ROWS_CHUNK):
+                chunk = changed_ids[start:start + CHANGED_ROWS_CHUNK]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"SELECT {id_column}, biometric_data FROM {table} "
+                               f"WHERE {id_column} IN ({placeholders}) AND biometric_data IS NOT NULL", chunk)
+                for person_id, stored_biometric_data in cursor.fetchall():
+                    ids.append(person_id)
+                    encodings.append(decode_encoding(stored_biometric_data))
+            removed_ids = sorted(set(changed_ids) - set(ids))
+            return changes[-1][0], removed_ids, ids, encodings
+    except mysql.connector.Error as err:
+        logging.error(f"Database error while reading gallery changes: {err}")
+        return None
+    finally:
+        db.close()
+
+
+def get_live_gallery(person_type: str, attach_shared: bool = True):
+    """
+    Return the process-wide gallery of a person type, kept current by polling gallery_changes.
+
+    Registrations, updates and deletions show up within AMS_GALLERY_REFRESH_INTERVAL
+    seconds without a full reload. With an interval of 0 every call loads the gallery afresh.
+    With AMS_SHARED_GALLERY=1 the gallery published by `python shared_gallery.py` is
+    attached instead, and only loaded here if none has been published.
+
+    Args:
+        person_type (str): 'student' or 'teacher'.
+        attach_shared (bool): False to always hold a gallery of this process's own (the publisher).
+
+    Returns:
+        The LiveGallery (or SharedGallery, or Gallery), or None if the type is invalid or the database failed.
+    """
+    if SHARED_GALLERY and attach_shared and person_type in PERSON_TABLES:
+        shared = attach_shared_gallery(person_type)
+        if shared is not None:
+            return shared
+        if person_type not in _live_galleries:
+            logging.warning(f"No shared {person_type} gallery has been published. Loading it in this process.")
+
+    if GALLERY_REFRESH_INTERVAL <= 0 or person_type not in PERSON_TABLES:
+        return load_gallery(person_type)
+
+    with _live_lock:
+        live = _live_galleries.get(person_type)
+        if live is None:
+            watermark, gallery = load_watermarked_gallery(person_type)
+            if gallery is None:
+                return None
+            live = LiveGallery(gallery, watermark, lambda: load_watermarked_gallery(person_type),
+                               lambda since: fetch_gallery_changes(person_type, since),
+                               poll_interval=GALLERY_REFRESH_INTERVAL).start()
+            _live_galleries[person_type] = live
+        return live
+
+
+def reset_live_galleries() -> None:
+    """Stop the live gallery pollers and forget their galleries (e.g. after switching databases)."""
+    with _live_lock:
+        for live in _live_galleries.values():
+            live.stop()
+        _live_galleries.clear()
+    with _ann_lock:
+        for _, live in _ann_indexes.values():
+            live.stop()
+        _ann_indexes.clear()
+
+
+def ann_index_path(person_type: str) -> Optional[str]:
+    """Location of the IVF index file of a person type, or None if ANN search is not configured."""
+    if not ANN_INDEX_DIR:
+        return None
+    return os.path.join(ANN_INDEX_DIR, f"{person_type}_ivf.npz")
+
+
+def _index_file_stamp(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _load_watermarked_ann_index(person_type: str, path: str):
+    """
+    Full load for the LiveGallery of an index: (watermark, IVFIndex).
+
+    The changes made since the index was saved (registrations, re-enrollments and
+    deletions by any process) are applied on top of it. Indexes saved without a
+    watermark, or databases without gallery_changes, take the current watermark instead.
+    """
+    try:
+        index = IVFIndex.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Could not load IVF index '{path}': {e}")
+        return None, None
+    if ANN_N_PROBE:
+        index.n_probe = int(ANN_N_PROBE)
+
+    if index.watermark is None:
+        db = get_db_connection()
+        if db is None:
+            logging.error("Database connection failed.")
+            return None, index
+        try:
+            with db.cursor() as cursor:
+                return _read_watermark(cursor, person_type), index
+        except mysql.connector.Error as err:
+            logging.error(f"Database error: {err}")
+            return None, index
+        finally:
+            db.close()
+
+    changes = fetch_gallery_changes(person_type, index.watermark, reload_changes=None)
+    if changes is None:
+        return index.watermark, index  # Caught up by the next poll
+    watermark, removed_ids, ids, encodings = changes
+    return watermark, index.with_changes(removed_ids, ids, encodings)
+
+
+def get_ann_index(person_type: str) -> Optional[LiveGallery]:
+    """
+    Return the persisted IVF index of a person type, kept current like the live gallery.
+
+    Changes recorded in gallery_changes are applied to the index every
+    AMS_GALLERY_REFRESH_INTERVAL seconds, and the index is loaded again when its file
+    is rebuilt (e.g. by `python ann_index.py`).
+
+    Returns:
+        Optional[LiveGallery]: The live index, or None if ANN search is not configured or not built.
+    """
+    path = ann_index_path(person_type)
+    if path is None:
+        return None
+
+    stamp = _index_file_stamp(path)
+    with _ann_lock:
+        cached = _ann_indexes.get(person_type)
+        if cached is not None and cached[0] == stamp:
+            live = cached[1]
+        else:
+            if cached is not None:
+                cached[1].stop()
+                del _ann_indexes[person_type]
+                logging.info(f"IVF index for {person_type}s changed on disk. Loading it again.")
+            if stamp is None:
+                return None
+            watermark, index = _load_watermarked_ann_index(person_type, path)
+            if index is None:
+                return None
+            live = LiveGallery(index, watermark, lambda: _load_watermarked_ann_index(person_type, path),
+                               lambda since: fetch_gallery_changes(person_type, since),
+                               poll_interval=GALLERY_REFRESH_INTERVAL)
+            if GALLERY_REFRESH_INTERVAL > 0:
+                live.start()
+            _ann_indexes[person_type] = (stamp, live)
+            logging.info(f"Loaded IVF index for {person_type}s: {len(index)} encodings in {index.n_lists} lists.")
+            return live
+
+    if GALLERY_REFRESH_INTERVAL <= 0:
+        live.refresh()
+    return live
+
+
+def add_to_ann_index(person_type: str, person_id: int, encoding) -> None:
+    """Insert a newly registered encoding into the persisted IVF index, if there is one."""
+    add_batch_to_ann_index(person_type, [person_id], [encoding])
+
+
+def add_batch_to_ann_index(person_type: str, person_ids, encodings) -> None:
+    """
+    Make several new encodings searchable in the IVF index right away, and persist them
+    with one write to disk.
+
+    The index is never modified in place: a new one is built (IVFIndex.with_changes) and
+    swapped in through its LiveGallery, which also picks the same rows up from
+    gallery_changes later.
+    """
+    live = get_ann_index(person_type)
+    if live is None:
+        return
+    index = live.apply_changes((), list(person_ids), encodings)
+    path = ann_index_path(person_type)
+    with _ann_lock:
+        if index.pending_count():
+            index.save_tail(path)
+        else:
+            # The inserts were merged into the inverted lists. Changes after the live
+            # watermark are applied again on load, which is harmless.
+            saved = copy.copy(index)
+            if isinstance(live.watermark, int):
+                saved.watermark = live.watermark
+            saved.save(path)
+            if person_type in _ann_indexes:
+                _ann_indexes[person_type] = (_index_file_stamp(path), live)
+
+
+def get_identification_gallery(person_type: str):
+    """
+    Return what 1:N identification of a person type searches: the live gallery split
+    into shards searched in parallel when AMS_SEARCH_SHARDS asks for exact sharded
+    search, otherwise the IVF index when one has been built for it (large galleries),
+    otherwise the process-wide live gallery.
+
+    Returns:
+        The sharded gallery, index or gallery (all provide match/match_batch), or None if loading failed.
+    """
+    if SEARCH_SHARDS:
+        gallery = get_live_gallery(person_type)
+        return ShardedGallery(gallery, SEARCH_SHARDS) if gallery is not None else None
+    gallery = get_ann_index(person_type)
+    if gallery is None:
+        gallery = get_live_gallery(person_type)
+    return gallery
+
+
+@timed("match.total")
+def find_person_by_biometric(biometric_data: bytes, person_type: str, threshold: float = 0.6) -> Optional[int]:
+    """
+    Find a person (student or teacher) in the database using their biometric data.
+
+    The probe is scored against the whole gallery at once and the closest entry
+    under the threshold wins, rather than the first row that happens to match.
+
+    Args:
+        biometric_data (bytes): The biometric data (face encoding) to search for.
+        person_type (str): The type of person to search for ('student' or 'teacher').
+        threshold (float): The distance threshold for face recognition comparison.
+
+    Returns:
+        Optional[int]: The ID of the matching person, or None if not found.
+    """
+    if biometric_data is None:
+        logging.warning("No biometric data provided.")
+        return None
+
+    with stage("match.load_gallery"):
+        gallery = get_identification_gallery(person_type)
+    if gallery is None:
+        return None
+
+    with stage("match.search"):
+        result = gallery.match(biometric_data, threshold=threshold)
+    if result.matched:
+        logging.info(f"{person_type.capitalize()} found with ID: {result.person_id} "
+                     f"(distance {result.distance:.3f}, margin {result.margin:.3f})")
+        return result.person_id
+
+    logging.info(f"No matching {person_type} found with the provided biometric data.")
+    return None
+
+
 
 
 def is_match(biometric_data: bytes, person_id: str) -> bool:
@@ -86,15 +452,15 @@ def is_match(biometric_data: bytes, person_id: str) -> bool:
     try:
         cursor = db.cursor()
 
-        # Query to get the pickled biometric data for the student
+        # Query to get the stored biometric data for the student
         query = "SELECT biometric_data FROM students WHERE enrollment_id = %s"
         
         cursor.execute(query, (person_id,))
         result = cursor.fetchone()
 
         if result:
-            # Unpickle the stored biometric data
-            saved_biometric_data = pickle.loads(result[0])
+            # Decode the stored biometric data (binary or legacy pickled format)
+            saved_biometric_data = decode_encoding(result[0])
 
             # Ensure the captured biometric data is in the correct format for comparison
             input_biometric_data = np.frombuffer(biometric_data, dtype=np.float64)
@@ -0,0 +1,358 @@
+
+# ______________________________________________________________BULK OFFLINE ENROLLMENT FROM CSV AND PHOTO FOLDERS_____________________________________________________________
+#
+#   python bulk_enroll.py student students.csv photos/
+#
+# The CSV has a header row naming the columns of ENROLL_COLUMNS; photos/<ID>/ holds the
+# photos of each person (every image with a face contributes to the mean encoding).
+# Committed IDs are appended to a progress file, so an interrupted run can simply be restarted.
+
+import argparse
+import csv
+import logging
+import os
+
+import mysql.connector
+import numpy as np
+from mysql.connector import IntegrityError
+
+from DBconfig import get_db_connection
+from audit_duplicates import find_enrolled_duplicates
+from biometric_utils import add_batch_to_ann_index
+from encoding_format import encode_encoding
+from encoding_pool import get_encoding_pool
+from frame_sources import IMAGE_EXTENSIONS
+from register import is_valid_course_id, is_valid_date, is_valid_email
+
+VALID_GENDERS = ('Male', 'male', 'Female', 'female', 'Other', 'other')
+
+# Person type -> (table, CSV/insert columns before biometric_data); the first column is the primary key
+ENROLL_COLUMNS = {
+    'student': ('students', ('enrollment_id', 'course_id', 'first_name', 'last_name', 'gender', 'date_of_birth',
+                             'email', 'phone_number', 'address')),
+    'teacher': ('teachers', ('teacher_id', 'first_name', 'last_name', 'gender', 'date_of_birth',
+                             'email', 'phone_number', 'address')),
+}
+
+# Values per IN (...) list when looking up existing IDs and emails
+LOOKUP_CHUNK_SIZE = 1000
+
+
+def validate_row(row, columns):
+    """
+    Validate one CSV row with the rules of the interactive registration.
+
+    A student's course_id is required here, although the interactive registration lets
+    it be left empty: a student without a course is on no class roster, so it would
+    never be identified first in its classes or marked absent.
+
+    Args:
+        row (dict): The CSV row.
+        columns (tuple): Columns of the target table, primary key first.
+
+    Returns:
+        tuple: (fields, None) with the values in column order, or (None, reason) if the row is invalid.
+    """
+    values = {column: (row.get(column) or '').strip() for column in columns}
+
+    person_id = values[columns[0]]
+    if not person_id.isdigit():
+        return None, f"invalid {columns[0]} '{person_id}'"
+    if not values['first_name'] or not values['last_name']:
+        return None, "first and last name are required"
+    if values['gender'] not in VALID_GENDERS:
+        return None, f"invalid gender '{values['gender']}'"
+    if not is_valid_date(values['date_of_birth']):
+        return None, "invalid date of birth (expected YYYY-MM-DD)"
+    if not is_valid_email(values['email']):
+        return None, f"invalid email '{values['email']}'"
+    if 'course_id' in values and not is_valid_course_id(values['course_id']):
+        return None, f"invalid course ID '{values['course_id']}'"
+
+    fields = []
+    for column in columns:
+        value = values[column] or None
+        if value is not None and column in (columns[0], 'course_id'):
+            value = int(value)
+        fields.append(value)
+    return tuple(fields), None
+
+
+def find_existing(table, id_column, person_ids, emails):
+    """
+    Look up which IDs and emails are already taken with a few set-based queries.
+
+    The email columns use a case-insensitive collation, so `email IN (...)` matches the
+    same rows as the LOWER(email) comparison of is_duplicate_email.
+
+    Returns:
+        tuple: (set of existing IDs, set of existing lower-cased emails), or None if the database failed.
+    """
+    db = get_db_connection()
+    if db is None:
+        logging.error("Database connection failed. Cannot check for existing records.")
+        return None
+
+    existing_ids, existing_emails = set(), set()
+    try:
+        with db.cursor() as cursor:
+            for column, values, found in ((id_column, list(person_ids), existing_ids),
+                                          ('email', list(emails), existing_emails)):
+                for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+                    chunk = values[start:start + LOOKUP_CHUNK_SIZE]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    cursor.execute(f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders})", chunk)
+                    found.update(value.lower() if isinstance(value, str) else value for value, in cursor.fetchall())
+        return existing_ids, existing_emails
+    except mysql.connector.Error as e:
+        logging.error(f"Error while checking for existing records: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def insert_batch(table, columns, rows):
+    """
+    Insert rows with a single multi-row INSERT and commit.
+
+    If the batch violates a constraint, it is rolled back and retried row by row so a
+    single bad row does not reject the whole batch.
+
+    Args:
+        table (str): Target table.
+        columns (tuple): Column names, biometric_data included.
+        rows (list): Value tuples in column order.
+
+    Returns:
+        list: The rows that were inserted (None if the database could not be reached).
+    """
+    db = get_db_connection()
+    if db is None:
+        logging.error("Database connection failed. Batch not inserted.")
+        return None
+
+    row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+    try:
+        with db.cursor() as cursor:
+            try:
+                cursor.execute(insert + ", ".join([row_placeholder] * len(rows)),
+                               [value for row in rows for value in row])
+                db.commit()
+                return rows
+            except IntegrityError as e:
+                db.rollback()
+                logging.warning(f"Batch of {len(rows)} rows rejected ({e}); inserting row by row.")
+
+            inserted = []
+            for row in rows:
+                try:
+                    cursor.execute(insert + row_placeholder, row)
+                    db.commit()
+                    inserted.append(row)
+                except IntegrityError as e:
+                    db.rollback()
+                    logging.error(f"{table} row {row[0]} rejected: {e}")
+            return inserted
+    except mysql.connector.Error as e:
+        logging.error(f"Error while inserting into {table}: {e}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+
+
+def load_progress(path):
+    """Return the IDs recorded as committed by a previous run."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {int(line) for line in f if line.strip().isdigit()}
+
+
+def append_progress(path, person_ids):
+    """Record committed IDs; written and synced only after the batch commit succeeded."""
+    with open(path, "a") as f:
+        f.writelines(f"{person_id}\n" for person_id in person_ids)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def photo_paths(photos_dir, person_id):
+    """Image files in the photo folder of one person (photos_dir/<ID>/)."""
+    person_dir = os.path.join(photos_dir, str(person_id))
+    if not os.path.isdir(person_dir):
+        return []
+    return [os.path.join(person_dir, name) for name in sorted(os.listdir(person_dir))
+            if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def mean_encoding(image_results, min_faces=1):
+    """Mean of the largest face of every photo, or None if fewer than min_faces photos had a face."""
+    encodings = [face_encodings[0] for _, face_encodings in image_results
+                 if face_encodings is not None and len(face_encodings) > 0]
+    if len(encodings) < min_faces:
+        return None
+    return np.mean(encodings, axis=0)
+
+
+def bulk_enroll(person_type, csv_path, photos_dir, batch_size=500, progress_path=None, rejects_path=None,
+                min_faces=1, dry_run=False, allow_duplicate_faces=False):
+    """
+    Enroll every person of a CSV file, encoding their photos across the encoding worker processes.
+
+    Rows are validated, filtered against the progress file and the database in bulk,
+    encoded in parallel, and inserted batch_size at a time. The IDs of each committed
+    batch are appended to the progress file, so rerunning the same command resumes
+    where an interrupted run stopped. Rejected rows are written to a CSV with the reason.
+
+    Args:
+        person_type (str): 'student' or 'teacher'.
+        csv_path (str): CSV with a header row of the table's column names.
+        photos_dir (str): Directory holding one sub-directory of photos per person ID.
+        batch_size (int): Rows per multi-row INSERT and commit.
+        progress_path (str, optional): Progress file; defaults to '<csv_path>.progress'.
+        rejects_path (str, optional): Rejected rows; defaults to '<csv_path>.rejected.csv'.
+        min_faces (int): Photos with a detectable face required per person.
+        dry_run (bool): Validate and encode without writing to the database or the progress file.
+        allow_duplicate_faces (bool): Enroll faces that are already enrolled under another ID.
+
+    Returns:
+        dict: Counts of 'enrolled', 'skipped' (already done) and 'rejected' rows.
+    """
+    table, columns = ENROLL_COLUMNS[person_type]
+    progress_path = progress_path or f"{csv_path}.progress"
+    rejects_path = rejects_path or f"{csv_path}.rejected.csv"
+    summary = {'enrolled': 0, 'skipped': 0, 'rejected': 0}
+    rejects = []
+
+    def reject(row, reason):
+        rejects.append({**row, 'reason': reason})
+        summary['rejected'] += 1
+
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.DictReader(f))
+
+    # Field validation, resume, and duplicates within the file itself
+    done = load_progress(progress_path)
+    pending, seen_ids, seen_emails = [], set(), set()
+    for row in rows:
+        fields, reason = validate_row(row, columns)
+        if fields is None:
+            reject(row, reason)
+            continue
+        person_id, email = fields[0], fields[columns.index('email')].lower()
+        if person_id in done:
+            summary['skipped'] += 1
+        elif person_id in seen_ids or email in seen_emails:
+            reject(row, "duplicate ID or email within the file")
+        else:
+            seen_ids.add(person_id)
+            seen_emails.add(email)
+            pending.append((row, fields))
+
+    # Duplicates against the database, in a few set-based queries
+    if pending:
+        existing = find_existing(table, columns[0], seen_ids, seen_emails)
+        if existing is None:
+            return summary
+        existing_ids, existing_emails = existing
+        unique = []
+        for row, fields in pending:
+            if fields[0] in existing_ids:
+                reject(row, f"{columns[0]} already registered")
+            elif fields[columns.index('email')].lower() in existing_emails:
+                reject(row, "email already registered")
+            else:
+                unique.append((row, fields))
+        pending = unique
+
+    # Photos
+    with_photos = []
+    for row, fields in pending:
+        paths = photo_paths(photos_dir, fields[0])
+        if paths:
+            with_photos.append((row, fields, paths))
+        else:
+            reject(row, "no photos found")
+
+    print(f"{len(with_photos)} {person_type}s to enroll, {summary['skipped']} already done, "
+          f"{summary['rejected']} rejected so far.")
+
+    def flush(batch):
+        if not allow_duplicate_faces:
+            # One vectorized check of the whole batch against every enrolled face
+            unique = []
+            for entry, found in zip(batch, find_enrolled_duplicates([encoding for _, _, encoding in batch])):
+                if found:
+                    reject(dict(zip(columns, entry[0])), f"face already enrolled as {found[0][0]} {found[0][1]}")
+                else:
+                    unique.append(entry)
+            batch = unique
+        if not batch:
+            return True
+        if dry_run:
+            summary['enrolled'] += len(batch)
+            return True
+        inserted = insert_batch(table, columns + ('biometric_data',), [fields + (blob,) for fields, blob, _ in batch])
+        if inserted is None:
+            return False
+        inserted_ids = {fields[0] for fields in inserted}
+        append_progress(progress_path, sorted(inserted_ids))
+        add_batch_to_ann_index(person_type, [fields[0] for fields, _, _ in batch if fields[0] in inserted_ids],
+                               [encoding for fields, _, encoding in batch if fields[0] in inserted_ids])
+        for fields, _, _ in batch:
+            if fields[0] not in inserted_ids:
+                reject(dict(zip(columns, fields)), "rejected by the database")
+        summary['enrolled'] += len(inserted_ids)
+        print(f"Enrolled {summary['enrolled']}/{len(with_photos)}...")
+        return True
+
+    # Encode in parallel (results come back in input order) and insert as batches fill up
+    batch = []
+    results = get_encoding_pool().map_files([paths for _, _, paths in with_photos])
+    for (row, fields, _), image_results in zip(with_photos, results):
+        encoding = mean_encoding(image_results, min_faces)
+        if encoding is None:
+            reject(row, f"fewer than {min_faces} photos with a detectable face")
+            continue
+        batch.append((fields, encode_encoding(encoding), encoding))
+        if len(batch) >= batch_size:
+            if not flush(batch):
+                break
+            batch = []
+    else:
+        if batch:
+            flush(batch)
+
+    if rejects:
+        with open(rejects_path, "w", newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rejects[0].keys()), extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rejects)
+        print(f"{len(rejects)} rejected rows written to '{rejects_path}'.")
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Enroll students or teachers in bulk from a CSV file and photo folders.")
+    parser.add_argument('person_type', choices=sorted(ENROLL_COLUMNS))
+    parser.add_argument('csv_path', help="CSV with a header row of column names (see ENROLL_COLUMNS).")
+    parser.add_argument('photos_dir', help="Directory with one sub-directory of photos per person ID.")
+    parser.add_argument('--batch-size', type=int, default=500, help="Rows per multi-row INSERT.")
+    parser.add_argument('--progress', help="Progress file used to resume (default: <csv_path>.progress).")
+    parser.add_argument('--rejects', help="CSV the rejected rows are written to (default: <csv_path>.rejected.csv).")
+    parser.add_argument('--min-faces', type=int, default=1, help="Photos with a detectable face required per person.")
+    parser.add_argument('--dry-run', action='store_true', help="Validate and encode without writing to the database.")
+    parser.add_argument('--allow-duplicate-faces', action='store_true',
+                        help="Enroll faces that are already enrolled under another ID.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.photos_dir):
+        parser.error(f"'{args.photos_dir}' is not a directory.")
+
+    result = bulk_enroll(args.person_type, args.csv_path, args.photos_dir, batch_size=args.batch_size,
+                         progress_path=args.progress, rejects_path=args.rejects, min_faces=args.min_faces,
+                         dry_run=args.dry_run, allow_duplicate_faces=args.allow_duplicate_faces)
+    action = "would be enrolled" if args.dry_run else "enrolled"
+    print(f"{result['enrolled']} {action}, {result['skipped']} already done, {result['rejected']} rejected.")
@@ -0,0 +1,95 @@
+
+# ______________________________________________________________BINARY FACE ENCODING STORAGE FORMAT_____________________________________________________________
+#
+# Layout of a stored encoding (all fields little-endian):
+#
+#   offset  size  field
+#   0       4     magic b"AMSE"
+#   4       1     format version (currently 1)
+#   5       1     dtype code (1 = float32, 2 = float64)
+#   6       2     number of components (uint16)
+#   8       n     raw component values
+#
+# The header is 8 bytes so the payload stays aligned and can be viewed with
+# np.frombuffer without copying. Rows written before this format existed hold
+# pickled numpy arrays; decode_encoding still reads those until they have been
+# rewritten by migrate_encodings.py.
+
+import io
+import pickle
+import struct
+
+import numpy as np
+
+MAGIC = b"AMSE"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBBH")
+
+DTYPE_CODES = {
+    1: np.dtype("<f4"),
+    2: np.dtype("<f8"),
+}
+CODES_BY_DTYPE = {dtype: code for code, dtype in DTYPE_CODES.items()}
+
+
+class _LegacyEncodingUnpickler(pickle.Unpickler):
+    """Unpickler that only rebuilds numpy arrays, so legacy BLOBs cannot run arbitrary code."""
+
+    ALLOWED = {
+        ("numpy", "ndarray"),
+        ("numpy", "dtype"),
+        ("numpy.core.multiarray", "_reconstruct"),
+        ("numpy._core.multiarray", "_reconstruct"),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) in self.ALLOWED:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a stored encoding.")
+
+
+def is_binary_encoding(blob) -> bool:
+    """Return True if the stored value is already in the binary format."""
+    return blob is not None and bytes(blob[:4]) == MAGIC
+
+
+def encode_encoding(encoding, dtype=np.float64) -> bytes:
+    """
+    Serialize a face encoding into the binary storage format.
+
+    Args:
+        encoding (array-like): A 1-d face encoding.
+        dtype: Storage precision, np.float32 or np.float64.
+
+    Returns:
+        bytes: Header followed by the raw little-endian values.
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    if dtype not in CODES_BY_DTYPE:
+        raise ValueError(f"Unsupported encoding dtype: {dtype}")
+
+    values = np.ascontiguousarray(np.asarray(encoding).reshape(-1), dtype=dtype)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, CODES_BY_DTYPE[dtype], values.size) + values.tobytes()
+
+
+def decode_encoding(blob) -> np.ndarray:
+    """
+    Deserialize a stored face encoding, accepting both the binary and the legacy pickled format.
+
+    Binary values are returned as a read-only, zero-copy view over `blob`.
+
+    Args:
+        blob (bytes): The value of a biometric_data column.
+
+    Returns:
+        np.ndarray: The 1-d face encoding.
+    """
+    if is_binary_encoding(blob):
+        _, version, dtype_code, count = HEADER.unpack_from(blob)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported encoding format version: {version}")
+        if dtype_code not in DTYPE_CODES:
+            raise ValueError(f"Unsupported encoding dtype code: {dtype_code}")
+        return np.frombuffer(blob, dtype=DTYPE_CODES[dtype_code], count=count, offset=HEADER.size)
+
+    return np.asarray(_LegacyEncodingUnpickler(io.BytesIO(blob)).load()).reshape(-1)
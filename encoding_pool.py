@@ -0,0 +1,235 @@
+
+# ______________________________________________________________PROCESS-POOL FACE ENCODING WORKERS_____________________________________________________________
+
+import atexit
+import collections
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from metrics import observe
+
+# Backpressure policies when max_pending frames are already in flight
+DROP_OLDEST = "drop_oldest"
+SKIP = "skip"
+
+
+def _init_worker():
+    """Import dlib once per worker instead of on the first frame."""
+    import face_recognition  # noqa: F401
+
+
+def encode_frame_timed(rgb_frame, face_locations=None, largest_only=False):
+    """
+    Worker function: encode the faces of one RGB frame, timing detection and encoding.
+
+    Metrics recorded inside a worker process would never be exported, so the stage
+    durations travel back with the encodings and the parent records them (record_timings).
+
+    Args:
+        rgb_frame (numpy.ndarray): The frame.
+        face_locations (list, optional): Known (top, right, bottom, left) boxes; detected with
+                                         the Haar cascade when omitted.
+        largest_only (bool): Encode only the largest detected face.
+
+    Returns:
+        tuple: (encodings, timings): one encoding per row (possibly zero rows), and
+               {stage name: seconds} for 'capture.detect' and 'capture.encode'.
+    """
+    import face_recognition
+    from face_detection import detect_face_locations
+
+    timings = {}
+    if face_locations is None:
+        started = time.perf_counter()
+        face_locations = detect_face_locations(rgb_frame)
+        timings["capture.detect"] = time.perf_counter() - started
+        if largest_only:
+            face_locations = face_locations[:1]
+    if not face_locations:
+        return np.empty((0, 128)), timings
+    started = time.perf_counter()
+    encodings = np.asarray(face_recognition.face_encodings(rgb_frame, known_face_locations=face_locations))
+    timings["capture.encode"] = time.perf_counter() - started
+    return encodings, timings
+
+
+def record_timings(timings):
+    """Record stage durations measured in a worker into this process's metrics."""
+    for name, seconds in timings.items():
+        observe(name, seconds)
+
+
+def encode_frame(rgb_frame, face_locations=None, largest_only=False):
+    """
+    Encode the faces of one RGB frame in this process (see encode_frame_timed).
+
+    Returns:
+        numpy.ndarray: One encoding per row (possibly zero rows).
+    """
+    encodings, timings = encode_frame_timed(rgb_frame, face_locations, largest_only)
+    record_timings(timings)
+    return encodings
+
+
+def encode_image_files(image_paths, largest_only=True):
+    """
+    Worker function: load image files and encode their faces.
+
+    Decoding the files inside the worker means only paths and 128-d encodings cross
+    process boundaries, instead of full-size pixel arrays.
+
+    Returns:
+        tuple: ([(path, encodings)] per image, encodings None if the file could not be read;
+               the stage timings of every encoded image).
+    """
+    import face_recognition
+
+    results, timings = [], []
+    for path in image_paths:
+        try:
+            rgb_frame = face_recognition.load_image_file(path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read image '{path}': {e}")
+            results.append((path, None))
+            continue
+        encodings, image_timings = encode_frame_timed(rgb_frame, largest_only=largest_only)
+        results.append((path, encodings))
+        timings.append(image_timings)
+    return results, timings
+
+
+class EncodingPool:
+    """
+    A pool of encoder processes fed without blocking the capture loop.
+
+    submit() never waits for a worker: when max_pending frames are already in flight,
+    the DROP_OLDEST policy cancels (or discards the result of) the oldest one, while
+    SKIP refuses the new frame. completed() hands results back strictly in the order
+    the frames were submitted, and records the workers' detect/encode timings.
+    """
+
+    def __init__(self, workers=None, max_pending=None, policy=DROP_OLDEST):
+        if policy not in (DROP_OLDEST, SKIP):
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.workers = workers or int(os.environ.get("AMS_ENCODING_WORKERS", 0)) or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.policy = policy
+        self.dropped = 0
+
+        # spawn: forking a process that already runs camera/GUI threads is not safe
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker)
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+
+    def submit(self, frame_id, rgb_frame, face_locations=None, largest_only=False):
+        """
+        Queue a frame for encoding.
+
+        Returns:
+            bool: False if the frame was skipped because the pool is saturated.
+        """
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                if self.policy == SKIP:
+                    self.dropped += 1
+                    return False
+                _, oldest = self._pending.popleft()
+                oldest.cancel()
+                self.dropped += 1
+            future = self._executor.submit(encode_frame_timed, rgb_frame, face_locations, largest_only)
+            self._pending.append((frame_id, future))
+            return True
+
+    def completed(self, wait=False, keep=0):
+        """
+        Yield (frame_id, encodings) for finished frames, in submission order.
+
+        Args:
+            wait (bool): Block for frames still being encoded instead of stopping at
+                         the first one, until at most `keep` frames remain in flight.
+            keep (int): See wait; 0 waits for every pending frame.
+        """
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                if not self._pending[0][1].done() and not (wait and len(self._pending) > keep):
+                    return
+                frame_id, future = self._pending.popleft()
+            if future.cancelled():
+                continue
+            try:
+                encodings, timings = future.result()
+            except Exception as e:
+                logging.error(f"Encoding of frame {frame_id} failed: {e}")
+                continue
+            record_timings(timings)
+            yield frame_id, encodings
+
+    def pending_ids(self):
+        """Return the IDs of the frames still in flight."""
+        with self._lock:
+            return {frame_id for frame_id, _ in self._pending}
+
+    def clear(self):
+        """Discard every frame still in flight."""
+        with self._lock:
+            for _, future in self._pending:
+                future.cancel()
+            self._pending.clear()
+
+    def map(self, rgb_frames, largest_only=True):
+        """Encode a batch of frames across all workers and return the encodings in input order."""
+        results = []
+        for encodings, timings in self._executor.map(encode_frame_timed, rgb_frames, [None] * len(rgb_frames),
+                                                     [largest_only] * len(rgb_frames)):
+            record_timings(timings)
+            results.append(encodings)
+        return results
+
+    def map_files(self, path_groups, largest_only=True, chunksize=4):
+        """
+        Encode groups of image files (e.g. all photos of one person) across all workers.
+
+        Returns:
+            iterator: One [(path, encodings)] list per group, in input order, as they complete.
+        """
+        for results, timings in self._executor.map(encode_image_files, path_groups, [largest_only] * len(path_groups),
+                                                   chunksize=chunksize):
+            for image_timings in timings:
+                record_timings(image_timings)
+            yield results
+
+    def close(self):
+        self.clear()
+        self._executor.shutdown(wait=True)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_encoding_pool():
+    """Return the process-wide encoding pool, starting its workers on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = EncodingPool()
+            logging.info(f"Started {_default_pool.workers} encoding worker processes.")
+        return _default_pool
+
+
+@atexit.register
+def shutdown_encoding_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is not None:
+            _default_pool.close()
+            _default_pool = None
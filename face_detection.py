@@ -0,0 +1,71 @@
+
+# ______________________________________________________________FAST HAAR-CASCADE FACE DETECTION_____________________________________________________________
+
+import os
+import threading
+
+import cv2
+
+CASCADE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "haarcascade_frontalface_default.xml")
+
+
+class HaarFaceDetector:
+    """
+    Cheap face detector run ahead of dlib.
+
+    The cascade runs on a downscaled grayscale copy of the frame and the boxes are
+    scaled back to full resolution in face_recognition's (top, right, bottom, left)
+    order, so they can be passed straight to face_encodings as known_face_locations
+    and dlib does not have to detect the faces a second time.
+    """
+
+    def __init__(self, cascade_path=CASCADE_PATH, downscale=0.5, scale_factor=1.1, min_neighbors=5, min_face_size=40):
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise IOError(f"Could not load Haar cascade from '{cascade_path}'.")
+        self.downscale = downscale
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        # Minimum face size is given in full-resolution pixels
+        small_side = max(1, int(min_face_size * downscale))
+        self.min_size = (small_side, small_side)
+
+    def detect(self, rgb_frame):
+        """
+        Detect faces in an RGB frame.
+
+        Args:
+            rgb_frame (numpy.ndarray): The frame, as passed to face_recognition.
+
+        Returns:
+            list: (top, right, bottom, left) boxes in full-resolution coordinates, largest first.
+        """
+        height, width = rgb_frame.shape[:2]
+        gray = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
+        if self.downscale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.downscale, fy=self.downscale, interpolation=cv2.INTER_AREA)
+
+        boxes = self.cascade.detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                              minNeighbors=self.min_neighbors, minSize=self.min_size)
+
+        locations = []
+        for (x, y, w, h) in boxes:
+            top = max(0, int(y / self.downscale))
+            left = max(0, int(x / self.downscale))
+            bottom = min(height, int((y + h) / self.downscale))
+            right = min(width, int((x + w) / self.downscale))
+            locations.append((top, right, bottom, left))
+
+        locations.sort(key=lambda box: (box[2] - box[0]) * (box[1] - box[3]), reverse=True)
+        return locations
+
+
+_local = threading.local()
+
+
+def detect_face_locations(rgb_frame):
+    """Detect faces with a per-thread default HaarFaceDetector (cascade objects are not shared between threads)."""
+    detector = getattr(_local, "detector", None)
+    if detector is None:
+        detector = _local.detector = HaarFaceDetector()
+    return detector.detect(rgb_frame)
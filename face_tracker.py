@@ -0,0 +1,128 @@
+
+# ______________________________________________________________LIGHTWEIGHT FACE TRACKING ACROSS FRAMES_____________________________________________________________
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from gallery import MatchResult
+
+Box = Tuple[int, int, int, int]  # (top, right, bottom, left), as used by face_recognition
+
+
+def box_iou(a: Box, b: Box) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    if intersection == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def box_centroid_distance(a: Box, b: Box) -> float:
+    """Distance between box centres, relative to the width of the first box."""
+    ay, ax = (a[0] + a[2]) / 2.0, (a[1] + a[3]) / 2.0
+    by, bx = (b[0] + b[2]) / 2.0, (b[1] + b[3]) / 2.0
+    width = max(1, a[1] - a[3])
+    return (((ay - by) ** 2 + (ax - bx) ** 2) ** 0.5) / width
+
+
+@dataclass
+class Track:
+    """A face followed across frames, with the last match result cached for it."""
+    track_id: int
+    box: Box
+    last_seen: int
+    encoded_frame: Optional[int] = None
+    match: Optional[MatchResult] = None
+    pending: bool = False  # Submitted for encoding, result not back yet
+
+
+class FaceTracker:
+    """
+    Associates face boxes between frames so each face is encoded once, not on every frame.
+
+    Detections are greedily paired with existing tracks by IoU (falling back to centroid
+    distance for fast movement). update() returns only the tracks that need the dlib
+    encoder: tracks that were just born, tracks whose cached match is older than
+    recheck_interval frames, and unmatched or low-margin tracks every retry_interval frames.
+    Tracks marked pending (their encoding is still in flight) are never reported as due.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.5, max_missed=15,
+                 recheck_interval=60, retry_interval=5, min_margin=0.1):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_missed = max_missed
+        self.recheck_interval = recheck_interval
+        self.retry_interval = retry_interval
+        self.min_margin = min_margin
+
+        self.tracks = {}
+        self._next_id = 1
+
+    def update(self, frame_number: int, boxes: List[Box]) -> List[Track]:
+        """
+        Feed the face boxes detected in a frame.
+
+        Args:
+            frame_number (int): Increasing number of the frame.
+            boxes (list): Detected (top, right, bottom, left) boxes.
+
+        Returns:
+            List[Track]: Tracks that should be encoded and matched on this frame.
+        """
+        for track_id in list(self.tracks):
+            if frame_number - self.tracks[track_id].last_seen > self.max_missed:
+                del self.tracks[track_id]
+
+        unmatched = set(range(len(boxes)))
+        free_tracks = set(self.tracks)
+
+        pairs = []
+        for track_id in self.tracks:
+            track_box = self.tracks[track_id].box
+            for index, box in enumerate(boxes):
+                iou = box_iou(track_box, box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, track_id, index))
+                elif box_centroid_distance(track_box, box) <= self.max_centroid_distance:
+                    pairs.append((0.0, track_id, index))
+        pairs.sort(key=lambda pair: pair[0], reverse=True)
+
+        for _, track_id, index in pairs:
+            if track_id in free_tracks and index in unmatched:
+                track = self.tracks[track_id]
+                track.box = boxes[index]
+                track.last_seen = frame_number
+                free_tracks.discard(track_id)
+                unmatched.discard(index)
+
+        for index in sorted(unmatched):
+            track = Track(self._next_id, boxes[index], frame_number)
+            self.tracks[track.track_id] = track
+            self._next_id += 1
+
+        return [track for track in self.tracks.values()
+                if track.last_seen == frame_number and not track.pending and self._needs_encoding(track, frame_number)]
+
+    def mark_pending(self, tracks: List[Track], pending: bool = True):
+        """Flag tracks whose encoding was submitted (or clear the flag when it was dropped)."""
+        for track in tracks:
+            track.pending = pending
+
+    def record_match(self, track: Track, result: MatchResult, frame_number: int):
+        """Cache the match result of a track that has just been encoded."""
+        track.match = result
+        track.encoded_frame = frame_number
+        track.pending = False
+
+    def _needs_encoding(self, track: Track, frame_number: int) -> bool:
+        if track.match is None or track.encoded_frame is None:
+            return True
+        age = frame_number - track.encoded_frame
+        if not track.match.matched or track.match.margin < self.min_margin:
+            return age >= self.retry_interval
+        return age >= self.recheck_interval
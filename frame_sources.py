@@ -0,0 +1,203 @@
+
+# ______________________________________________________________PLUGGABLE FRAME SOURCES AND HEADLESS MODE_____________________________________________________________
+#
+# Every capture path reads frames through open_frame_source() instead of cv2.VideoCapture(0):
+#
+#   AMS_FRAME_SOURCE   camera index (default 0), a video file, or a directory of images
+#   AMS_FRAME_SKIP     frames skipped after each decoded frame of a video file (default 0)
+#   AMS_HEADLESS=1     never open a window (servers without a display, CI)
+
+import logging
+import os
+import queue
+import threading
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+HEADLESS = os.environ.get("AMS_HEADLESS", "").lower() in ("1", "true", "yes")
+
+# Marks the end of a video file on the decode queue
+_END_OF_VIDEO = object()
+
+
+class FrameSource:
+    """
+    The subset of the cv2.VideoCapture interface the capture code uses.
+
+    `live` sources (cameras) keep producing frames whether or not they are consumed, so
+    slow consumers should drop stale frames. Recorded sources wait for the consumer
+    instead, and set `finished` once their last frame has been read.
+    """
+
+    live = False
+    finished = False
+
+    def isOpened(self):
+        raise NotImplementedError
+
+    def read(self):
+        """Return (ret, bgr_frame) like cv2.VideoCapture.read()."""
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class WebcamSource(FrameSource):
+    """A camera; other VideoCapture methods (e.g. set()) are passed through."""
+
+    live = True
+
+    def __init__(self, index=0):
+        self._capture = cv2.VideoCapture(index)
+
+    def isOpened(self):
+        return self._capture.isOpened()
+
+    def read(self):
+        return self._capture.read()
+
+    def release(self):
+        self._capture.release()
+
+    def __getattr__(self, name):
+        return getattr(self._capture, name)
+
+
+class VideoFileSource(FrameSource):
+    """
+    A recorded video, decoded ahead of the consumer by a dedicated thread.
+
+    The decode thread fills a bounded buffer as fast as the CPU allows and blocks when
+    the consumer falls behind, so no frame is dropped. After each kept frame,
+    `frame_skip` frames are only grabbed, which skips the costly conversion to a BGR
+    image.
+    """
+
+    def __init__(self, path, frame_skip=0, buffer_size=64):
+        self.path = path
+        self.frame_skip = max(0, int(frame_skip))
+        self.frames_decoded = 0
+        self._capture = cv2.VideoCapture(path)
+        self._frames = queue.Queue(maxsize=buffer_size)
+        self._stop_event = threading.Event()
+        self._thread = None
+        if self._capture.isOpened():
+            self._thread = threading.Thread(target=self._decode, name="video-decode", daemon=True)
+            self._thread.start()
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self._frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode(self):
+        try:
+            while not self._stop_event.is_set():
+                ret, frame = self._capture.read()
+                if not ret:
+                    return
+                self.frames_decoded += 1
+                if not self._put(frame):
+                    return
+                for _ in range(self.frame_skip):
+                    if not self._capture.grab():
+                        return
+        except cv2.error as e:
+            logging.error(f"Decoding '{self.path}' failed: {e}")
+        finally:
+            self._put(_END_OF_VIDEO)
+
+    def isOpened(self):
+        return self._thread is not None
+
+    def read(self):
+        if self.finished or self._thread is None:
+            return False, None
+        frame = self._frames.get()
+        if frame is _END_OF_VIDEO:
+            self.finished = True
+            return False, None
+        return True, frame
+
+    def release(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._capture.release()
+
+
+class ImageDirectorySource(FrameSource):
+    """The images of a directory, in file name order, as consecutive frames."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        self._paths = [os.path.join(directory, name) for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+        self._position = 0
+
+    def isOpened(self):
+        return bool(self._paths)
+
+    def read(self):
+        while self._position < len(self._paths):
+            path = self._paths[self._position]
+            self._position += 1
+            frame = cv2.imread(path)
+            if frame is not None:
+                return True, frame
+            logging.warning(f"Skipping unreadable image '{path}'.")
+        self.finished = True
+        return False, None
+
+
+def open_frame_source(source=None, frame_skip=None):
+    """
+    Open a camera, video file or image directory.
+
+    Args:
+        source (int, str or FrameSource, optional): Camera index, video file path, or image directory;
+                                                    defaults to AMS_FRAME_SOURCE, then camera 0. An
+                                                    already opened FrameSource is returned as is.
+        frame_skip (int, optional): Frames skipped between decoded frames of a video file;
+                                    defaults to AMS_FRAME_SKIP, then 0.
+
+    Returns:
+        FrameSource: The source (check isOpened() before reading).
+    """
+    if isinstance(source, FrameSource):
+        return source
+    if source is None:
+        source = os.environ.get("AMS_FRAME_SOURCE", 0)
+    if frame_skip is None:
+        frame_skip = int(os.environ.get("AMS_FRAME_SKIP", 0))
+
+    if isinstance(source, int) or str(source).isdigit():
+        return WebcamSource(int(source))
+    if os.path.isdir(source):
+        return ImageDirectorySource(source)
+    return VideoFileSource(source, frame_skip=frame_skip)
+
+
+def show_frame(window_title, frame):
+    """
+    Display a frame unless running headless.
+
+    Returns:
+        bool: True if 'q' was pressed in the window.
+    """
+    if HEADLESS:
+        return False
+    cv2.imshow(window_title, frame)
+    return cv2.waitKey(1) & 0xFF == ord('q')
+
+
+def close_windows():
+    if not HEADLESS:
+        cv2.destroyAllWindows()
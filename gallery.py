@@ -0,0 +1,341 @@
+
+# ______________________________________________________________IN-MEMORY FACE GALLERY (VECTORIZED MATCHING)_____________________________________________________________
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+ENCODING_DIM = 128
+# Seconds before a FallbackGallery tries again to load a fallback that could not be loaded
+FALLBACK_RETRY_INTERVAL = 30.0
+
+
+@dataclass
+class MatchResult:
+    """
+    Outcome of scoring one probe encoding against a gallery.
+
+    Attributes:
+        person_id: ID of the best match if it is under the threshold, otherwise None.
+        distance: Euclidean distance to the closest gallery entry (inf for an empty gallery).
+        margin: Distance gap between the best and the second best entry (inf if there is none).
+        top_k: The k closest entries as (person_id, distance) pairs, closest first.
+    """
+    person_id: Optional[int]
+    distance: float
+    margin: float
+    top_k: List[Tuple[int, float]] = field(default_factory=list)
+
+    @property
+    def matched(self) -> bool:
+        return self.person_id is not None
+
+
+class Gallery:
+    """
+    All enrolled encodings of one person type held as a single contiguous matrix.
+
+    Squared row norms are precomputed so that the distances from a probe to every
+    gallery entry come out of one matrix-vector product:
+        ||g - p||^2 = ||g||^2 + ||p||^2 - 2 * g.p
+
+    Memory-mapped arrays of the right dtype are used without copying; pass `sq_norms`
+    as well to avoid reading the whole matrix up front.
+    """
+
+    def __init__(self, ids, encodings, dtype=np.float64, sq_norms=None):
+        self.ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        matrix = np.asarray(encodings, dtype=dtype)
+        if matrix.size == 0:
+            matrix = np.empty((0, ENCODING_DIM), dtype=dtype)
+        else:
+            matrix = matrix.reshape(len(self.ids), -1)
+        self.matrix = np.ascontiguousarray(matrix)
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self.sq_norms = np.asarray(sq_norms, dtype=self.matrix.dtype)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def distances(self, probe) -> np.ndarray:
+        """
+        Compute the Euclidean distance from one probe to every gallery entry.
+
+        Args:
+            probe (array-like): A single face encoding.
+
+        Returns:
+            np.ndarray: Distances with the same order as `self.ids`.
+        """
+        probe = np.asarray(probe, dtype=self.matrix.dtype).reshape(-1)
+        sq = self.sq_norms + probe.dot(probe) - 2.0 * (self.matrix @ probe)
+        return np.sqrt(np.maximum(sq, 0.0))
+
+    def match(self, probe, threshold: float = 0.6, k: int = 5) -> MatchResult:
+        """
+        Find the closest gallery entry to a probe encoding.
+
+        Args:
+            probe (array-like): The face encoding to identify.
+            threshold (float): Distances at or above this value are not a match.
+            k (int): Number of closest candidates to report in `top_k`.
+
+        Returns:
+            MatchResult: The best match (or None), its distance, margin and top-k list.
+        """
+        if len(self) == 0:
+            return MatchResult(None, float('inf'), float('inf'))
+        return self._result(self.distances(probe), threshold, k)
+
+    def batch_distances(self, probes) -> np.ndarray:
+        """
+        Compute the distances from several probes to every gallery entry in one matrix product.
+
+        Args:
+            probes (array-like): Face encodings, one per row.
+
+        Returns:
+            np.ndarray: A (len(probes), len(self)) distance matrix.
+        """
+        probes = np.asarray(probes, dtype=self.matrix.dtype).reshape(-1, self.matrix.shape[1])
+        sq = self.sq_norms[None, :] + np.einsum('ij,ij->i', probes, probes)[:, None] - 2.0 * (probes @ self.matrix.T)
+        return np.sqrt(np.maximum(sq, 0.0))
+
+    def match_batch(self, probes, threshold: float = 0.6, k: int = 5) -> List[MatchResult]:
+        """
+        Identify every face of a frame at once.
+
+        Args:
+            probes (array-like): Face encodings, one per row.
+            threshold (float): Distances at or above this value are not a match.
+            k (int): Number of closest candidates to report per probe.
+
+        Returns:
+            List[MatchResult]: One result per probe, in the same order.
+        """
+        if len(probes) == 0:
+            return []
+        if len(self) == 0:
+            return [MatchResult(None, float('inf'), float('inf')) for _ in range(len(probes))]
+        return [self._result(row, threshold, k) for row in self.batch_distances(probes)]
+
+    def _result(self, distances: np.ndarray, threshold: float, k: int) -> MatchResult:
+        return rank_candidates(self.ids, distances, threshold, k)
+
+    def with_changes(self, removed_ids, ids, encodings) -> "Gallery":
+        """
+        Return a new gallery with some entries removed and others inserted or replaced.
+
+        The existing gallery is not modified, so matches running against it are unaffected.
+        Only the squared norms of the new rows are computed.
+
+        Args:
+            removed_ids (array-like): IDs to drop.
+            ids (array-like): IDs to insert; an ID already present is replaced.
+            encodings (array-like): Encodings of `ids`, one per row.
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        encodings = np.asarray(encodings, dtype=self.matrix.dtype).reshape(len(ids), self.matrix.shape[1])
+        keep = ~np.isin(self.ids, np.concatenate((np.asarray(removed_ids, dtype=np.int64).reshape(-1), ids)))
+        return Gallery(np.concatenate((self.ids[keep], ids)),
+                       np.concatenate((self.matrix[keep], encodings)),
+                       dtype=self.matrix.dtype,
+                       sq_norms=np.concatenate((self.sq_norms[keep], np.einsum('ij,ij->i', encodings, encodings))))
+
+
+def rank_candidates(ids: np.ndarray, distances: np.ndarray, threshold: float = 0.6, k: int = 5) -> MatchResult:
+    """
+    Turn the distances from a probe to a set of candidates into a MatchResult.
+
+    Args:
+        ids (np.ndarray): Person IDs of the candidates.
+        distances (np.ndarray): Distance from the probe to each candidate, same order as `ids`.
+        threshold (float): Distances at or above this value are not a match.
+        k (int): Number of closest candidates to report in `top_k`.
+
+    Returns:
+        MatchResult: The best match (or None), its distance, margin and top-k list.
+    """
+    if len(distances) == 0:
+        return MatchResult(None, float('inf'), float('inf'))
+    k = max(1, min(k, len(distances)))
+    if k < len(distances):
+        nearest = np.argpartition(distances, k - 1)[:k]
+    else:
+        nearest = np.arange(len(distances))
+    nearest = nearest[np.argsort(distances[nearest])]
+
+    top_k = [(int(ids[i]), float(distances[i])) for i in nearest]
+    best_id, best_distance = top_k[0]
+    if len(top_k) > 1:
+        margin = top_k[1][1] - best_distance
+    elif len(distances) > 1:
+        margin = float(np.partition(distances, 1)[1]) - best_distance
+    else:
+        margin = float('inf')
+
+    person_id = best_id if best_distance < threshold else None
+    return MatchResult(person_id, best_distance, margin, top_k)
+
+
+class FallbackGallery:
+    """
+    A small primary gallery (e.g. a class roster) searched first, with a larger one behind it.
+
+    Only probes that miss the primary gallery are scored against the fallback, which
+    is loaded lazily by `fallback_loader` the first time it is needed. If the loader
+    returns None, it is tried again once `retry_interval` seconds have passed.
+    """
+
+    def __init__(self, primary: Gallery, fallback_loader: Callable[[], Optional[Gallery]],
+                 retry_interval: float = FALLBACK_RETRY_INTERVAL):
+        self.primary = primary
+        self.retry_interval = retry_interval
+        self._fallback_loader = fallback_loader
+        self._fallback = None
+        self._retry_at = 0.0
+
+    def __len__(self):
+        return len(self.primary)
+
+    @property
+    def fallback(self) -> Optional[Gallery]:
+        if self._fallback is None and self._fallback_loader is not None and time.monotonic() >= self._retry_at:
+            self._fallback = self._fallback_loader()
+            if self._fallback is not None:
+                self._fallback_loader = None
+            else:
+                self._retry_at = time.monotonic() + self.retry_interval
+                logging.warning(f"Fallback gallery could not be loaded. Retrying in {self.retry_interval:.0f}s.")
+        return self._fallback
+
+    def match(self, probe, threshold: float = 0.6, k: int = 5) -> MatchResult:
+        return self.match_batch(np.asarray(probe).reshape(1, -1), threshold, k)[0]
+
+    def match_batch(self, probes, threshold: float = 0.6, k: int = 5) -> List[MatchResult]:
+        results = self.primary.match_batch(probes, threshold, k)
+        misses = [i for i, result in enumerate(results) if not result.matched]
+        if misses and self.fallback is not None and len(self.fallback) > 0:
+            probes = np.asarray(probes).reshape(len(results), -1)
+            for i, result in zip(misses, self.fallback.match_batch(probes[misses], threshold, k)):
+                results[i] = result
+        return results
+
+
+class LiveGallery:
+    """
+    A gallery kept up to date in the background while it is being matched against.
+
+    A poller thread asks `fetch_changes(watermark)` for the changes since the last
+    watermark every `poll_interval` seconds. fetch_changes returns one of:
+        None                                                   nothing could be read; try again later
+        (watermark, removed_ids, ids, encodings)               incremental changes
+        (watermark, RELOAD)                                    too much changed; call `loader` again
+    Changes are applied copy-on-write (Gallery.with_changes) and published by swapping
+    a single reference, so matches in progress keep the gallery they started with and
+    never wait for a refresh.
+    """
+
+    RELOAD = "reload"
+
+    def __init__(self, gallery: Gallery, watermark, loader: Callable[[], Tuple[object, Optional[Gallery]]],
+                 fetch_changes: Callable[[object], Optional[tuple]], poll_interval: float = 5.0):
+        """
+        Args:
+            gallery (Gallery): The initially loaded gallery.
+            watermark: Position in the change log the gallery reflects.
+            loader: Returns (watermark, Gallery) for a full load; the watermark must be read
+                    before the rows so that changes made during the load are applied again.
+            fetch_changes: See the class docstring.
+            poll_interval (float): Seconds between polls.
+        """
+        self._loader = loader
+        self._fetch_changes = fetch_changes
+        self.poll_interval = poll_interval
+        self._gallery = gallery
+        self._watermark = watermark
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def gallery(self) -> Gallery:
+        """The current immutable gallery."""
+        return self._gallery
+
+    @property
+    def watermark(self):
+        """Position in the change log the current gallery reflects."""
+        return self._watermark
+
+    def __len__(self):
+        return len(self._gallery)
+
+    def match(self, probe, threshold: float = 0.6, k: int = 5) -> MatchResult:
+        return self._gallery.match(probe, threshold, k)
+
+    def match_batch(self, probes, threshold: float = 0.6, k: int = 5) -> List[MatchResult]:
+        return self._gallery.match_batch(probes, threshold, k)
+
+    def refresh(self) -> bool:
+        """
+        Apply the changes since the last poll.
+
+        Returns:
+            bool: True if the gallery changed.
+        """
+        with self._refresh_lock:
+            changes = self._fetch_changes(self._watermark)
+            if changes is None:
+                return False
+            if changes[1] is LiveGallery.RELOAD:
+                watermark, gallery = self._loader()
+                if gallery is None:
+                    return False
+            else:
+                watermark, removed_ids, ids, encodings = changes
+                if len(removed_ids) == 0 and len(ids) == 0:
+                    self._watermark = watermark
+                    return False
+                gallery = self._gallery.with_changes(removed_ids, ids, encodings)
+            self._gallery, self._watermark = gallery, watermark
+            return True
+
+    def apply_changes(self, removed_ids, ids, encodings):
+        """
+        Publish changes this process made before the next poll sees them (e.g. a
+        registration). The watermark is kept, so the poll applies them again, which is
+        harmless.
+
+        Returns:
+            The new gallery.
+        """
+        with self._refresh_lock:
+            self._gallery = self._gallery.with_changes(removed_ids, ids, encodings)
+            return self._gallery
+
+    def _poll(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                if self.refresh():
+                    logging.info(f"Gallery refreshed: {len(self._gallery)} encodings.")
+            except Exception as e:
+                logging.error(f"Gallery refresh failed: {e}")
+
+    def start(self) -> "LiveGallery":
+        """Start polling for changes in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._poll, name="gallery-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
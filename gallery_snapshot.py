@@ -0,0 +1,338 @@
+
+# ______________________________________________________________PERSISTENT MEMORY-MAPPED GALLERY SNAPSHOTS_____________________________________________________________
+#
+# With AMS_GALLERY_SNAPSHOT_DIR set, each person type's gallery is kept on disk as
+#
+#   <type>.json                    version stamp: generation, row count, newest created_at,
+#                                  gallery_changes watermark
+#   <type>.<generation>.ids.npy    person IDs
+#   <type>.<generation>.matrix.npy encodings, one per row (memory-mapped read-only)
+#   <type>.<generation>.norms.npy  squared row norms used by Gallery
+#   <type>.lock                    held by the process writing a new generation
+#
+# A process maps the newest generation instead of pulling every BLOB from MySQL, so
+# start-up costs a few milliseconds and all processes share the same page cache.
+# Before use, the snapshot is compared with the table (gallery_changes watermark, row
+# count and newest created_at). Only the rows changed (or, without gallery_changes,
+# created) since the snapshot are fetched and written as a new generation. If that
+# does not add up to the table, it is reloaded in full.
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import mysql.connector
+import numpy as np
+
+from DBconfig import get_db_connection
+from encoding_format import decode_encoding
+from gallery import ENCODING_DIM, Gallery
+
+GALLERY_SNAPSHOT_DIR = os.environ.get("AMS_GALLERY_SNAPSHOT_DIR")
+
+# Rows copied at a time when writing a new generation
+COPY_CHUNK_ROWS = 65536
+# Changed IDs fetched per query when applying gallery changes
+CHANGED_ROWS_CHUNK = 1000
+
+_snapshots = {}  # person type -> (stamp dict, Gallery)
+_snapshot_lock = threading.Lock()
+
+
+def _stamp_path(directory, person_type):
+    return os.path.join(directory, f"{person_type}.json")
+
+
+def _array_path(directory, person_type, generation, name):
+    return os.path.join(directory, f"{person_type}.{generation}.{name}.npy")
+
+
+def _table_state(cursor, table, person_type):
+    """
+    (row count, newest created_at, gallery_changes watermark) of the enrolled rows of a table.
+
+    The watermark is read first, so changes made while the rows are read are applied
+    again on the next sync. It is None on databases created before gallery_changes.
+    """
+    try:
+        cursor.execute("SELECT COALESCE(MAX(change_id), 0) FROM gallery_changes WHERE person_type = %s", (person_type,))
+        watermark = int(cursor.fetchone()[0])
+    except mysql.connector.ProgrammingError:
+        watermark = None
+    cursor.execute(f"SELECT COUNT(*), MAX(created_at) FROM {table} WHERE biometric_data IS NOT NULL")
+    count, newest = cursor.fetchone()
+    return int(count), (str(newest) if newest is not None else None), watermark
+
+
+def _is_current(stamp, state):
+    return stamp is not None and (stamp["count"], stamp["newest_created_at"], stamp.get("watermark")) == state
+
+
+@contextlib.contextmanager
+def _write_lock(directory, person_type):
+    """Hold the snapshot's lock file so only one process at a time writes (and cleans up) generations."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{person_type}.lock"), "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 seconds
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_stamp(directory, person_type):
+    """Return the version stamp of a snapshot, or None if there is none."""
+    try:
+        with open(_stamp_path(directory, person_type)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def map_snapshot(directory, person_type, stamp):
+    """Memory-map the arrays of a snapshot generation as a Gallery (nothing is read until it is used)."""
+    generation = stamp["generation"]
+    ids = np.load(_array_path(directory, person_type, generation, "ids"), mmap_mode='r')
+    matrix = np.load(_array_path(directory, person_type, generation, "matrix"), mmap_mode='r')
+    norms = np.load(_array_path(directory, person_type, generation, "norms"), mmap_mode='r')
+    return Gallery(ids, matrix, dtype=matrix.dtype, sq_norms=norms)
+
+
+def write_snapshot(directory, person_type, ids, matrix_parts, count, newest, watermark=None, replaced_generation=None):
+    """
+    Write a new snapshot generation and publish it by replacing the stamp file.
+
+    Call it with the snapshot's write lock held: generations other than the new one and
+    the one it replaces are deleted, and processes that read the replaced stamp may
+    still be about to map that generation.
+
+    Args:
+        directory (str): Snapshot directory.
+        person_type (str): 'student' or 'teacher'.
+        ids (np.ndarray): Person IDs of every row.
+        matrix_parts (list): Encoding matrices that stacked in order form the gallery; memory-mapped
+                             parts are copied in chunks so the whole gallery is never held in memory twice.
+        count (int): Row count of the table the snapshot reflects.
+        newest (str): Newest created_at of those rows.
+        watermark (int, optional): gallery_changes watermark the rows were read at.
+        replaced_generation (str, optional): Generation of the stamp being replaced.
+
+    Returns:
+        dict: The new stamp.
+    """
+    os.makedirs(directory, exist_ok=True)
+    generation = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    n_rows = sum(len(part) for part in matrix_parts)
+    dtype = matrix_parts[0].dtype if matrix_parts else np.dtype(np.float64)
+
+    matrix = np.lib.format.open_memmap(_array_path(directory, person_type, generation, "matrix"), mode='w+',
+                                       dtype=dtype, shape=(n_rows, ENCODING_DIM))
+    norms = np.lib.format.open_memmap(_array_path(directory, person_type, generation, "norms"), mode='w+',
+                                      dtype=dtype, shape=(n_rows,))
+    row = 0
+    for part in matrix_parts:
+        for start in range(0, len(part), COPY_CHUNK_ROWS):
+            chunk = np.asarray(part[start:start + COPY_CHUNK_ROWS], dtype=dtype)
+            matrix[row:row + len(chunk)] = chunk
+            norms[row:row + len(chunk)] = np.einsum('ij,ij->i', chunk, chunk)
+            row += len(chunk)
+    matrix.flush()
+    norms.flush()
+    del matrix, norms
+    np.save(_array_path(directory, person_type, generation, "ids"), np.asarray(ids, dtype=np.int64))
+
+    stamp = {"generation": generation, "count": count, "newest_created_at": newest, "watermark": watermark,
+             "rows": n_rows, "dtype": dtype.str, "written_at": time.time()}
+    tmp_path = f"{_stamp_path(directory, person_type)}.{generation}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stamp, f)
+    os.replace(tmp_path, _stamp_path(directory, person_type))
+    _remove_old_generations(directory, person_type, {generation, replaced_generation})
+    return stamp
+
+
+def _remove_old_generations(directory, person_type, kept_generations):
+    """
+    Delete the array files of every generation older than the ones kept.
+
+    Processes that still map an old generation keep reading it until they remap. Where the
+    OS refuses to delete a mapped file (Windows), it is retried after the next write.
+    """
+    for name in os.listdir(directory):
+        parts = name.split(".")
+        if len(parts) == 4 and parts[0] == person_type and parts[3] == "npy" and parts[1] not in kept_generations:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def _decode_rows(rows):
+    ids = np.fromiter((person_id for person_id, _, _ in rows), dtype=np.int64, count=len(rows))
+    encodings = np.array([decode_encoding(blob) for _, blob, _ in rows], dtype=np.float64).reshape(-1, ENCODING_DIM)
+    return ids, encodings
+
+
+def sync_snapshot(person_type, id_column, table, directory=None):
+    """
+    Bring the snapshot of a person type up to date with its table and return it as a Gallery.
+
+    Args:
+        person_type (str): 'student' or 'teacher' (names the snapshot files).
+        id_column (str): Primary key column of the table.
+        table (str): Table holding the biometric_data BLOBs.
+        directory (str, optional): Snapshot directory; defaults to AMS_GALLERY_SNAPSHOT_DIR.
+
+    Returns:
+        Optional[Gallery]: The memory-mapped gallery, or None if the database failed.
+    """
+    directory = directory or GALLERY_SNAPSHOT_DIR
+    with _snapshot_lock:
+        stamp, gallery = _map_current(directory, person_type)
+
+        db = get_db_connection()
+        if db is None:
+            logging.error("Database connection failed. Using the gallery snapshot as is.")
+            return gallery
+        try:
+            with db.cursor() as cursor:
+                state = _table_state(cursor, table, person_type)
+                if _is_current(stamp, state):
+                    return gallery
+
+                with _write_lock(directory, person_type):
+                    # Another process may have brought the snapshot up to date while this one waited
+                    stamp, gallery = _map_current(directory, person_type)
+                    if _is_current(stamp, state):
+                        return gallery
+                    return _write_changes(cursor, directory, person_type, id_column, table, stamp, gallery, state)
+        except mysql.connector.Error as e:
+            logging.error(f"Database error while syncing the {person_type} snapshot: {e}")
+            return gallery
+        finally:
+            db.close()
+
+
+def _map_current(directory, person_type):
+    """(stamp, Gallery) of the published generation, mapping it if it changed since the last call."""
+    stamp, gallery = _snapshots.get(person_type, (None, None))
+    disk_stamp = read_stamp(directory, person_type)
+    if disk_stamp and (stamp is None or disk_stamp["generation"] != stamp["generation"]):
+        try:
+            stamp, gallery = disk_stamp, map_snapshot(directory, person_type, disk_stamp)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Snapshot of {person_type}s could not be mapped ({e}); rebuilding it.")
+            return None, None
+        _snapshots[person_type] = (stamp, gallery)
+    return stamp, gallery
+
+
+def _changed_rows(cursor, person_type, id_column, table, stamp):
+    """
+    IDs whose rows changed since a stamp and the current encodings of those rows.
+
+    Returns:
+        Optional[tuple]: (changed_ids, ids, encodings), or None if the stamp cannot tell what changed.
+    """
+    if stamp.get("watermark") is not None:
+        cursor.execute("SELECT DISTINCT person_id FROM gallery_changes WHERE person_type = %s AND change_id > %s",
+                       (person_type, stamp["watermark"]))
+        changed_ids = [person_id for person_id, in cursor.fetchall()]
+        rows = []
+        for start in range(0, len(changed_ids), CHANGED_ROWS_CHUNK):
+            chunk = changed_ids[start:start + CHANGED_ROWS_CHUNK]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"SELECT {id_column}, biometric_data, created_at FROM {table} "
+                           f"WHERE {id_column} IN ({placeholders}) AND biometric_data IS NOT NULL", chunk)
+            rows.extend(cursor.fetchall())
+        return (np.asarray(changed_ids, dtype=np.int64),) + _decode_rows(rows)
+
+    if stamp["newest_created_at"] is not None:
+        # Rows created at or after the stamped second (>= catches rows sharing that second)
+        cursor.execute(f"SELECT {id_column}, biometric_data, created_at FROM {table} "
+                       f"WHERE biometric_data IS NOT NULL AND created_at >= %s", (stamp["newest_created_at"],))
+        ids, encodings = _decode_rows(cursor.fetchall())
+        return ids, ids, encodings
+    return None
+
+
+def _write_changes(cursor, directory, person_type, id_column, table, stamp, gallery, state):
+    """Write the generation matching `state`, from the changed rows if possible, and return it mapped."""
+    count, newest, watermark = state
+    replaced = stamp["generation"] if stamp else None
+
+    changes = _changed_rows(cursor, person_type, id_column, table, stamp) if stamp else None
+    if changes is not None:
+        changed_ids, delta_ids, delta_encodings = changes
+        keep = ~np.isin(gallery.ids, changed_ids)
+        if int(keep.sum()) + len(delta_ids) == count:
+            kept_ids = gallery.ids[keep] if not keep.all() else gallery.ids
+            kept_matrix = gallery.matrix[keep] if not keep.all() else gallery.matrix
+            gallery = _publish(directory, person_type, np.concatenate((kept_ids, delta_ids)),
+                               [kept_matrix, delta_encodings], state, replaced)
+            logging.info(f"Snapshot of {person_type}s updated with {len(changed_ids)} changed rows ({count} total).")
+            return gallery
+        logging.info(f"Rows of {table} were removed or changed before the snapshot; reloading it in full.")
+
+    cursor.execute(f"SELECT {id_column}, biometric_data, created_at FROM {table} WHERE biometric_data IS NOT NULL")
+    ids, encodings = _decode_rows(cursor.fetchall())
+    gallery = _publish(directory, person_type, ids, [encodings], state, replaced)
+    logging.info(f"Snapshot of {person_type}s written with {count} rows.")
+    return gallery
+
+
+def _publish(directory, person_type, ids, matrix_parts, state, replaced_generation):
+    """
+    Write and map a new generation. If the files cannot be written or mapped, the rows
+    are returned as an in-memory Gallery and the next sync tries again.
+    """
+    count, newest, watermark = state
+    try:
+        stamp = write_snapshot(directory, person_type, ids, matrix_parts, count, newest, watermark, replaced_generation)
+        gallery = map_snapshot(directory, person_type, stamp)
+    except OSError as e:
+        logging.error(f"Snapshot of {person_type}s could not be written or mapped ({e}). Using it from memory.")
+        _snapshots.pop(person_type, None)
+        dtype = matrix_parts[0].dtype if matrix_parts else np.dtype(np.float64)
+        return Gallery(ids, np.concatenate([np.asarray(part, dtype=dtype) for part in matrix_parts]), dtype=dtype)
+    _snapshots[person_type] = (stamp, gallery)
+    return gallery
+
+
+if __name__ == '__main__':
+    import argparse
+    from biometric_utils import PERSON_TABLES
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Write or refresh the memory-mapped gallery snapshots (requires AMS_GALLERY_SNAPSHOT_DIR).")
+    parser.add_argument('person_types', nargs='*', choices=sorted(PERSON_TABLES), default=sorted(PERSON_TABLES))
+    args = parser.parse_args()
+
+    if not GALLERY_SNAPSHOT_DIR:
+        parser.error("Set AMS_GALLERY_SNAPSHOT_DIR to the directory the snapshots should be written to.")
+    for snapshot_type in args.person_types:
+        snapshot = sync_snapshot(snapshot_type, *PERSON_TABLES[snapshot_type])
+        print(f"{snapshot_type}: {len(snapshot) if snapshot is not None else 'no'} encodings in the snapshot.")
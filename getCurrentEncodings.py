@@ -2,122 +2,364 @@
 # ______________________________________________________________GETTING CURRENT MEAN ENCODING VIA THREADS_____________________________________________________________
 
 import cv2
-import os
+import queue
 import time
-import shutil
 import face_recognition
 import numpy as np
 import threading
+from face_detection import detect_face_locations
+from encoding_pool import encode_frame
+from frame_sources import close_windows, open_frame_source, show_frame
+from metrics import stage, timed
 
-def delete_directory(directory):
-    """Deletes a directory and its contents."""
+# Marks the end of the capture stream on the frame queue
+END_OF_FRAMES = None
+# Returned by the queue poll when no frame arrived in time
+NO_FRAME = object()
+# How often the encoding thread collects finished work from an EncodingPool (seconds)
+POOL_POLL_INTERVAL = 0.01
+
+# Adaptive mode: stop once the running mean moves less than this between encodings
+CONVERGENCE_TOLERANCE = 0.05
+# Encodings further than this from the running mean are treated as a different face
+CONSISTENCY_DISTANCE = 0.4
+
+def capture_images(cam, num_images, frame_queue, stop_event, deadline=None):
+    """
+    Thread function to capture frames and hand them to the encoding thread in memory.
+
+    With a deadline (adaptive mode) frames are grabbed back to back until the encoding
+    thread sets stop_event or the deadline passes; if the encoder falls behind, the
+    oldest queued frame is dropped so it always works on a recent one. Without a
+    deadline exactly num_images frames are captured one second apart. Recorded sources
+    (video files, image directories) are never dropped from or paced.
+    """
+    adaptive = deadline is not None
     try:
-        shutil.rmtree(directory)
-        print(f"Image directory '{directory}' deleted successfully.")
-    except Exception as e:
-        print(f"Error deleting directory '{directory}': {e}")
-
-def capture_images(cam, num_images, temp_image_dir, capture_event, encode_event, stop_event):
-    """Thread function to capture images."""
-    for i in range(num_images):
-        if stop_event.is_set():  # Stop if the stop signal is set
-            break
+        i = 0
+        while adaptive or i < num_images:
+            if stop_event.is_set():  # Stop if the stop signal is set
+                break
+            if adaptive and time.monotonic() >= deadline:
+                print("Capture timed out.")
+                break
+            i += 1
+
+            with stage("capture.grab"):
+                ret, frame = cam.read()
+            if not ret:
+                if cam.finished:
+                    break
+                print(f"Failed to grab frame {i}. Skipping...")
+                continue
+            if show_frame("Capturing Image", frame):
+                break
 
-        capture_event.wait()  # Wait until the capture event is set
-        capture_event.clear()
+            # Convert once here; face_recognition works on RGB arrays
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if adaptive and cam.live:
+                put_latest(frame_queue, (i, rgb_frame))
+            else:
+                frame_queue.put((i, rgb_frame))  # Blocks while the queue is full
+                if not adaptive:
+                    print(f"Image {i} captured.")
+                if not adaptive and cam.live:
+                    time.sleep(1)  # Delay before capturing the next image
+    finally:
+        frame_queue.put(END_OF_FRAMES)  # Always release the encoding thread
 
-        ret, frame = cam.read()
-        if not ret:
-            print(f"Failed to grab frame {i + 1}. Skipping...")
-            encode_event.set()  # Signal the encoding thread to proceed even if capture fails
+def put_latest(frame_queue, item):
+    """Put an item on the queue, discarding the oldest queued frame if it is full."""
+    while True:
+        try:
+            frame_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+def put_waiting(frame_queue, item, stop_event):
+    """Put an item on the queue, waiting for room unless stop_event is set; returns whether it was queued."""
+    while not stop_event.is_set():
+        try:
+            frame_queue.put(item, timeout=POOL_POLL_INTERVAL)
+            return True
+        except queue.Full:
             continue
-        cv2.imshow("Capturing Image", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    return False
+
+def has_converged(encodings, previous_mean, min_encodings, tolerance=CONVERGENCE_TOLERANCE):
+    """Return the running mean and whether it has settled enough to stop capturing."""
+    mean_encoding = np.mean(encodings, axis=0)
+    if len(encodings) < min_encodings or previous_mean is None:
+        return mean_encoding, False
+    return mean_encoding, np.linalg.norm(mean_encoding - previous_mean) < tolerance
 
+def process_encodings(frame_queue, encodings, stop_event, adaptive=False, min_encodings=2,
+                      max_encodings=None, early_stop=None, pool=None):
+    """
+    Thread function to extract encodings from queued frames.
 
-        temp_image_path = os.path.join(temp_image_dir, f"temp_face_{i + 1}.jpg")
-        cv2.imwrite(temp_image_path, frame)
-        print(f"Image {i + 1} captured.")
+    In adaptive mode the running mean is updated after every encoding and stop_event
+    is set as soon as it has converged, max_encodings have been collected, or
+    early_stop(mean_encoding) returns True (e.g. a confident gallery match).
 
-        encode_event.set()  # Signal the encoding thread to process this image
-        time.sleep(1)  # Delay before capturing the next image
+    With an EncodingPool, frames are handed to the worker processes without waiting
+    and their encodings are consumed in frame order as they complete.
+    """
+    mean_encoding = None
 
-def process_encodings(temp_image_dir, num_images, encodings, capture_event, encode_event, stop_event):
-    """Thread function to extract encodings."""
-    for i in range(num_images):
-        if stop_event.is_set():  # Stop if the stop signal is set
+    def accept(frame_number, face_encodings):
+        nonlocal mean_encoding
+        if len(face_encodings) == 0:
+            if not adaptive:
+                print(f"No face found in image {frame_number}, skipping...")
+            return
+
+        encoding = face_encodings[0]
+        if adaptive and mean_encoding is not None and np.linalg.norm(encoding - mean_encoding) > CONSISTENCY_DISTANCE:
+            # A different face is in front of the camera now; start over with it
+            encodings.clear()
+            mean_encoding = None
+        encodings.append(encoding)
+        print(f"Captured encoding {frame_number}.")
+
+        if not adaptive:
+            return
+        mean_encoding, converged = has_converged(encodings, mean_encoding, min_encodings)
+        if converged or (max_encodings and len(encodings) >= max_encodings) or (early_stop and early_stop(mean_encoding)):
+            stop_event.set()
+
+    while True:
+        try:
+            # With a pool, wake up regularly to collect finished encodings
+            item = frame_queue.get(timeout=POOL_POLL_INTERVAL if pool else None)
+        except queue.Empty:
+            item = NO_FRAME
+        if item is END_OF_FRAMES:
             break
 
-        encode_event.wait()  # Wait until the encoding event is set
-        encode_event.clear()
+        if item is not NO_FRAME and not stop_event.is_set():  # Drain without encoding once stopped
+            frame_number, rgb_frame = item
+            if pool is None:
+                # Haar pass first, then encode only the largest (closest) face
+                accept(frame_number, encode_frame(rgb_frame, largest_only=True))
+            else:
+                pool.submit(frame_number, rgb_frame, largest_only=True)
+
+        if pool is not None:
+            for frame_number, face_encodings in pool.completed():
+                if not stop_event.is_set():
+                    accept(frame_number, face_encodings)
+
+    if pool is not None:
+        if stop_event.is_set():
+            pool.clear()
+        else:
+            for frame_number, face_encodings in pool.completed(wait=True):
+                if not stop_event.is_set():
+                    accept(frame_number, face_encodings)
+
+def capture_frames(cam, frame_queue, stop_event, window_title="Classroom Attendance"):
+    """
+    Thread function to keep the queue filled with frames until stopped ('q' in the window stops too).
+
+    A live camera always replaces the queued frame with the latest one; a recorded source
+    waits for the consumer, so every frame it yields is processed, and ends the stream
+    when it runs out.
+    """
+    frame_number = 0
+    try:
+        while not stop_event.is_set():
+            with stage("capture.grab"):
+                ret, frame = cam.read()
+            if not ret:
+                if cam.finished:
+                    break
+                continue
+            frame_number += 1
+            if show_frame(window_title, frame):
+                stop_event.set()
+                break
+            item = (frame_number, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if cam.live:
+                put_latest(frame_queue, item)
+            else:
+                put_waiting(frame_queue, item, stop_event)
+    finally:
+        if cam.live or not put_waiting(frame_queue, END_OF_FRAMES, stop_event):
+            put_latest(frame_queue, END_OF_FRAMES)
 
-        temp_image_path = os.path.join(temp_image_dir, f"temp_face_{i + 1}.jpg")
+def stream_frames(stop_event, queue_size=1, source=None):
+    """
+    Generator for continuous capture.
 
-        if not os.path.exists(temp_image_path):
-            print(f"No image found for encoding {i + 1}, skipping...")
-            capture_event.set()  # Signal the capture thread to proceed
+    Yields (frame_number, rgb_frame) until stop_event is set, 'q' is pressed in
+    the camera window, or a recorded source ends. Camera frames that arrive while the
+    consumer is still busy with a previous one are dropped, so it always works on the
+    current view of the room.
+
+    Args:
+        source (optional): Camera index, video file or image directory (see open_frame_source).
+    """
+    cam = open_frame_source(source)
+    if not cam.isOpened():
+        print("Error: Camera could not be opened." if cam.live else "Error: Frame source could not be opened.")
+        return
+
+    frame_queue = queue.Queue(maxsize=queue_size)
+    capture_thread = threading.Thread(target=capture_frames, args=(cam, frame_queue, stop_event))
+    capture_thread.start()
+    try:
+        while True:
+            item = frame_queue.get()
+            if item is END_OF_FRAMES:
+                break
+            yield item
+    finally:
+        stop_event.set()
+        capture_thread.join()
+        cam.release()
+        close_windows()
+
+def stream_frame_encodings(stop_event, queue_size=1, source=None):
+    """
+    Generator for continuous multi-face capture.
+
+    Yields (frame_number, face_locations, face_encodings) for every frame that
+    contains at least one face, encoding every face of every frame.
+    """
+    for frame_number, rgb_frame in stream_frames(stop_event, queue_size, source):
+        face_locations = detect_face_locations(rgb_frame)
+        if not face_locations:
             continue
+        face_encodings = face_recognition.face_encodings(rgb_frame, known_face_locations=face_locations)
+        yield frame_number, face_locations, np.asarray(face_encodings)
 
-        image = face_recognition.load_image_file(temp_image_path)
-        face_encodings = face_recognition.face_encodings(image)
+def stream_tracked_encodings(stop_event, tracker, queue_size=1, pool=None, source=None):
+    """
+    Generator for continuous multi-face capture that encodes each tracked face once.
 
-        if face_encodings:
-            encodings.append(face_encodings[0])
-            print(f"Captured encoding {i + 1}.")
-        else:
-            print(f"No face found in image {i + 1}, skipping...")
+    Every frame's detections are fed to the FaceTracker, and only the tracks it
+    reports as due (new faces, periodic re-checks, low-confidence retries) are
+    encoded. Yields (frame_number, tracks, face_encodings) with one encoding per
+    track; the caller caches each match with tracker.record_match.
 
-        os.remove(temp_image_path)  # Clean up the processed image
-        capture_event.set()  # Signal the capture thread to proceed
-        time.sleep(1)
+    With an EncodingPool the due faces are encoded by the worker processes while
+    the next frames are being tracked, and results are yielded in frame order. A
+    recorded source waits for a free slot in the pool instead of dropping frames.
+    Submitted tracks stay pending (not due again) until their result is back or the
+    pool drops their frame. Frames still in flight when the stream ends (or is closed
+    early) are discarded, so they never reach the next stream on the same pool.
+    """
+    cam = open_frame_source(source)
+    due_by_frame = {}
+    try:
+        for frame_number, rgb_frame in stream_frames(stop_event, queue_size, cam):
+            due_tracks = tracker.update(frame_number, detect_face_locations(rgb_frame))
+            if due_tracks:
+                boxes = [track.box for track in due_tracks]
+                if pool is None:
+                    face_encodings = face_recognition.face_encodings(rgb_frame, known_face_locations=boxes)
+                    yield frame_number, due_tracks, np.asarray(face_encodings)
+                    continue
+                if not cam.live:
+                    yield from _finished_frames(pool, tracker, due_by_frame, wait=True, keep=pool.max_pending - 1)
+                if pool.submit(frame_number, rgb_frame, face_locations=boxes):
+                    due_by_frame[frame_number] = due_tracks
+                    tracker.mark_pending(due_tracks)
 
-def capture_and_extract_encoding(num_images=5, temp_image_dir="temp_images"):
-    """Main function to handle image capturing and encoding extraction."""
-    if not os.path.exists(temp_image_dir):
-        os.makedirs(temp_image_dir)
+            if pool is not None:
+                yield from _finished_frames(pool, tracker, due_by_frame)
+                # Forget frames the pool dropped under load (or failed to encode); their faces are due again
+                in_flight = pool.pending_ids()
+                for dropped_frame in [f for f in due_by_frame if f not in in_flight]:
+                    _finished(tracker, due_by_frame, dropped_frame)
 
+        if pool is not None:
+            # Finish the faces still being encoded (the tail of a recorded source)
+            yield from _finished_frames(pool, tracker, due_by_frame, wait=True)
+    finally:
+        if pool is not None:
+            pool.clear()
+
+def _finished_frames(pool, tracker, due_by_frame, **kwargs):
+    """Yield (frame_number, tracks, face_encodings) for this stream's finished frames, skipping any other frame."""
+    for done_frame, face_encodings in pool.completed(**kwargs):
+        if done_frame in due_by_frame:
+            yield done_frame, _finished(tracker, due_by_frame, done_frame), face_encodings
+
+def _finished(tracker, due_by_frame, frame_number):
+    """Take a frame's tracks off the in-flight list and make them eligible for encoding again."""
+    tracks = due_by_frame.pop(frame_number)
+    tracker.mark_pending(tracks, False)
+    return tracks
+
+@timed("capture.total")
+def capture_and_extract_encoding(num_images=5, queue_size=2, adaptive=True, min_encodings=2,
+                                 timeout=3.0, early_stop=None, pool=None, source=None):
+    """
+    Main function to handle image capturing and encoding extraction.
+
+    Frames travel from the capture thread to the encoding thread through a bounded
+    in-memory queue, so nothing is written to disk.
+
+    Args:
+        num_images (int): Frames to capture in fixed mode; the most encodings to average in adaptive mode.
+        queue_size (int): Frames buffered between the capture and encoding threads.
+        adaptive (bool): Capture continuously and stop as soon as the encodings are consistent,
+                         instead of capturing num_images frames one second apart.
+        min_encodings (int): Encodings required before the adaptive mode may stop.
+        timeout (float): Hard limit in seconds for the adaptive mode.
+        early_stop (callable, optional): Called with the running mean encoding; returning True ends the capture.
+        pool (EncodingPool, optional): Encode frames in worker processes instead of the encoding thread.
+        source (optional): Camera index, video file or image directory (see open_frame_source).
+
+    Returns:
+        numpy.ndarray: The mean encoding, or None if no face was encoded.
+    """
     encodings = []
-    cam = cv2.VideoCapture(0)
+    cam = open_frame_source(source)
 
     if not cam.isOpened():
-        print("Error: Camera could not be opened.")
+        print("Error: Camera could not be opened." if cam.live else "Error: Frame source could not be opened.")
         return None
 
-    print(f"Capturing {num_images} images...")
+    if adaptive:
+        print("Capturing until a stable face encoding is found...")
+    else:
+        print(f"Capturing {num_images} images...")
 
-    # Events for thread synchronization
-    capture_event = threading.Event()
-    encode_event = threading.Event()
+    frame_queue = queue.Queue(maxsize=queue_size)
     stop_event = threading.Event()
 
     # Threads for capturing images and processing encodings
-    capture_thread = threading.Thread(target=capture_images, args=(cam, num_images, temp_image_dir, capture_event, encode_event, stop_event))
-    encoding_thread = threading.Thread(target=process_encodings, args=(temp_image_dir, num_images, encodings, capture_event, encode_event, stop_event))
+    deadline = time.monotonic() + timeout if adaptive else None
+    capture_thread = threading.Thread(target=capture_images, args=(cam, num_images, frame_queue, stop_event, deadline))
+    encoding_thread = threading.Thread(target=process_encodings, args=(frame_queue, encodings, stop_event),
+                                       kwargs={"adaptive": adaptive, "min_encodings": min_encodings,
+                                               "max_encodings": num_images, "early_stop": early_stop,
+                                               "pool": pool})
 
     capture_thread.start()
     encoding_thread.start()
 
-    capture_event.set()  # Start the capture process
-
     # Wait for both threads to finish
     capture_thread.join()
     encoding_thread.join()
 
     # Cleanup resources
     cam.release()
-    cv2.destroyAllWindows()
+    close_windows()
 
     if not encodings:
         print("No valid encodings captured.")
-        delete_directory(temp_image_dir)
         return None
 
     # Calculate the mean encoding
     mean_encoding = np.mean(encodings, axis=0)
     print("Mean encoding calculated.")
 
-    # Delete the temporary image directory
-    delete_directory(temp_image_dir)
-
-    return mean_encoding
\ No newline at end of file
+    return mean_encoding
@@ -7,8 +7,11 @@ import numpy as np
 import time
 import shutil
 from threading import Thread, Lock
+from encoding_pool import get_encoding_pool
+from frame_sources import close_windows, open_frame_source, show_frame
 
-def capture_and_extract_mean_encoding(num_images=10, save_dir='temp_images', instructions=None, frame_size=(640, 480)):
+def capture_and_extract_mean_encoding(num_images=10, save_dir='temp_images', instructions=None, frame_size=(640, 480),
+                                      source=None):
     """
     Captures images with user instructions, extracts mean face encodings, and cleans up the directory.
     
@@ -39,20 +42,23 @@ def capture_and_extract_mean_encoding(num_images=10, save_dir='temp_images', ins
 
             # Countdown before capture
             for countdown in range(1, 0, -1):
+                if not cam.live:
+                    break
                 print(f"Capturing in {countdown}...")
                 time.sleep(1)
 
             for _ in range(num_images // len(instructions)):  # Distribute images across instructions
                 ret, frame = cam.read()
                 if not ret:
+                    if cam.finished:
+                        return
                     print("Failed to grab frame. Retrying...")
                     continue
 
                 # Show the current frame with instruction
                 cv2.putText(frame, f"Instruction: {instruction}", (10, 30),
                             cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-                cv2.imshow("Capturing Face", frame)
-                cv2.waitKey(1)  # Allow OpenCV to update the window
+                show_frame("Capturing Face", frame)  # Also lets OpenCV update the window
 
                 # Save the image synchronously
                 image_filename = os.path.join(save_dir, f"{instruction.replace(' ', '_')}_{captured_images + 1}.jpg")
@@ -65,31 +71,32 @@ def capture_and_extract_mean_encoding(num_images=10, save_dir='temp_images', ins
                 if captured_images >= num_images:
                     break
 
-                time.sleep(1)  # Pause briefly for the user to reposition
+                if cam.live:
+                    time.sleep(1)  # Pause briefly for the user to reposition
 
     def encode_faces(save_dir, lock, encodings_list):
-        """Extract face encodings from the saved images."""
-        for image_filename in os.listdir(save_dir):
-            image_path = os.path.join(save_dir, image_filename)
-            image = face_recognition.load_image_file(image_path)
+        """Extract face encodings from the saved images, spread across the encoding worker processes."""
+        image_filenames = sorted(os.listdir(save_dir))
+        images = [face_recognition.load_image_file(os.path.join(save_dir, image_filename))
+                  for image_filename in image_filenames]
 
-            # Find face encodings
-            face_encodings = face_recognition.face_encodings(image)
+        for image_filename, face_encodings in zip(image_filenames, get_encoding_pool().map(images)):
             if len(face_encodings) > 0:
                 with lock:
                     encodings_list.append(face_encodings[0])
             else:
                 print(f"No face detected in {image_filename}, skipping...")
 
-    # Initialize camera
-    cam = cv2.VideoCapture(0)
+    # Initialize camera (or the recorded source given instead)
+    cam = open_frame_source(source)
     if not cam.isOpened():
         print("Error: Camera could not be opened.")
         return None
 
     # Set frame size
-    cam.set(cv2.CAP_PROP_FRAME_WIDTH, frame_size[0])
-    cam.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_size[1])
+    if cam.live:
+        cam.set(cv2.CAP_PROP_FRAME_WIDTH, frame_size[0])
+        cam.set(cv2.CAP_PROP_FRAME_HEIGHT, frame_size[1])
 
     # Ensure save directory exists
     if not os.path.exists(save_dir):
@@ -122,7 +129,7 @@ def capture_and_extract_mean_encoding(num_images=10, save_dir='temp_images', ins
 
     # Release the camera and close the window
     cam.release()
-    cv2.destroyAllWindows()
+    close_windows()
 
     # Check if any face encodings were captured
     if not encodings_list:
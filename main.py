@@ -1,4 +1,5 @@
 import logging
+from attendance_writer import start_journal_replayer
 from session_utils import handle_attendance_session
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +26,8 @@ def main_menu():
 
 
 if __name__ == '__main__':
+    # Write marks journaled by an earlier run that never reached the database
+    start_journal_replayer()
     try:
         main_menu()
     except KeyboardInterrupt:
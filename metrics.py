@@ -0,0 +1,225 @@
+
+# ______________________________________________________________PER-STAGE LATENCY METRICS_____________________________________________________________
+#
+# Disabled unless AMS_METRICS=1 (or enable_metrics() is called); while disabled stage()
+# hands back one shared no-op context manager and count() returns immediately.
+#
+#   AMS_METRICS_PORT      serve Prometheus text format on http://0.0.0.0:<port>/metrics
+#   AMS_METRICS_JSON      dump a JSON snapshot to this file every AMS_METRICS_INTERVAL seconds (default 60)
+
+import atexit
+import bisect
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style."""
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.bucket_counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def snapshot(self):
+        cumulative, running = {}, 0
+        for bound, bucket_count in zip(BUCKETS + (float("inf"),), self.bucket_counts):
+            running += bucket_count
+            cumulative["+Inf" if bound == float("inf") else repr(bound)] = running
+        return {"count": self.count, "sum": self.total, "buckets": cumulative}
+
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoOpStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_OP_STAGE = _NoOpStage()
+
+
+def enable_metrics(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def metrics_enabled():
+    return _enabled
+
+
+def stage(name):
+    """
+    Time a block of code into the histogram of a pipeline stage.
+
+    Usage:
+        with stage("match.search"):
+            ...
+    """
+    return _Stage(name) if _enabled else _NO_OP_STAGE
+
+
+def timed(name):
+    """Decorator form of stage() for timing a whole function."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name, seconds):
+    """Record one duration for a stage."""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+def count(event, session_id=None, amount=1):
+    """Increment an event counter (scans, matches, misses, retries, ...), optionally per session."""
+    if not _enabled:
+        return
+    key = (event, None if session_id is None else str(session_id))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def snapshot():
+    """Return every histogram and counter as plain data."""
+    with _lock:
+        return {
+            "stages": {name: histogram.snapshot() for name, histogram in sorted(_histograms.items())},
+            "counters": [{"event": event, "session_id": session_id, "value": value}
+                         for (event, session_id), value in sorted(_counters.items(), key=lambda item: (item[0][0], item[0][1] or ""))],
+        }
+
+
+def render_prometheus():
+    """Render the current metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = ["# HELP ams_stage_seconds Latency of each attendance pipeline stage.",
+             "# TYPE ams_stage_seconds histogram"]
+    for name, histogram in data["stages"].items():
+        for bound, value in histogram["buckets"].items():
+            lines.append(f'ams_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {value}')
+        lines.append(f'ams_stage_seconds_sum{{stage="{name}"}} {histogram["sum"]}')
+        lines.append(f'ams_stage_seconds_count{{stage="{name}"}} {histogram["count"]}')
+
+    lines += ["# HELP ams_events_total Attendance events, per session where applicable.",
+              "# TYPE ams_events_total counter"]
+    for counter in data["counters"]:
+        labels = f'event="{counter["event"]}"'
+        if counter["session_id"] is not None:
+            labels += f',session="{counter["session_id"]}"'
+        lines.append(f"ams_events_total{{{labels}}} {counter['value']}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the application log
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics from a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Metrics available on http://{host}:{port}/metrics")
+    return server
+
+
+def dump_json(path):
+    """Write a snapshot atomically to a JSON file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"timestamp": time.time(), **snapshot()}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def start_json_dump(path, interval=60.0):
+    """Dump a snapshot every `interval` seconds from a daemon thread, and once more at exit."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                dump_json(path)
+            except OSError as e:
+                logging.error(f"Could not write metrics to '{path}': {e}")
+
+    threading.Thread(target=run, name="metrics-json", daemon=True).start()
+    atexit.register(dump_json, path)
+
+
+def configure_from_env():
+    """Apply the AMS_METRICS* environment variables (called on import)."""
+    if os.environ.get("AMS_METRICS", "").lower() not in ("1", "true", "yes"):
+        return
+    enable_metrics()
+    if multiprocessing.current_process().name != "MainProcess":
+        return  # Worker processes record but do not export
+    if os.environ.get("AMS_METRICS_PORT"):
+        try:
+            start_metrics_server(int(os.environ["AMS_METRICS_PORT"]))
+        except OSError as e:
+            logging.error(f"Could not start the metrics server: {e}")
+    if os.environ.get("AMS_METRICS_JSON"):
+        start_json_dump(os.environ["AMS_METRICS_JSON"], float(os.environ.get("AMS_METRICS_INTERVAL", 60)))
+
+
+configure_from_env()
@@ -0,0 +1,101 @@
+
+# ______________________________________________________________MIGRATE PICKLED ENCODINGS TO THE BINARY FORMAT_____________________________________________________________
+
+import argparse
+import logging
+
+import mysql.connector
+import numpy as np
+
+from DBconfig import get_db_connection
+from encoding_format import decode_encoding, encode_encoding, is_binary_encoding
+
+logging.basicConfig(level=logging.INFO)
+
+# Table -> primary key column holding a biometric_data BLOB
+MIGRATION_TABLES = {
+    'students': 'enrollment_id',
+    'teachers': 'teacher_id',
+}
+
+
+def migrate_table(table, id_column, dtype=np.float64, batch_size=500, dry_run=False):
+    """
+    Rewrite every pickled biometric_data value of a table in the binary format.
+
+    Rows are read in primary key order, batch_size at a time, and each batch is
+    written back with a single executemany and commit.
+
+    Args:
+        table (str): Table name ('students' or 'teachers').
+        id_column (str): Primary key column of the table.
+        dtype: Storage precision for the rewritten encodings.
+        batch_size (int): Rows read and updated per round-trip.
+        dry_run (bool): Count the rows that would change without writing them.
+
+    Returns:
+        int: Number of rows converted (or that would be converted in a dry run).
+    """
+    db = get_db_connection()
+    if db is None:
+        logging.error(f"Database connection failed. {table} not migrated.")
+        return 0
+
+    converted = 0
+    last_id = None
+    cursor = None
+    try:
+        cursor = db.cursor()
+        while True:
+            if last_id is None:
+                cursor.execute(f"SELECT {id_column}, biometric_data FROM {table} "
+                               f"WHERE biometric_data IS NOT NULL ORDER BY {id_column} LIMIT %s", (batch_size,))
+            else:
+                cursor.execute(f"SELECT {id_column}, biometric_data FROM {table} "
+                               f"WHERE biometric_data IS NOT NULL AND {id_column} > %s ORDER BY {id_column} LIMIT %s",
+                               (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            updates = []
+            for person_id, blob in rows:
+                if is_binary_encoding(blob):
+                    continue
+                try:
+                    updates.append((encode_encoding(decode_encoding(blob), dtype), person_id))
+                except Exception as e:
+                    logging.error(f"Skipping {table}.{id_column}={person_id}: cannot decode stored encoding: {e}")
+
+            if updates and not dry_run:
+                cursor.executemany(f"UPDATE {table} SET biometric_data = %s WHERE {id_column} = %s", updates)
+                db.commit()
+            converted += len(updates)
+            logging.info(f"{table}: {converted} rows converted so far (last {id_column} {last_id}).")
+
+        return converted
+
+    except mysql.connector.Error as err:
+        logging.error(f"Database error while migrating {table}: {err}")
+        db.rollback()
+        return converted
+    finally:
+        if cursor:
+            cursor.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert pickled biometric_data BLOBs to the binary encoding format.")
+    parser.add_argument('--dtype', choices=['float32', 'float64'], default='float64',
+                        help="Storage precision of the rewritten encodings.")
+    parser.add_argument('--batch-size', type=int, default=500, help="Rows per read/update round-trip.")
+    parser.add_argument('--dry-run', action='store_true', help="Only report how many rows would change.")
+    args = parser.parse_args()
+
+    for table_name, key_column in MIGRATION_TABLES.items():
+        total = migrate_table(table_name, key_column, dtype=np.dtype(args.dtype),
+                              batch_size=args.batch_size, dry_run=args.dry_run)
+        action = "would be converted" if args.dry_run else "converted"
+        print(f"{table_name}: {total} rows {action}.")
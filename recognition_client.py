@@ -0,0 +1,229 @@
+
+# ______________________________________________________________RECOGNITION SERVICE CLIENT_____________________________________________________________
+#
+# With AMS_RECOGNITION_SERVICE set (e.g. "127.0.0.1:8765" or "unix:/run/ams/recognition.sock"),
+# session_utils sends identification, verification and attendance marks to a running
+# `python recognition_service.py` instead of loading galleries and opening database
+# connections of its own. Many classrooms then share one warm gallery and one pool.
+#
+# Protocol: one JSON object per line in each direction. Encodings travel as base64 of
+# their little-endian float64 bytes.
+
+import base64
+import json
+import logging
+import os
+import socket
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from gallery import ENCODING_DIM, MatchResult
+
+RECOGNITION_SERVICE = os.environ.get("AMS_RECOGNITION_SERVICE")
+# Seconds a request may take before the client gives up on the service
+RECOGNITION_TIMEOUT = float(os.environ.get("AMS_RECOGNITION_TIMEOUT", 10))
+
+
+class RecognitionServiceError(Exception):
+    """The recognition service could not be reached or rejected a request."""
+
+
+def parse_address(address):
+    """
+    Split a service address into what socket.connect() expects.
+
+    Returns:
+        tuple: (socket family, address) for "host:port" or "unix:/path".
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def pack_encodings(encodings):
+    """Encode a (n, 128) array (or a single encoding) for the wire."""
+    matrix = np.asarray(encodings, dtype='<f8').reshape(-1, ENCODING_DIM)
+    return base64.b64encode(matrix.tobytes()).decode("ascii")
+
+
+def unpack_encodings(data):
+    """Inverse of pack_encodings: always returns a (n, 128) float64 array."""
+    return np.frombuffer(base64.b64decode(data), dtype='<f8').reshape(-1, ENCODING_DIM)
+
+
+def result_to_dict(result):
+    return {"person_id": result.person_id, "distance": result.distance, "margin": result.margin,
+            "top_k": [[int(person_id), float(distance)] for person_id, distance in result.top_k]}
+
+
+def result_from_dict(data):
+    return MatchResult(data["person_id"], data["distance"], data["margin"],
+                       [(person_id, distance) for person_id, distance in data["top_k"]])
+
+
+class RecognitionClient:
+    """
+    Blocking client of the recognition service.
+
+    Each thread keeps its own connection, opened on first use and reopened once if
+    the service dropped it (e.g. after a restart).
+    """
+
+    def __init__(self, address, timeout=RECOGNITION_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(address)
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        return sock
+
+    def _disconnect(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                self._local.reader.close()
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def request(self, op, **fields):
+        """
+        Send one request and wait for its response.
+
+        Returns:
+            dict: The response fields.
+
+        Raises:
+            RecognitionServiceError: If the service is unreachable or reports an error.
+        """
+        line = (json.dumps(dict(fields, op=op)) + "\n").encode("utf-8")
+        for attempt in (1, 2):
+            try:
+                sock = getattr(self._local, "sock", None) or self._connect()
+                sock.sendall(line)
+                response = self._local.reader.readline()
+                if not response:
+                    raise ConnectionError("connection closed by the recognition service")
+                break
+            except OSError as e:
+                self._disconnect()
+                if attempt == 2:
+                    raise RecognitionServiceError(f"Recognition service at {self.address} unavailable: {e}") from e
+
+        response = json.loads(response)
+        if "error" in response:
+            raise RecognitionServiceError(response["error"])
+        return response
+
+    def identify_batch(self, encodings, person_type="student", session_id=None,
+                       threshold=0.6, k=5) -> List[MatchResult]:
+        """
+        Identify several encodings in one request.
+
+        Args:
+            encodings (array-like): Encodings, one per row.
+            person_type (str): 'student' or 'teacher'.
+            session_id (int, optional): Search this session's roster first (students only).
+            threshold (float): The distance threshold for face recognition comparison.
+            k (int): Candidates returned per encoding.
+
+        Returns:
+            List[MatchResult]: One result per encoding.
+        """
+        if len(encodings) == 0:
+            return []
+        response = self.request("identify", encodings=pack_encodings(encodings), person_type=person_type,
+                                session_id=session_id, threshold=threshold, k=k)
+        return [result_from_dict(result) for result in response["results"]]
+
+    def identify(self, encoding, person_type="student", session_id=None, threshold=0.6, k=5) -> MatchResult:
+        return self.identify_batch(np.asarray(encoding).reshape(1, -1), person_type, session_id, threshold, k)[0]
+
+    def verify(self, encoding, enrollment_id, threshold=0.6) -> bool:
+        """Check a scan against the stored encoding of one student (1:1)."""
+        return self.request("verify", encodings=pack_encodings(encoding), enrollment_id=enrollment_id,
+                            threshold=threshold)["match"]
+
+    def mark(self, session_id, enrollment_id, attendance_status='present', excuse_reason_id=None) -> bool:
+        """Journal an attendance mark in the service's writer of the session (False if the student was already marked)."""
+        return self.request("mark", session_id=session_id, enrollment_id=enrollment_id,
+                            attendance_status=attendance_status, excuse_reason_id=excuse_reason_id).get("added", True)
+
+    def close_writer(self, session_id) -> bool:
+        """
+        Flush and discard the service's writer of a session.
+
+        Returns:
+            bool: False if marks could not be written, True otherwise.
+        """
+        return self.request("close_writer", session_id=session_id)["flushed"]
+
+    def release_session(self, session_id):
+        """Drop the roster gallery the service built for a session."""
+        self.request("release_session", session_id=session_id)
+
+    def gallery(self, person_type="student", session_id=None):
+        return RemoteGallery(self, person_type, session_id)
+
+    def writer(self, session_id):
+        return RemoteAttendanceWriter(self, session_id)
+
+
+class RemoteGallery:
+    """match/match_batch of a gallery held by the recognition service."""
+
+    def __init__(self, client, person_type="student", session_id=None):
+        self.client = client
+        self.person_type = person_type
+        self.session_id = session_id
+
+    def match(self, probe, threshold: float = 0.6, k: int = 5) -> MatchResult:
+        return self.client.identify(probe, self.person_type, self.session_id, threshold, k)
+
+    def match_batch(self, probes, threshold: float = 0.6, k: int = 5) -> List[MatchResult]:
+        return self.client.identify_batch(probes, self.person_type, self.session_id, threshold, k)
+
+
+class RemoteAttendanceWriter:
+    """The AttendanceWriter interface, with the marks queued in the recognition service."""
+
+    def __init__(self, client, session_id):
+        self.client = client
+        self.session_id = session_id
+
+    def mark(self, enrollment_id, attendance_status='present', excuse_reason_id=None):
+        return self.client.mark(self.session_id, enrollment_id, attendance_status, excuse_reason_id)
+
+    def pending_count(self):
+        return 0  # Pending marks live in the service's journal
+
+    def close(self):
+        return self.client.close_writer(self.session_id)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_recognition_client() -> Optional[RecognitionClient]:
+    """Return the process-wide client, or None when AMS_RECOGNITION_SERVICE is not set."""
+    global _client
+    if not RECOGNITION_SERVICE:
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = RecognitionClient(RECOGNITION_SERVICE)
+            logging.info(f"Using the recognition service at {RECOGNITION_SERVICE}.")
+        return _client
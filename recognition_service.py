@@ -0,0 +1,238 @@
+
+# ______________________________________________________________SHARED RECOGNITION SERVICE_____________________________________________________________
+#
+#   python recognition_service.py --listen 127.0.0.1:8765      (or --listen unix:/run/ams/recognition.sock)
+#
+# Holds the student and teacher galleries once for every kiosk of a site and serves
+# identify, verify and attendance-mark requests (protocol in recognition_client.py).
+# Identify requests that arrive within AMS_SERVICE_BATCH_WINDOW_MS of each other for
+# the same gallery are scored in a single matrix product. Kiosks point
+# AMS_RECOGNITION_SERVICE at the same address.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+import numpy as np
+
+from attendance_writer import close_attendance_writer, get_attendance_writer, start_journal_replayer
+from biometric_utils import PERSON_TABLES, get_identification_gallery, get_live_gallery, is_match
+from metrics import count, stage
+from recognition_client import RECOGNITION_SERVICE, parse_address, result_to_dict, unpack_encodings
+from session_utils import ensure_session_gallery, release_session_gallery
+
+# How long the first identify request of a batch waits for others to join it
+BATCH_WINDOW = float(os.environ.get("AMS_SERVICE_BATCH_WINDOW_MS", 2)) / 1000.0
+# Encodings scored per matrix product at most
+MAX_BATCH = 256
+# Longest request line accepted (a classroom frame of encodings is a few hundred KB at most)
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent identify requests against one gallery into match_batch calls.
+
+    The first request to arrive opens a batch; requests arriving in the next `window`
+    seconds (or until `max_batch` encodings are waiting) join it. The batch is scored
+    in the default executor so the event loop keeps accepting requests meanwhile.
+    The batching task ends whenever the queue is empty and submit() starts a new one,
+    so a batcher that is dropped (e.g. when its session is released) leaves nothing running.
+    """
+
+    def __init__(self, resolve_gallery, threshold, k, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.resolve_gallery = resolve_gallery
+        self.threshold = threshold
+        self.k = k
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    async def submit(self, probes):
+        """Queue a (n, 128) array of encodings and wait for their n MatchResults."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((probes, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        # No await between the empty check and returning, so submit() sees either a queued
+        # item picked up here or a finished task it replaces
+        while not self._queue.empty():
+            batch = [self._queue.get_nowait()]
+            waiting = len(batch[0][0])
+            deadline = loop.time() + self.window
+            while waiting < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                waiting += len(item[0])
+
+            probes = np.concatenate([probes for probes, _ in batch])
+            try:
+                results = await loop.run_in_executor(None, self._match, probes)
+            except Exception as e:
+                logging.error(f"Batch of {len(probes)} encodings could not be matched: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            count("service.batches")
+            count("service.encodings", amount=len(probes))
+            start = 0
+            for probes, future in batch:
+                if not future.done():
+                    future.set_result(results[start:start + len(probes)])
+                start += len(probes)
+
+    def _match(self, probes):
+        gallery = self.resolve_gallery()
+        if gallery is None:
+            raise RuntimeError("Gallery could not be loaded.")
+        with stage("service.match_batch"):
+            return gallery.match_batch(probes, threshold=self.threshold, k=self.k)
+
+
+class RecognitionService:
+    """The request handlers, sharing one batcher per (gallery, threshold, k)."""
+
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._batchers = {}
+
+    def _batcher(self, person_type, session_id, threshold, k):
+        key = (person_type, session_id, threshold, k)
+        batcher = self._batchers.get(key)
+        if batcher is None:
+            if session_id is not None:
+                resolve = lambda: ensure_session_gallery(session_id)
+            else:
+                resolve = lambda: get_identification_gallery(person_type)
+            batcher = self._batchers[key] = MicroBatcher(resolve, threshold, k, self.window, self.max_batch)
+        return batcher
+
+    async def identify(self, request):
+        person_type = request.get("person_type", "student")
+        if person_type not in PERSON_TABLES:
+            raise ValueError(f"Unknown person type '{person_type}'.")
+        session_id = request.get("session_id") if person_type == "student" else None
+        batcher = self._batcher(person_type, session_id, float(request.get("threshold", 0.6)), int(request.get("k", 5)))
+        results = await batcher.submit(unpack_encodings(request["encodings"]))
+        return {"results": [result_to_dict(result) for result in results]}
+
+    async def verify(self, request):
+        probe = unpack_encodings(request["encodings"])[0]
+        enrollment_id = int(request["enrollment_id"])
+        threshold = float(request.get("threshold", 0.6))
+
+        # 1:1 against the in-memory copy of the student's encoding; the database only if it is missing.
+        # Resolving the gallery may load or refresh it from MySQL, so it runs off the event loop.
+        loop = asyncio.get_running_loop()
+        gallery = await loop.run_in_executor(None, get_live_gallery, "student")
+        gallery = getattr(gallery, "gallery", gallery)
+        rows = np.flatnonzero(gallery.ids == enrollment_id) if gallery is not None else []
+        if len(rows):
+            distance = float(np.linalg.norm(np.asarray(gallery.matrix[rows[0]], dtype=np.float64) - probe))
+            return {"match": distance <= threshold, "distance": distance}
+        return {"match": await loop.run_in_executor(None, is_match, probe.tobytes(), enrollment_id)}
+
+    async def mark(self, request):
+        added = get_attendance_writer(int(request["session_id"])).mark(
+            int(request["enrollment_id"]), request.get("attendance_status", "present"), request.get("excuse_reason_id"))
+        return {"added": added}
+
+    async def close_writer(self, request):
+        loop = asyncio.get_running_loop()
+        return {"flushed": await loop.run_in_executor(None, close_attendance_writer, int(request["session_id"]))}
+
+    async def release_session(self, request):
+        session_id = int(request["session_id"])
+        release_session_gallery(session_id)
+        for key in [key for key in self._batchers if key[1] == session_id]:
+            del self._batchers[key]
+        return {}
+
+    async def ping(self, request):
+        return {}
+
+    async def handle_connection(self, reader, writer):
+        """Serve the requests of one kiosk connection, one JSON line at a time."""
+        handlers = {"identify": self.identify, "verify": self.verify, "mark": self.mark,
+                    "close_writer": self.close_writer, "release_session": self.release_session, "ping": self.ping}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    handler = handlers.get(request.get("op"))
+                    if handler is None:
+                        raise ValueError(f"Unknown operation '{request.get('op')}'.")
+                    response = await handler(request)
+                except Exception as e:
+                    logging.error(f"Request failed: {e}")
+                    response = {"error": str(e)}
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            logging.warning(f"Connection dropped: {e}")
+        finally:
+            writer.close()
+
+
+async def serve(address, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+    """
+    Load the galleries and serve requests on a TCP or Unix socket address until cancelled.
+
+    Args:
+        address (str): "host:port" or "unix:/path".
+        window (float): Seconds an identify batch stays open for more requests.
+        max_batch (int): Encodings scored per matrix product at most.
+    """
+    # Write marks journaled by an earlier run that never reached the database
+    start_journal_replayer()
+    loop = asyncio.get_running_loop()
+    for person_type in sorted(PERSON_TABLES):
+        gallery = await loop.run_in_executor(None, get_identification_gallery, person_type)
+        print(f"{person_type}: {len(gallery) if gallery is not None else 'no'} encodings loaded.")
+
+    service = RecognitionService(window, max_batch)
+    family, bind_address = parse_address(address)
+    if isinstance(bind_address, str):
+        if os.path.exists(bind_address):
+            os.remove(bind_address)  # Left over from a previous run
+        server = await asyncio.start_unix_server(service.handle_connection, bind_address, limit=MAX_REQUEST_BYTES)
+    else:
+        server = await asyncio.start_server(service.handle_connection, *bind_address, limit=MAX_REQUEST_BYTES)
+    print(f"Recognition service listening on {address}.")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve face identification and attendance marking to many kiosks.")
+    parser.add_argument('--listen', default=RECOGNITION_SERVICE or "127.0.0.1:8765",
+                        help="host:port or unix:/path (default: AMS_RECOGNITION_SERVICE, then 127.0.0.1:8765).")
+    parser.add_argument('--batch-window-ms', type=float, default=BATCH_WINDOW * 1000.0,
+                        help="How long an identify batch waits for concurrent requests.")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help="Encodings scored per matrix product at most.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.listen, args.batch_window_ms / 1000.0, args.max_batch))
+    except KeyboardInterrupt:
+        print("Recognition service stopped.")
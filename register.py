@@ -4,8 +4,10 @@ import re
 from getMeanEncodings import capture_and_extract_mean_encoding
 from mysql.connector import Error, IntegrityError
 from DBconfig import get_db_connection
+from biometric_utils import add_to_ann_index
+from audit_duplicates import find_enrolled_duplicates
 import numpy as np
-import pickle
+from encoding_format import encode_encoding
 
 # Initialize logging
 logging.basicConfig(filename='registration.log', level=logging.INFO, 
@@ -75,7 +77,7 @@ def register_teacher():
                phone_number, address, biometric_data) 
                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
 
-    register_person((teacher_id, first_name, last_name, gender, date_of_birth, email, phone_number, address), query)
+    register_person((teacher_id, first_name, last_name, gender, date_of_birth, email, phone_number, address), query, 'teacher')
 
 # Function to register a student
 def register_student():
@@ -115,10 +117,11 @@ def register_student():
                email, phone_number, address, biometric_data) 
                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
 
-    register_person((enrollment_id, course_id, first_name, last_name, gender, date_of_birth, email, phone_number, address), query)
+    register_person((enrollment_id, course_id, first_name, last_name, gender, date_of_birth, email, phone_number, address), query, 'student')
 
 # Generic function to register a person in the database
-def register_person(fields, query):
+# (fields[0] is the person's ID; person_type keeps the ANN index, if any, up to date)
+def register_person(fields, query, person_type=None):
     print("Please look at the camera for biometric data...")
 
     biometric_data = capture_and_extract_mean_encoding()  # Capture biometric data
@@ -127,9 +130,20 @@ def register_person(fields, query):
         logging.error("Face detection failed. Registration aborted.")
         return
 
-    # Convert biometric data to a pickled format before saving to the database
+    # The same face under another ID would make identification ambiguous
+    duplicates = find_enrolled_duplicates([biometric_data])[0]
+    if duplicates:
+        print("Warning: this face is very similar to already enrolled people:")
+        for duplicate_type, duplicate_id, distance in duplicates:
+            print(f"  {duplicate_type} {duplicate_id} (distance {distance:.3f})")
+        if input("Register anyway? (y/n): ").strip().lower() != 'y':
+            logging.warning(f"Registration of {fields[0]} aborted: face already enrolled as {duplicates[0][0]} {duplicates[0][1]}.")
+            return
+
+    # Convert biometric data to the binary storage format before saving to the database
+    encoding = biometric_data
     if isinstance(biometric_data, np.ndarray):
-        biometric_data = pickle.dumps(biometric_data)  # Pickle the numpy array
+        biometric_data = encode_encoding(biometric_data)
 
     db = get_db_connection()
     if db is None:
@@ -142,6 +156,8 @@ def register_person(fields, query):
             db.commit()
             logging.info("Registered successfully.")
             print("Registration successful!")
+        if person_type:
+            add_to_ann_index(person_type, fields[0], encoding)
     except IntegrityError as e:
         if "Duplicate entry" in str(e):
             logging.error("The provided email or biometric data already exists.")
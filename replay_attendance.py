@@ -0,0 +1,103 @@
+
+# ______________________________________________________________REPLAY RECORDED LECTURES THROUGH CLASSROOM ATTENDANCE_____________________________________________________________
+#
+#   python replay_attendance.py 42 lecture.mp4 [more.mp4 frames_dir/ ...] --frame-skip 2
+#   python replay_attendance.py --manifest lectures.csv      (CSV columns: session_id, source)
+#
+# Runs headless unless AMS_HEADLESS=0 is set explicitly.
+
+import os
+
+os.environ.setdefault("AMS_HEADLESS", "1")
+
+import argparse
+import csv
+import time
+
+from attendance_journal import get_attendance_journal
+from attendance_reports import refresh_session_rollups
+from frame_sources import open_frame_source
+from recognition_client import get_recognition_client
+from session_utils import (build_session_gallery, close_session_writer, load_marked_students, load_session_class,
+                           release_session, run_classroom_mode, session_writer)
+
+
+def replay_session(session_id, sources, frame_skip=0, threshold=0.6):
+    """
+    Mark the attendance of a session from recorded video files or image directories.
+
+    Each source runs through the classroom-mode pipeline (tracking, pooled encoding,
+    roster-first matching) as fast as it can be decoded; students who already have an
+    attendance row in the session are not marked again, except absent ones, which are
+    marked present when found. The rollups of a completed session are recomputed.
+
+    Args:
+        session_id (int): The session the recordings belong to.
+        sources (list): Video file paths and/or image directories.
+        frame_skip (int): Video frames skipped after each processed frame.
+        threshold (float): The distance threshold for face recognition comparison.
+
+    Returns:
+        set: Enrollment IDs newly marked present, or None if the session could not be loaded.
+    """
+    available_class_id = load_session_class(session_id)
+    if available_class_id is None:
+        print(f"Session {session_id} not found.")
+        return None
+    already_marked = load_marked_students(session_id)
+    if already_marked is None:
+        return None
+    already_marked |= get_attendance_journal().marked_students(session_id)  # Not replayed to the database yet
+
+    if get_recognition_client() is None:
+        build_session_gallery(session_id, available_class_id)
+    writer = session_writer(session_id)
+    marked_students = set(already_marked)
+    try:
+        for source in sources:
+            frame_source = open_frame_source(source, frame_skip=frame_skip)
+            started = time.monotonic()
+            run_classroom_mode(session_id, writer, marked_students, threshold, source=frame_source)
+            elapsed = time.monotonic() - started
+            frames = getattr(frame_source, "frames_decoded", None)
+            rate = f", {frames / elapsed:.1f} frames/s" if frames and elapsed > 0 else ""
+            print(f"Session {session_id}: '{source}' replayed in {elapsed:.1f}s{rate}.")
+    finally:
+        flushed = close_session_writer(session_id)
+        release_session(session_id)
+    newly_marked = marked_students - already_marked
+    if newly_marked and flushed:
+        # Reports of a session closed before the replay must count the students found now
+        refresh_session_rollups(session_id)
+    return newly_marked
+
+
+def read_manifest(path):
+    """Group the sources of a manifest CSV (session_id, source) by session, in file order."""
+    sessions = {}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            sessions.setdefault(int(row['session_id']), []).append(row['source'])
+    return sessions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mark attendance from recorded lectures (video files or image directories).")
+    parser.add_argument('session_id', type=int, nargs='?', help="Session the recordings belong to.")
+    parser.add_argument('sources', nargs='*', help="Video files and/or image directories.")
+    parser.add_argument('--manifest', help="CSV with session_id and source columns, to replay many sessions.")
+    parser.add_argument('--frame-skip', type=int, default=0, help="Video frames skipped after each processed frame.")
+    parser.add_argument('--threshold', type=float, default=0.6, help="Face distance threshold.")
+    args = parser.parse_args()
+
+    if args.manifest:
+        replays = read_manifest(args.manifest)
+    elif args.session_id is not None and args.sources:
+        replays = {args.session_id: args.sources}
+    else:
+        parser.error("Give a session ID and at least one source, or --manifest.")
+
+    for replay_session_id, replay_sources in replays.items():
+        newly_marked = replay_session(replay_session_id, replay_sources, args.frame_skip, args.threshold)
+        if newly_marked is not None:
+            print(f"Session {replay_session_id}: {len(newly_marked)} students marked present.")
@@ -1,10 +1,20 @@
 import datetime
 import logging
 from DBconfig import get_db_connection
-from attendances import record_attendance, choose_person_type
-from biometric_utils import find_person_by_biometric
+from attendances import choose_person_type
+from attendance_journal import get_attendance_journal
+from attendance_writer import close_attendance_writer, get_attendance_writer
+from attendance_reports import update_session_rollups
+import threading
+import mysql.connector
+from biometric_utils import find_person_by_biometric, get_live_gallery, load_class_roster_gallery
 from classUtils import select_class
-from getCurrentEncodings import capture_and_extract_encoding
+from encoding_pool import get_encoding_pool
+from face_tracker import FaceTracker
+from gallery import FallbackGallery
+from metrics import count
+from recognition_client import RecognitionServiceError, get_recognition_client
+from getCurrentEncodings import capture_and_extract_encoding, stream_tracked_encodings
 
 # Constants for user prompts
 EXIT_PROMPT = "Press 'Enter' to continue or type 'exit' to finish the session: "
@@ -13,11 +23,341 @@ ATTENDANCE_SUCCESS = "Attendance recorded for {} ID: {}"
 ATTENDANCE_FAIL = "No matching student or teacher found. Please try again."
 FAILED_CAPTURE_PROMPT = "Failed to capture biometric data. Please try again."
 TEACHER_VERIFICATION_FAIL = "Teacher biometric verification failed. Cannot close session."
+CLASSROOM_MODE_PROMPT = "Classroom mode running. Press 'q' in the camera window (or Ctrl+C) to finish scanning."
+
+# Marks every rostered student (the students of the class's course) with no mark in the session as absent
+MARK_ABSENTEES_QUERY = """
+    INSERT IGNORE INTO attendances (session_id, enrollment_id, attendance_status)
+    SELECT ses.session_id, st.enrollment_id, 'absent'
+    FROM sessions ses
+    JOIN availableclasses ac ON ac.available_class_id = ses.available_class_id
+    JOIN students st ON st.course_id = ac.course_id
+    WHERE ses.session_id = %s
+      AND NOT EXISTS (SELECT 1 FROM attendances a
+                      WHERE a.session_id = ses.session_id AND a.enrollment_id = st.enrollment_id)
+"""
+
+# Whether a student is on the roster of a session's class
+ROSTERED_STUDENT_QUERY = """
+    SELECT 1
+    FROM sessions ses
+    JOIN availableclasses ac ON ac.available_class_id = ses.available_class_id
+    JOIN students st ON st.course_id = ac.course_id
+    WHERE ses.session_id = %s AND st.enrollment_id = %s
+"""
 
 def log_attendance(session_id, student_id, status):
     logging.info(f"Session ID: {session_id}, Student ID: {student_id}, Status: {status}")
 
 
+# Session ID -> FallbackGallery (class roster first, every student second)
+_session_galleries = {}
+
+
+def build_session_gallery(session_id, available_class_id):
+    """
+    Build the candidate gallery of a session from the roster of its class.
+
+    Scans are matched against the roster first; the institution-wide live student
+    gallery (which picks up registrations made during the day) is only consulted if a
+    face is not on the roster.
+
+    Returns:
+        FallbackGallery: The session gallery, or None if the roster could not be loaded.
+    """
+    roster = load_class_roster_gallery(available_class_id)
+    if roster is None:
+        logging.error(f"Roster of class {available_class_id} could not be loaded. Session {session_id} will search all students.")
+        return None
+
+    logging.info(f"Session {session_id}: {len(roster)} rostered students loaded.")
+    gallery = FallbackGallery(roster, lambda: get_live_gallery("student"))
+    _session_galleries[session_id] = gallery
+    return gallery
+
+
+def get_session_gallery(session_id):
+    """Return the session's roster-first gallery, or the global student gallery if it has none."""
+    gallery = _session_galleries.get(session_id)
+    if gallery is None:
+        gallery = get_live_gallery("student")
+    return gallery
+
+
+def release_session_gallery(session_id):
+    _session_galleries.pop(session_id, None)
+
+
+def load_session_class(session_id):
+    """Return the available_class_id of a session, or None if the session does not exist."""
+    db = get_db_connection()
+    if db is None:
+        logging.error("Database connection failed.")
+        return None
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT available_class_id FROM sessions WHERE session_id = %s", (session_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+    except mysql.connector.Error as e:
+        logging.error(f"Error while loading session {session_id}: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def is_rostered_student(session_id, enrollment_id):
+    """
+    Check a typed enrollment ID against the roster of the session's class.
+
+    Returns:
+        Optional[bool]: None if the database could not be queried.
+    """
+    db = get_db_connection()
+    if db is None:
+        logging.error("Database connection failed.")
+        return None
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(ROSTERED_STUDENT_QUERY, (session_id, enrollment_id))
+            return cursor.fetchone() is not None
+    except mysql.connector.Error as e:
+        logging.error(f"Error while checking the roster of session {session_id}: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def load_marked_students(session_id):
+    """Enrollment IDs that already have an attendance row in the session, other than as absent."""
+    db = get_db_connection()
+    if db is None:
+        logging.error("Database connection failed.")
+        return None
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT enrollment_id FROM attendances WHERE session_id = %s AND attendance_status <> 'absent'",
+                           (session_id,))
+            return {enrollment_id for enrollment_id, in cursor.fetchall()}
+    except mysql.connector.Error as e:
+        logging.error(f"Error while loading the attendance of session {session_id}: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def resume_open_session(teacher_id):
+    """
+    Offer the teacher the sessions they started that were never closed (e.g. the
+    application was restarted mid-lecture), as recorded in the attendance journal.
+
+    Returns:
+        tuple: (session_id, marked_students) of the session to continue, or (None, None) to start a new one.
+    """
+    journal = get_attendance_journal()
+    for session_id, available_class_id, _, opened_at in journal.open_sessions(teacher_id):
+        choice = input(f"Session {session_id} started at {opened_at} was not closed. "
+                       f"Resume it? (y = resume / n = new / c = close it): ").strip().lower()
+        if choice == 'y':
+            if get_recognition_client() is None:
+                build_session_gallery(session_id, available_class_id)
+            # Marks still waiting in the journal and marks already in the database
+            marked_students = journal.marked_students(session_id) | (load_marked_students(session_id) or set())
+            print(f"Session {session_id} resumed with {len(marked_students)} students already marked.")
+            return session_id, marked_students
+        if choice == 'c':
+            close_attendance_session(session_id)  # The teacher has just been verified
+    return None, None
+
+
+def ensure_session_gallery(session_id):
+    """
+    Return the session's roster-first gallery, building it from the session's class on first use.
+
+    Used where sessions are created elsewhere (the recognition service).
+    """
+    gallery = _session_galleries.get(session_id)
+    if gallery is None:
+        available_class_id = load_session_class(session_id)
+        if available_class_id is not None:
+            gallery = build_session_gallery(session_id, available_class_id)
+    return gallery if gallery is not None else get_live_gallery("student")
+
+
+# With AMS_RECOGNITION_SERVICE set, galleries and attendance writers live in the shared
+# recognition service (recognition_service.py) and the helpers below forward to it.
+
+def find_person(biometric_data, person_type, threshold=0.6):
+    """
+    find_person_by_biometric, answered by the recognition service when one is configured.
+
+    Returns:
+        Optional[int]: The ID of the matching person, or None if not found.
+    """
+    client = get_recognition_client()
+    if client is None:
+        return find_person_by_biometric(biometric_data, person_type, threshold)
+    try:
+        result = client.identify(biometric_data, person_type, threshold=threshold)
+    except RecognitionServiceError as e:
+        logging.error(f"Identification failed: {e}")
+        return None
+    return result.person_id
+
+
+def session_writer(session_id):
+    """Return the attendance writer of a session (local, or a proxy of the service's writer)."""
+    client = get_recognition_client()
+    return client.writer(session_id) if client is not None else get_attendance_writer(session_id)
+
+
+def mark_student(writer, session_id, enrollment_id, attendance_status='present', excuse_reason_id=None):
+    """
+    Mark a student through the session's writer.
+
+    A mark the recognition service cannot take (timeout, restart, error) is journaled
+    by this process instead and replayed to the database from here.
+
+    Returns:
+        bool: False if the student already had a mark in the session.
+    """
+    try:
+        return writer.mark(enrollment_id, attendance_status, excuse_reason_id)
+    except RecognitionServiceError as e:
+        logging.error(f"Recognition service did not take the mark of student {enrollment_id} ({e}). Journaled locally.")
+        return get_attendance_writer(session_id).mark(enrollment_id, attendance_status, excuse_reason_id)
+
+
+def close_session_writer(session_id):
+    """
+    Flush and discard the attendance writer of a session.
+
+    Returns:
+        bool: False if marks could not be written, True otherwise.
+    """
+    client = get_recognition_client()
+    if client is None:
+        return close_attendance_writer(session_id)
+    # Marks the service could not take were journaled here (see mark_student)
+    flushed = close_attendance_writer(session_id)
+    try:
+        return client.close_writer(session_id) and flushed
+    except RecognitionServiceError as e:
+        logging.error(f"Attendance marks of session {session_id} could not be flushed: {e}")
+        return False
+
+
+def release_session(session_id):
+    """Drop the session's roster gallery, wherever it is held."""
+    client = get_recognition_client()
+    if client is None:
+        release_session_gallery(session_id)
+        return
+    try:
+        client.release_session(session_id)
+    except RecognitionServiceError as e:
+        logging.warning(f"Session {session_id} could not be released by the recognition service: {e}")
+
+
+def identify_student(session_id, biometric_data, threshold=0.6):
+    """
+    Identify a scanned student, searching the session roster before everyone else.
+
+    Returns:
+        Optional[int]: The enrollment ID, or None if not found.
+    """
+    client = get_recognition_client()
+    if client is not None:
+        try:
+            result = client.identify(biometric_data, "student", session_id, threshold)
+        except RecognitionServiceError as e:
+            logging.error(f"Identification failed: {e}")
+            return None
+        return result.person_id
+
+    gallery = _session_galleries.get(session_id)
+    if gallery is None:
+        return find_person_by_biometric(biometric_data, "student", threshold)
+
+    result = gallery.match(biometric_data, threshold=threshold)
+    if result.matched:
+        logging.info(f"Student found with ID: {result.person_id} (distance {result.distance:.3f})")
+        return result.person_id
+    logging.info("No matching student found with the provided biometric data.")
+    return None
+
+
+def choose_scan_mode():
+    """
+    Ask the teacher how students should be scanned.
+
+    Returns:
+        str: 'individual' (one student per scan) or 'classroom' (every face in view, continuously).
+    """
+    while True:
+        print("Please choose the scanning mode:")
+        print("1. Individual (one student at a time)")
+        print("2. Classroom (camera pointed at the room)")
+
+        choice = input("Enter your choice (1 or 2): ").strip()
+
+        if choice == '1':
+            return 'individual'
+        elif choice == '2':
+            return 'classroom'
+        else:
+            print("Invalid choice, please select 1 for Individual or 2 for Classroom.")
+
+
+def run_classroom_mode(session_id, writer, marked_students, threshold=0.6, source=None):
+    """
+    Mark every recognized face in each frame until the teacher ends the scan.
+
+    The session's roster-first gallery is used for every frame, faces are tracked across frames so each
+    one is encoded when it first appears (and re-checked only periodically), and
+    all faces due in a frame are matched in a single matrix operation.
+
+    Args:
+        session_id (int): The current session ID.
+        writer (AttendanceWriter): Writer of the current session.
+        marked_students (set): Enrollment IDs already marked in this session; updated in place.
+        threshold (float): The distance threshold for face recognition comparison.
+        source (optional): Camera index, video file or image directory to scan (see open_frame_source).
+    """
+    client = get_recognition_client()
+    gallery = client.gallery("student", session_id) if client is not None else get_session_gallery(session_id)
+    if gallery is None:
+        print("No enrolled students could be loaded. Classroom mode unavailable.")
+        return
+
+    print(CLASSROOM_MODE_PROMPT)
+    stop_event = threading.Event()
+    tracker = FaceTracker()
+    try:
+        for frame_number, tracks, face_encodings in stream_tracked_encodings(stop_event, tracker, pool=get_encoding_pool(),
+                                                                                 source=source):
+            try:
+                results = gallery.match_batch(face_encodings, threshold=threshold)
+            except RecognitionServiceError as e:
+                # The tracks have no match yet, so they are encoded and sent again on a later frame
+                logging.error(f"Faces of frame {frame_number} could not be identified: {e}")
+                count("retries", session_id)
+                continue
+            for track, result in zip(tracks, results):
+                tracker.record_match(track, result, frame_number)
+                count("scans", session_id)
+                count("matches" if result.matched else "misses", session_id)
+                if result.matched and result.person_id not in marked_students:
+                    mark_student(writer, session_id, result.person_id, attendance_status="present")
+                    marked_students.add(result.person_id)
+                    print(ATTENDANCE_SUCCESS.format("Student", result.person_id))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+    print(f"Classroom scan finished. {len(marked_students)} students marked present.")
+
+
 
 
 # handle attendance session function
@@ -39,6 +379,7 @@ def handle_attendance_session():
         biometric_data = capture_and_extract_encoding()
         if biometric_data is None:
             print(FAILED_CAPTURE_PROMPT)
+            count("retries")
             attempts += 1
             if attempts >= max_attempts:
                 print("Failed to capture biometric data multiple times. Exiting session.")
@@ -50,42 +391,54 @@ def handle_attendance_session():
         print("Failed to capture biometric data. Exiting session.")
         return
 
-    teacher_id = find_person_by_biometric(biometric_data, "teacher")
+    teacher_id = find_person(biometric_data, "teacher")
     if not teacher_id:
         print("Teacher verification failed. Cannot initiate the session.")
         return
 
-    # Select the class for the session
-    selected_class = select_class(teacher_id)
-    if not selected_class:
-        print("Error: No class selected. Cannot start the session.")
-        return
-
-    print(f"Teacher verified successfully. Starting the attendance session for {selected_class['subject_code']} - {selected_class['subject_name']}...")
-
-    # Create the session
-    session_id = create_attendance_session(selected_class)
-    if not session_id:
-        print("Error: Failed to create the attendance session.")
+    # Continue a session left open by an earlier run, or start a new one
+    session_id, marked_students = resume_open_session(teacher_id)
+    if session_id is None:
+        # Select the class for the session
+        selected_class = select_class(teacher_id)
+        if not selected_class:
+            print("Error: No class selected. Cannot start the session.")
+            return
+
+        print(f"Teacher verified successfully. Starting the attendance session for {selected_class['subject_code']} - {selected_class['subject_name']}...")
+
+        # Create the session
+        session_id = create_attendance_session(selected_class)
+        if not session_id:
+            print("Error: Failed to create the attendance session.")
+            return
+
+        print("Session started successfully. Please begin scanning students for attendance.\n")
+        marked_students = set()  # Track students already marked
+
+    writer = session_writer(session_id)  # Marks are journaled locally and written in batches
+
+    if choose_scan_mode() == 'classroom':
+        run_classroom_mode(session_id, writer, marked_students)
+        handle_close_session(session_id)
+        close_session_writer(session_id)  # Flush even if the session could not be closed
+        print(SESSION_END_PROMPT)
         return
 
-    print("Session started successfully. Please begin scanning students for attendance.\n")
-    
-    marked_students = set()  # Track students already marked
     while True:
-        biometric_data = capture_and_extract_encoding()
+        biometric_data = capture_and_extract_encoding(pool=get_encoding_pool())
         if biometric_data is None:
             print(FAILED_CAPTURE_PROMPT)
+            count("retries", session_id)
             continue
 
-        enrollment_id = find_person_by_biometric(biometric_data, "student")
+        enrollment_id = identify_student(session_id, biometric_data)
+        count("scans", session_id)
+        count("matches" if enrollment_id else "misses", session_id)
         if enrollment_id:
             if enrollment_id not in marked_students: 
-                # Use the updated record_attendance function
-                record_attendance(session_id=session_id, 
-                                  enrollment_id=enrollment_id, 
-                                  biometric_data=biometric_data, 
-                                  attendance_status="present")
+                # The gallery match already verified the student, so queue the mark directly
+                mark_student(writer, session_id, enrollment_id, attendance_status="present")
                 marked_students.add(enrollment_id)  # Add to marked list
                 print(ATTENDANCE_SUCCESS.format("Student", enrollment_id))
             else:
@@ -94,13 +447,13 @@ def handle_attendance_session():
             print("Student not found. Marking as absent.")
             absent_student_id = input("Enter Enrollment ID to mark absent (or press Enter to skip): ").strip()
             if absent_student_id:
-                if absent_student_id.isdigit():
+                # Unchecked when the database is down: a mark MySQL refuses is set aside on replay
+                if absent_student_id.isdigit() and is_rostered_student(session_id, int(absent_student_id)) is False:
+                    print(f"Enrollment ID {absent_student_id} is not on this class's roster. Skipping.")
+                elif absent_student_id.isdigit():
                     confirm = input(f"Are you sure you want to mark student {absent_student_id} as absent? (y/n): ").strip().lower()
                     if confirm == 'y':
-                        record_attendance(session_id=session_id, 
-                                          enrollment_id=int(absent_student_id), 
-                                          biometric_data=None, 
-                                          attendance_status="absent")
+                        mark_student(writer, session_id, int(absent_student_id), attendance_status="absent")
                         print(f"Attendance marked as absent for Enrollment ID: {absent_student_id}")
                     else:
                         print("Absent marking canceled.")
@@ -113,6 +466,7 @@ def handle_attendance_session():
         exit_choice = input(EXIT_PROMPT).lower()
         if exit_choice == 'exit':
             handle_close_session(session_id)
+            close_session_writer(session_id)  # Flush even if the session could not be closed
             print("Session successfully ended. All attendance has been recorded.")
             print(SESSION_END_PROMPT)
             break
@@ -127,7 +481,7 @@ def handle_close_session(session_id):
     biometric_data = capture_and_extract_encoding()  # No parameters passed
 
     if biometric_data is not None and biometric_data.size > 0:
-        teacher_verified = find_person_by_biometric(biometric_data, person_type)
+        teacher_verified = find_person(biometric_data, person_type)
         if teacher_verified:
             close_attendance_session(session_id)  # Pass the session ID to close it
         else:
@@ -142,9 +496,17 @@ def close_attendance_session(session_id):
     """
     Close an ongoing attendance session.
 
+    Every rostered student without a mark is marked absent, and the rollups are
+    updated, in the transaction that completes the session.
+
     Args:
         session_id (int): The ID of the session to close.
     """
+    # Write any queued attendance marks before the session is marked completed
+    if not close_session_writer(session_id):
+        logging.error("Queued attendance marks could not be written. Attendance session not closed.")
+        return
+
     db = get_db_connection()
     if db is None:
         logging.error("Database connection failed. Attendance session not closed.")
@@ -154,11 +516,18 @@ def close_attendance_session(session_id):
         with db.cursor() as cursor:
             query = """UPDATE sessions SET status = 'completed', end_time = %s WHERE session_id = %s"""
             cursor.execute(query, (datetime.datetime.now(), session_id))
+            cursor.execute(MARK_ABSENTEES_QUERY, (session_id,))
+            logging.info(f"Session {session_id}: {cursor.rowcount} students marked absent.")
+            update_session_rollups(cursor, session_id)  # Reports see the session once it is completed
             db.commit()
             logging.info(f"Attendance session with ID {session_id} closed successfully.")
+        get_attendance_journal().close_session(session_id)
+        release_session(session_id)
     except Exception as e:
         logging.error(f"Error while closing attendance session: {e}")
         db.rollback()
+    finally:
+        db.close()  # Return the connection to the pool
 
 
 
@@ -180,11 +549,23 @@ def create_attendance_session(selected_class):
                                    'ongoing'))
             db.commit()
             logging.info("Attendance session created successfully.")
-            return cursor.lastrowid  # Get the ID of the newly created session
+            session_id = cursor.lastrowid  # Get the ID of the newly created session
+
+        # Remembered locally so the session can be resumed if the application restarts
+        get_attendance_journal().open_session(session_id, selected_class['available_class_id'],
+                                              selected_class['teacher_id'])
+
+        # Match students of this class first; fall back to every student only on a miss
+        # (the recognition service, if one is used, builds it on the session's first scan)
+        if get_recognition_client() is None:
+            build_session_gallery(session_id, selected_class['available_class_id'])
+        return session_id
 
     except Exception as e:
         logging.error(f"Error while creating attendance session: {e}")
         db.rollback()
         return None
+    finally:
+        db.close()  # Return the connection to the pool
 
 
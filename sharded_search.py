@@ -0,0 +1,126 @@
+
+# ______________________________________________________________SHARDED EXACT SEARCH_____________________________________________________________
+#
+# With AMS_SEARCH_SHARDS=<n> (or "auto" for one shard per core), 1:N identification
+# splits the gallery into n contiguous row ranges and scores them on a thread pool.
+# NumPy releases the GIL inside the matrix products, so the shards run on separate cores.
+# Each shard keeps its own closest candidates and the lists are merged, so the result is
+# exactly the one a single full search gives. Cap the BLAS threads
+# (e.g. OPENBLAS_NUM_THREADS=1) so the shards do not compete with BLAS for the same cores.
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+
+from gallery import MatchResult, rank_candidates
+
+
+def _shard_count_from_env():
+    value = os.environ.get("AMS_SEARCH_SHARDS", "").strip().lower()
+    if not value:
+        return None
+    if value == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(value))
+
+
+SEARCH_SHARDS = _shard_count_from_env()
+# Galleries smaller than this many rows per shard are searched in fewer shards
+MIN_SHARD_ROWS = 4096
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_search_executor() -> ThreadPoolExecutor:
+    """The process-wide thread pool the shards run on (one thread per core)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="search-shard")
+        return _executor
+
+
+def _search_shard(matrix, sq_norms, start, stop, probes, probe_norms, keep):
+    """
+    Squared distances from every probe to its `keep` closest rows of matrix[start:stop].
+
+    Returns:
+        tuple: (rows, squared distances), both (len(probes), keep) with gallery-wide row numbers.
+    """
+    sq = sq_norms[None, start:stop] + probe_norms[:, None] - 2.0 * (probes @ matrix[start:stop].T)
+    if keep < stop - start:
+        nearest = np.argpartition(sq, keep - 1, axis=1)[:, :keep]
+        return nearest + start, np.take_along_axis(sq, nearest, axis=1)
+    return np.broadcast_to(np.arange(start, stop), sq.shape), sq
+
+
+class ShardedGallery:
+    """
+    Exact 1:N search over a gallery split into shards that are searched in parallel.
+
+    `source` may be a Gallery or anything holding one in a `gallery` attribute
+    (LiveGallery, SharedGallery); the current gallery is read on every call, so
+    refreshes are picked up.
+    """
+
+    def __init__(self, source, shards=None, executor=None, min_shard_rows=MIN_SHARD_ROWS):
+        self.source = source
+        self.shards = shards or SEARCH_SHARDS or os.cpu_count() or 1
+        self.min_shard_rows = min_shard_rows
+        self._executor = executor
+
+    @property
+    def gallery(self):
+        return getattr(self.source, "gallery", self.source)
+
+    def __len__(self):
+        return len(self.gallery)
+
+    def shard_bounds(self, n_rows):
+        """(start, stop) row ranges of the shards for a gallery of n_rows."""
+        shards = max(1, min(self.shards, n_rows // max(self.min_shard_rows, 1)))
+        bounds = np.linspace(0, n_rows, shards + 1).astype(np.int64)
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    def match(self, probe, threshold: float = 0.6, k: int = 5) -> MatchResult:
+        return self.match_batch(np.asarray(probe).reshape(1, -1), threshold, k)[0]
+
+    def match_batch(self, probes, threshold: float = 0.6, k: int = 5) -> List[MatchResult]:
+        """
+        Identify one or more probes (e.g. every face of a frame) against all shards.
+
+        Args:
+            probes (array-like): Face encodings, one per row.
+            threshold (float): Distances at or above this value are not a match.
+            k (int): Number of closest candidates to report per probe.
+
+        Returns:
+            List[MatchResult]: One result per probe, identical to Gallery.match_batch.
+        """
+        gallery = self.gallery
+        if len(probes) == 0:
+            return []
+        if gallery is None or len(gallery) == 0:
+            return [MatchResult(None, float('inf'), float('inf')) for _ in range(len(probes))]
+
+        matrix, sq_norms = gallery.matrix, gallery.sq_norms
+        probes = np.asarray(probes, dtype=matrix.dtype).reshape(-1, matrix.shape[1])
+        probe_norms = np.einsum('ij,ij->i', probes, probes)
+        keep = max(k, 2)  # The runner-up is needed for the margin even when k is 1
+
+        bounds = self.shard_bounds(len(gallery))
+        if len(bounds) == 1:
+            shard_results = [_search_shard(matrix, sq_norms, 0, len(gallery), probes, probe_norms, keep)]
+        else:
+            executor = self._executor or get_search_executor()
+            futures = [executor.submit(_search_shard, matrix, sq_norms, start, stop, probes, probe_norms, keep)
+                       for start, stop in bounds]
+            shard_results = [future.result() for future in futures]
+
+        rows = np.concatenate([shard_rows for shard_rows, _ in shard_results], axis=1)
+        distances = np.sqrt(np.maximum(np.concatenate([sq for _, sq in shard_results], axis=1), 0.0))
+        return [rank_candidates(gallery.ids[rows[i]], distances[i], threshold, k) for i in range(len(probes))]
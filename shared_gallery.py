@@ -0,0 +1,343 @@
+
+# ______________________________________________________________SHARED-MEMORY GALLERY FOR MULTI-PROCESS WORKERS_____________________________________________________________
+#
+#   python shared_gallery.py [student] [teacher] --interval 5
+#
+# One loader process keeps each gallery in a multiprocessing.shared_memory segment;
+# processes started with AMS_SHARED_GALLERY=1 attach to it read-only instead of
+# decoding their own copy, so memory does not grow with the number of workers.
+#
+#   <prefix>-<type>-<generation>   header, person IDs, squared norms, encoding matrix
+#   <prefix>-<type>-current        (sequence, generation) of the segment to read
+#
+# A new generation is written in full before the pointer is swapped to it (a
+# sequence lock: the sequence is odd while the pointer is being written). Readers
+# therefore see either the old or the new gallery, never a half-written one.
+# A publisher that shuts down sets CLOSED_BIT in the pointer before removing it;
+# readers then attach to the pointer of the next publisher when one starts.
+
+import logging
+import os
+import struct
+import threading
+import time
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from gallery import Gallery
+
+SHARED_GALLERY = os.environ.get("AMS_SHARED_GALLERY", "").lower() in ("1", "true", "yes")
+SHARED_GALLERY_PREFIX = os.environ.get("AMS_SHARED_GALLERY_PREFIX", "ams")
+
+# magic, rows, columns, dtype string
+_HEADER = struct.Struct("<8sQQ8s")
+_MAGIC = b"AMSGAL01"
+# Arrays start on cache-line boundaries
+_ALIGN = 64
+# Set in the published generation by a publisher that has shut down
+CLOSED_BIT = 1 << 63
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def _segment_name(prefix, person_type, generation):
+    return f"{prefix}-{person_type}-{generation}"
+
+
+def _pointer_name(prefix, person_type):
+    return f"{prefix}-{person_type}-current"
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _layout(rows, columns, dtype):
+    """Byte offsets of the ids, norms and matrix arrays, and the total segment size."""
+    ids_offset = _aligned(_HEADER.size)
+    norms_offset = _aligned(ids_offset + rows * 8)
+    matrix_offset = _aligned(norms_offset + rows * dtype.itemsize)
+    return ids_offset, norms_offset, matrix_offset, max(matrix_offset + rows * columns * dtype.itemsize, 1)
+
+
+def _attach(name):
+    """
+    Attach to an existing segment without registering it with the resource tracker
+    (before Python 3.13 the tracker unlinks every attached segment when the process exits,
+    and unregistering afterwards would also drop the publisher's registration when both
+    processes share a tracker).
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _read_generation(pointer):
+    """
+    Read the published generation under the sequence lock (0 if nothing was published yet;
+    CLOSED_BIT is set if the publisher has shut down).
+    """
+    while True:
+        sequence = int(pointer[0])
+        if sequence % 2 == 0:
+            generation = int(pointer[1])
+            if int(pointer[0]) == sequence:
+                return generation
+        time.sleep(0)
+
+
+class SharedGalleryPublisher:
+    """Writes generations of one person type's gallery and swaps readers over to them."""
+
+    def __init__(self, person_type, prefix=SHARED_GALLERY_PREFIX):
+        self.person_type = person_type
+        self.prefix = prefix
+        try:
+            self._pointer_segment = shared_memory.SharedMemory(name=_pointer_name(prefix, person_type), create=True, size=16)
+            self._pointer = np.ndarray((2,), dtype=np.uint64, buffer=self._pointer_segment.buf)
+            self._pointer[:] = 0
+        except FileExistsError:
+            # Left by an earlier publisher: continue its generations so readers notice the swap
+            self._pointer_segment = shared_memory.SharedMemory(name=_pointer_name(prefix, person_type))
+            self._pointer = np.ndarray((2,), dtype=np.uint64, buffer=self._pointer_segment.buf)
+        self.generation = _read_generation(self._pointer) & ~CLOSED_BIT
+        self._segment = None
+
+    def publish(self, gallery):
+        """
+        Copy a gallery into a new segment and make it the current generation.
+
+        Returns:
+            int: The new generation.
+        """
+        ids, matrix, norms = gallery.ids, gallery.matrix, gallery.sq_norms
+        rows, columns = matrix.shape
+        ids_offset, norms_offset, matrix_offset, size = _layout(rows, columns, matrix.dtype)
+
+        generation = self.generation + 1
+        segment = shared_memory.SharedMemory(name=_segment_name(self.prefix, self.person_type, generation),
+                                             create=True, size=size)
+        _HEADER.pack_into(segment.buf, 0, _MAGIC, rows, columns, matrix.dtype.str.encode("ascii"))
+        np.ndarray((rows,), dtype=np.int64, buffer=segment.buf, offset=ids_offset)[:] = ids
+        np.ndarray((rows,), dtype=matrix.dtype, buffer=segment.buf, offset=norms_offset)[:] = norms
+        np.ndarray((rows, columns), dtype=matrix.dtype, buffer=segment.buf, offset=matrix_offset)[:] = matrix
+
+        self._set_pointer(generation)
+
+        previous, self._segment, self.generation = self._segment, segment, generation
+        if previous is not None:
+            # Readers still attached keep their mapping; new readers can no longer open it
+            previous.close()
+            previous.unlink()
+        elif generation > 1:
+            self._unlink_orphan(generation - 1)
+        logging.info(f"Shared {self.person_type} gallery generation {generation} published ({rows} encodings).")
+        return generation
+
+    def _set_pointer(self, generation):
+        self._pointer[0] += 1  # Odd: readers wait
+        self._pointer[1] = generation
+        self._pointer[0] += 1
+
+    def _unlink_orphan(self, generation):
+        try:
+            orphan = shared_memory.SharedMemory(name=_segment_name(self.prefix, self.person_type, generation))
+        except FileNotFoundError:
+            return
+        orphan.close()
+        orphan.unlink()
+
+    def close(self):
+        """
+        Remove the current generation and the pointer. Attached readers keep what they
+        mapped and switch to the pointer of the next publisher once it starts.
+        """
+        self._set_pointer(self.generation | CLOSED_BIT)
+        if self._segment is not None:
+            self._segment.close()
+            self._segment.unlink()
+            self._segment = None
+        del self._pointer
+        self._pointer_segment.close()
+        self._pointer_segment.unlink()
+
+
+class SharedGallery:
+    """
+    A gallery published by another process, attached read-only without copying.
+
+    Every access checks the published generation and attaches to a newer one when it
+    appears, so it is used like a LiveGallery. Matches in progress keep the gallery
+    they started with, and an old generation stays mapped until nothing uses it.
+    When the publisher shuts down, the last gallery is kept and the pointer is attached
+    again by name until a restarted publisher provides one.
+    """
+
+    def __init__(self, person_type, prefix=SHARED_GALLERY_PREFIX):
+        self.person_type = person_type
+        self.prefix = prefix
+        self._pointer_segment = _attach(_pointer_name(prefix, person_type))
+        self._pointer = np.ndarray((2,), dtype=np.uint64, buffer=self._pointer_segment.buf)
+        self._retired_pointers = []
+        self._publisher_closed = False
+        self._generation = None
+        self._gallery = None
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def gallery(self) -> Gallery:
+        """The current generation's gallery (None if nothing has been published yet)."""
+        generation = _read_generation(self._pointer)
+        if generation & CLOSED_BIT:
+            with self._lock:
+                generation = self._reattach_pointer()
+        if generation != self._generation:
+            with self._lock:
+                self._switch(generation)
+        return self._gallery
+
+    def _reattach_pointer(self):
+        """Attach to the pointer of a restarted publisher, if there is one; return the generation to read."""
+        generation = _read_generation(self._pointer)
+        if not generation & CLOSED_BIT:
+            return generation  # Another thread re-attached already
+        if not self._publisher_closed:
+            self._publisher_closed = True
+            logging.warning(f"Shared {self.person_type} gallery publisher stopped. Serving generation "
+                            f"{self._generation} until it is restarted.")
+        try:
+            segment = _attach(_pointer_name(self.prefix, self.person_type))
+        except FileNotFoundError:
+            return self._generation
+        pointer = np.ndarray((2,), dtype=np.uint64, buffer=segment.buf)
+        generation = _read_generation(pointer)
+        if generation & CLOSED_BIT:
+            segment.close()  # The same closed pointer (still there where it cannot be unlinked)
+            return self._generation
+        # Other threads may still read the old pointer: it stays mapped
+        self._retired_pointers.append(self._pointer_segment)
+        self._pointer_segment, self._pointer = segment, pointer
+        self._publisher_closed = False
+        logging.info(f"Shared {self.person_type} gallery publisher restarted.")
+        # Generation numbers may be reused by the new publisher, so any generation is new
+        self._generation = None
+        return generation
+
+    def _switch(self, generation):
+        while generation != self._generation and generation != 0 and not generation & CLOSED_BIT:
+            try:
+                segment = _attach(_segment_name(self.prefix, self.person_type, generation))
+            except FileNotFoundError:
+                # Superseded between reading the pointer and attaching: read it again
+                generation = _read_generation(self._pointer)
+                continue
+
+            magic, rows, columns, dtype = _HEADER.unpack_from(segment.buf, 0)
+            if magic != _MAGIC:
+                segment.close()
+                raise ValueError(f"Shared memory segment of generation {generation} is not a gallery.")
+            dtype = np.dtype(dtype.rstrip(b"\0").decode("ascii"))
+            ids_offset, norms_offset, matrix_offset, size = _layout(rows, columns, dtype)
+
+            # Every array is a view of one read-only root array; the segment is unmapped only
+            # once the root (and so every view a match may still hold) has been collected
+            root = np.ndarray((size,), dtype=np.uint8, buffer=segment.buf)
+            root.flags.writeable = False
+            weakref.finalize(root, segment.close)
+            ids = root[ids_offset:ids_offset + rows * 8].view(np.int64)
+            norms = root[norms_offset:norms_offset + rows * dtype.itemsize].view(dtype)
+            matrix = root[matrix_offset:matrix_offset + rows * columns * dtype.itemsize].view(dtype).reshape(rows, columns)
+
+            self._gallery = Gallery(ids, matrix, dtype=dtype, sq_norms=norms)
+            self._generation = generation
+
+    def __len__(self):
+        gallery = self.gallery
+        return len(gallery) if gallery is not None else 0
+
+    def match(self, probe, threshold: float = 0.6, k: int = 5):
+        return self.gallery.match(probe, threshold, k)
+
+    def match_batch(self, probes, threshold: float = 0.6, k: int = 5):
+        return self.gallery.match_batch(probes, threshold, k)
+
+
+def attach_shared_gallery(person_type, prefix=SHARED_GALLERY_PREFIX):
+    """
+    Return the process-wide SharedGallery of a person type.
+
+    Returns:
+        Optional[SharedGallery]: None if no loader has published that gallery yet.
+    """
+    with _readers_lock:
+        reader = _readers.get((prefix, person_type))
+        if reader is None:
+            try:
+                reader = SharedGallery(person_type, prefix)
+            except FileNotFoundError:
+                return None
+            if reader.gallery is None:
+                return None
+            _readers[(prefix, person_type)] = reader
+        return reader
+
+
+def run_publisher(person_types, interval=5.0, prefix=SHARED_GALLERY_PREFIX, stop_event=None):
+    """
+    Publish the galleries and republish each one whenever its live gallery changes.
+
+    Args:
+        person_types (list): 'student' and/or 'teacher'.
+        interval (float): Seconds between checks for changes.
+        prefix (str): Segment name prefix.
+        stop_event (threading.Event, optional): Stops the loop when set; runs until interrupted otherwise.
+    """
+    from biometric_utils import get_live_gallery
+
+    stop_event = stop_event or threading.Event()
+    publishers = {person_type: SharedGalleryPublisher(person_type, prefix) for person_type in person_types}
+    published = {}
+    try:
+        while True:
+            for person_type, publisher in publishers.items():
+                live = get_live_gallery(person_type, attach_shared=False)
+                gallery = getattr(live, "gallery", live)
+                if gallery is not None and gallery is not published.get(person_type):
+                    publisher.publish(gallery)
+                    published[person_type] = gallery
+            if stop_event.wait(interval):
+                break
+    finally:
+        for publisher in publishers.values():
+            publisher.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    from biometric_utils import PERSON_TABLES
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Publish the galleries in shared memory for processes run with AMS_SHARED_GALLERY=1.")
+    parser.add_argument('person_types', nargs='*', choices=sorted(PERSON_TABLES), default=sorted(PERSON_TABLES))
+    parser.add_argument('--interval', type=float, default=5.0, help="Seconds between checks for gallery changes.")
+    parser.add_argument('--prefix', default=SHARED_GALLERY_PREFIX, help="Shared memory segment name prefix.")
+    args = parser.parse_args()
+
+    try:
+        run_publisher(args.person_types, args.interval, args.prefix)
+    except KeyboardInterrupt:
+        print("Shared galleries removed.")
@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("numpy")
+
+import attendance_writer
+from attendance_journal import AttendanceJournal
+from benchmarks.synthetic import StandInDatabase, synthetic_gallery
+
+SESSION_ID = 1  # The session StandInDatabase creates
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    database = StandInDatabase(*synthetic_gallery(10), directory=str(tmp_path))
+    monkeypatch.setattr(attendance_writer, "get_db_connection", database.get_connection)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = AttendanceJournal(str(tmp_path / "journal.sqlite3"))
+    yield journal
+    journal.close()
+
+
+def stored_marks(database):
+    connection = sqlite3.connect(database.path)
+    try:
+        return dict(connection.execute("SELECT enrollment_id, attendance_status FROM attendances WHERE session_id = ?",
+                                       (SESSION_ID,)))
+    finally:
+        connection.close()
+
+
+def test_replay_sets_aside_a_mark_the_database_refuses(database, journal):
+    journal.append(SESSION_ID, 5)
+    journal.append(SESSION_ID, 999, 'absent')  # No such student: fails the foreign key
+    journal.append(SESSION_ID, 6)
+
+    assert attendance_writer.replay_journal(journal)
+    assert stored_marks(database) == {5: 'present', 6: 'present'}
+    assert journal.pending_count() == 0
+    assert journal._execute("SELECT enrollment_id FROM marks WHERE replayed = -1") == [(999,)]
+
+    # Later marks are not held back by the refused one
+    journal.append(SESSION_ID, 7)
+    assert attendance_writer.replay_journal(journal)
+    assert stored_marks(database)[7] == 'present'
+
+
+def test_replay_upgrades_an_absent_mark(database, journal):
+    journal.append(SESSION_ID, 3, 'absent')
+    journal.append(SESSION_ID, 4)
+    assert attendance_writer.replay_journal(journal)
+
+    journal.append(SESSION_ID, 3)
+    journal.append(SESSION_ID, 4, 'absent')
+    assert attendance_writer.replay_journal(journal)
+    assert stored_marks(database) == {3: 'present', 4: 'present'}